@@ -1,39 +1,82 @@
-from openai import OpenAI
+import asyncio
 import json
-from tools import tools, handle_tool_call
+import re
+import time
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from tools import tools, describe_tools, unit_of_work, ToolExecutor
+from context import ContextManager
+from cache import ResponseCache
+from llm_client import shared_client
+from metrics import NULL_METRICS, JsonLinesSink, Metrics, TurnStats, log, set_verbose
+from config import get_config
+from guard import FINAL_TOOL_CHOICE, LoopGuard, fallback_response, force_final_messages
+from tool_selection import ToolSelector
+
+
+def __getattr__(name):
+    # The openai SDK takes most of the import time, agent.OpenAI imports it on first use
+    if name in ("OpenAI", "AsyncOpenAI"):
+        import openai
+        globals()[name] = getattr(openai, name)
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _openai(name):
+    return globals().get(name) or __getattr__(name)
 
-CONFIG = json.load(open('config.json'))
-API_KEY = CONFIG["api_key"]
-MODEL = CONFIG["model"]
 
 class Agent:
-    def __init__(self):
-        self.client = OpenAI(
-            api_key=API_KEY, 
-            base_url=CONFIG["base_url"]  # Usa il base_url dal config
-        )
+    def __init__(self, max_tool_workers=8, parallel_safe_tools=None, stream=False, context_manager=None,
+                 response_cache=None, metrics=None, config=None, loop_guard=None, tool_selector=None):
+        # config.json and environment variables, keys of config override them
+        self.config = {**get_config(), **(config or {})}
+        self.model = self.config.get("model")
+        # Caps on iterations, time and tokens, repeated read-only calls are memoized
+        self.loop_guard = loop_guard or LoopGuard(**self.config.get("loop_guard", {}))
+        # Opt-in: stage the task writes of an iteration and commit them in a single write
+        self.group_commit = self.config.get("group_commit", False)
+        # Optional ToolSelector sending only the tools relevant to the request
+        if tool_selector is None and self.config.get("tool_selection"):
+            tool_selector = ToolSelector(**self.config["tool_selection"])
+        self.tool_selector = tool_selector
+        # Metrics receiving llm_call, tool_call and turn events, disabled by default
+        self.metrics = metrics or NULL_METRICS
+        # TurnStats of the last process_conversation call
+        self.last_turn = None
+        # Optional ResponseCache answering identical requests without an API call
+        self.response_cache = response_cache
+        # Optional ContextManager that keeps messages under a token budget
+        self.context_manager = context_manager
+        # Stream completions: final_response content reaches the caller while it is
+        # generated and tool calls start as soon as their arguments are complete
+        self.stream = stream
+        # Tool calls of the same turn run concurrently, use 1 to run them one by one
+        self.tool_executor = ToolExecutor(max_workers=max_tool_workers, parallel_safe=parallel_safe_tools,
+                                          metrics=self.metrics)
+        # Created on first use, see the client property
+        self._client = None
         self.system_prompt = {
             "role": "system",
-            "content": """
+            "content": f"""
             You are an autonomous assistant that executes tasks directly using available tools. When receiving requests:
             1. Analyze the request and determine if tools are needed
             2. Execute necessary tools automatically without asking for confirmation
             3. ALWAYS use final_response tool to deliver the final answer
             
             Available tools:
-            - get_weather: Get weather conditions
-            - schedule_task: Schedule tasks using cron expressions
-            - list_all_tasks: Get markdown formatted list of all tasks
-            - delete_task_by_objective: Delete tasks containing specific text
+{describe_tools(indent='            ')}
             
             For scheduling tasks:
             - If cron expression is not provided, use default "0 9 * * 1-5" (weekdays at 9am)
             - If objectives are not fully specified, make reasonable assumptions
             - Use schedule_task tool with format:
-            {
+            {{
                 "cron_expression": "the_cron_expression",
                 "objectives": ["objective1", "objective2"]
-            }
+            }}
             
             Guidelines:
             1. Execute tasks immediately without asking for confirmation
@@ -44,84 +87,545 @@ class Agent:
             """
         }
 
-    def send_messages(self, messages):
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self.create_client()
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def create_client(self):
+        # Shared by every Agent of the process: pooled connections, one rate limiter, retries
+        return shared_client(
+            _openai("OpenAI"),
+            api_key=self.config.get("api_key"), 
+            base_url=self.config.get("base_url"),  # Usa il base_url dal config
+            **self.config.get("rate_limits", {})
+        )
+
+    def send_messages(self, messages, stats=None, tool_choice=None, selection=None):
+        schemas = selection.schemas if selection else tools
+        cache_key, cached = self.cache_lookup(messages, schemas)
+        if cached:
+            self.record_llm_call(stats, 0.0, None, cached=True)
+            return cached
+        started = time.perf_counter()
+        extra = {"tool_choice": tool_choice} if tool_choice else {}
         response = self.client.chat.completions.create(
-            model=MODEL,
+            model=self.model,
             messages=messages,
-            tools=tools
+            tools=schemas,
+            **extra
         )
+        self.record_llm_call(stats, time.perf_counter() - started, response.usage, selection=selection)
+        if cache_key:
+            self.response_cache.put(cache_key, response.choices[0].message)
         return response.choices[0].message
 
-    def process_conversation(self, messages):
+    def record_llm_call(self, stats, latency, usage, cached=False, selection=None):
+        tokens_saved = selection.tokens_saved if selection else 0
+        if stats is not None:
+            stats.llm_calls += 1
+            stats.cache_hits += cached
+            stats.tool_tokens_saved += tokens_saved
+            stats.add_usage(usage)
+        self.metrics.emit(
+            "llm_call", latency=latency, cached=cached, tool_tokens_saved=tokens_saved,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0
+        )
+
+    def finish_turn(self, stats, final_response, guard=None):
+        if guard is not None:
+            stats.memo_hits = guard.memo_hits
+        self.last_turn = stats.finish()
+        self.metrics.emit("turn", **stats.as_dict())
+        return final_response
+
+    def select_tools(self, messages):
+        """ToolSelection of this turn, None sends every tool"""
+        if self.tool_selector is None:
+            return None
+        selection = self.tool_selector.select(messages)
+        log(f"Tools sent: {', '.join(sorted(selection.names))} (~{selection.tokens_saved} tokens saved)")
+        return selection
+
+    def widen_selection(self, selection, response, stats):
+        """The model called a tool that was not sent: send all of them for the rest of the turn"""
+        left_out = selection.left_out(response.tool_calls) if selection else None
+        if left_out:
+            log(f"Tools left out were called ({', '.join(left_out)}), sending every tool")
+            selection.widen()
+            stats.tool_fallbacks += 1
+
+    def unit_of_work(self):
+        return unit_of_work() if self.group_commit else nullcontext()
+
+    def stop_reason(self, guard, stats):
+        reason = guard.check(stats)
+        if reason:
+            log(f"\n=== Loop guard: {reason}, forcing final_response ===")
+            stats.stopped = reason
+            stats.iterations += 1
+        return reason
+
+    def forced_final(self, response, reason, messages, on_final_delta):
+        final_response = get_final_response(response) or response.content or fallback_response(reason, messages)
+        if self.stream and on_final_delta:
+            on_final_delta(final_response)
+        messages.append({"role": "assistant", "content": final_response})
+        return final_response
+
+    def cache_lookup(self, messages, schemas=tools):
+        """Return (cache key, cached message), both None when caching does not apply"""
+        if not self.response_cache:
+            return None, None
+        cache_key = self.response_cache.key(self.model, messages, schemas)
+        if cache_key is None:
+            return None, None
+        return cache_key, self.response_cache.get(cache_key)
+
+    def summarize(self, messages):
+        """Summarize dropped messages, can be used as ContextManager summarize callable"""
+        transcript = "\n".join(
+            f"{m['role']}: {m.get('content') or json.dumps(m.get('tool_calls'))}" for m in messages
+        )
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": "Summarize this conversation in a few sentences, keep names, dates, cron expressions and results."},
+                {"role": "user", "content": transcript}
+            ]
+        )
+        return response.choices[0].message.content
+
+    def send_messages_stream(self, messages, batch, on_final_delta=None, stats=None, selection=None):
+        """Stream a completion, returns the assembled message and the futures of its tool calls"""
+        schemas = selection.schemas if selection else tools
+        cache_key, cached = self.cache_lookup(messages, schemas)
+        if cached:
+            self.record_llm_call(stats, 0.0, None, cached=True)
+            return replay_cached(cached, batch, on_final_delta)
+        started = time.perf_counter()
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            tools=schemas,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        accumulator = StreamAccumulator(batch, on_final_delta)
+        for chunk in stream:
+            accumulator.add_chunk(chunk)
+        message, futures = accumulator.finish()
+        self.record_llm_call(stats, time.perf_counter() - started, accumulator.usage, selection=selection)
+        if cache_key:
+            self.response_cache.put(cache_key, message)
+        return message, futures
+
+    def process_conversation(self, messages, on_final_delta=None):
+        stats = TurnStats()
+        guard = self.loop_guard.start(self.tool_executor.parallel_safe)
+        selection = self.select_tools(messages)
         final_response = None
-        iteration = 1
         
         while True:
-            print(f"\n=== Conversation iteration {iteration} ===")
-            response = self.send_messages(messages)
-            
-            if response.content:
-                print(f"Assistant initial response: {response.content}")
-            
-            # Check for final_response tool call first
-            if response.tool_calls:
-                for tool_call in response.tool_calls:
-                    if tool_call.function.name == "final_response":
-                        final_args = json.loads(tool_call.function.arguments)
-                        final_response = final_args['content']
-                        # Add only the final response to messages
-                        messages.append({
-                            "role": "assistant",
-                            "content": final_response
-                        })
-                        return final_response
+            reason = self.stop_reason(guard, stats)
+            if reason:
+                response = self.send_messages(force_final_messages(messages, reason), stats, FINAL_TOOL_CHOICE,
+                                              selection)
+                final_response = self.forced_final(response, reason, messages, on_final_delta)
+                return self.finish_turn(stats, final_response, guard)
+
+            stats.iterations += 1
+            log(f"\n=== Conversation iteration {stats.iterations} ===")
+            if self.context_manager:
+                self.context_manager.compact(messages)
+            # Task writes of this iteration are committed together when it ends
+            with self.unit_of_work():
+                tool_futures = None
+                if self.stream:
+                    response, tool_futures = self.send_messages_stream(
+                        messages, self.tool_executor.batch(guard.memo), on_final_delta, stats, selection)
+                else:
+                    response = self.send_messages(messages, stats, selection=selection)
+                self.widen_selection(selection, response, stats)
             
-            # Store the assistant's message
-            assistant_message = {
-                "role": "assistant",
-                "content": response.content
-            }
+                if response.content:
+                    log(f"Assistant initial response: {response.content}")
             
-            if response.tool_calls:
-                assistant_message["tool_calls"] = [
-                    {
-                        "id": tc.id,
-                        "type": tc.type,
-                        "function": {
-                            "name": tc.function.name,
-                            "arguments": tc.function.arguments
-                        }
-                    }
-                    for tc in response.tool_calls
-                ]
+                # Check for final_response tool call first
+                final_response = get_final_response(response)
+                if final_response is not None:
+                    # Streamed calls of the same message must finish inside the unit of work
+                    wait(tool_futures or [])
+                    # Add only the final response to messages
+                    messages.append({
+                        "role": "assistant",
+                        "content": final_response
+                    })
+                    return self.finish_turn(stats, final_response, guard)
             
-            messages.append(assistant_message)
+                # Store the assistant's message
+                messages.append(build_assistant_message(response))
             
-            if not response.tool_calls:
-                final_response = response.content
-                break
+                if not response.tool_calls:
+                    final_response = response.content
+                    break
                 
-            # Process other tool calls
-            for tool_call in response.tool_calls:
-                tool_result = handle_tool_call(tool_call)
-                messages.append({
-                    "role": "tool",
-                    "name": tool_call.function.name,
-                    "content": tool_result,
-                    "tool_call_id": tool_call.id
-                })
-                print(f"Tool result: {tool_result}")
+                guard.observe(response.tool_calls)
+                # Process other tool calls, results keep the tool_call_id order
+                if tool_futures is None:
+                    tool_results = self.tool_executor.map(response.tool_calls, guard.memo)
+                else:
+                    tool_results = [future.result() for future in tool_futures]
+                append_tool_results(messages, response.tool_calls, tool_results)
             
-            iteration += 1
+                stats.tool_calls += len(response.tool_calls)
                 
-        return final_response
+        return self.finish_turn(stats, final_response, guard)
+
+
+class AsyncAgent(Agent):
+    """Asyncio version of Agent, many conversations can share one event loop"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Tools block: they never run on the event loop, one worker keeps max_tool_workers=1 sequential
+        if self.tool_executor.pool is None:
+            self.tool_executor.pool = ThreadPoolExecutor(max_workers=1)
+
+    @Agent.client.getter
+    def client(self):
+        # Not kept: the shared client of the event loop running now
+        return self._client if self._client is not None else self.create_client()
+
+    def create_client(self):
+        return shared_client(_openai("AsyncOpenAI"), api_key=self.config.get("api_key"),
+                             base_url=self.config.get("base_url"), asynchronous=True,
+                             **self.config.get("rate_limits", {}))
+
+    async def send_messages(self, messages, stats=None, tool_choice=None, selection=None):
+        schemas = selection.schemas if selection else tools
+        cache_key, cached = self.cache_lookup(messages, schemas)
+        if cached:
+            self.record_llm_call(stats, 0.0, None, cached=True)
+            return cached
+        started = time.perf_counter()
+        extra = {"tool_choice": tool_choice} if tool_choice else {}
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            tools=schemas,
+            **extra
+        )
+        self.record_llm_call(stats, time.perf_counter() - started, response.usage, selection=selection)
+        if cache_key:
+            self.response_cache.put(cache_key, response.choices[0].message)
+        return response.choices[0].message
+
+    async def send_messages_stream(self, messages, batch, on_final_delta=None, stats=None, selection=None):
+        schemas = selection.schemas if selection else tools
+        cache_key, cached = self.cache_lookup(messages, schemas)
+        if cached:
+            self.record_llm_call(stats, 0.0, None, cached=True)
+            return replay_cached(cached, batch, on_final_delta)
+        started = time.perf_counter()
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            tools=schemas,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        accumulator = StreamAccumulator(batch, on_final_delta)
+        async for chunk in stream:
+            accumulator.add_chunk(chunk)
+        message, futures = accumulator.finish()
+        self.record_llm_call(stats, time.perf_counter() - started, accumulator.usage, selection=selection)
+        if cache_key:
+            self.response_cache.put(cache_key, message)
+        return message, futures
+
+    async def process_conversation(self, messages, on_final_delta=None):
+        stats = TurnStats()
+        guard = self.loop_guard.start(self.tool_executor.parallel_safe)
+        selection = self.select_tools(messages)
+        final_response = None
+
+        while True:
+            reason = self.stop_reason(guard, stats)
+            if reason:
+                response = await self.send_messages(force_final_messages(messages, reason), stats,
+                                                    FINAL_TOOL_CHOICE, selection)
+                final_response = self.forced_final(response, reason, messages, on_final_delta)
+                return self.finish_turn(stats, final_response, guard)
+
+            stats.iterations += 1
+            log(f"\n=== Conversation iteration {stats.iterations} ===")
+            if self.context_manager:
+                self.context_manager.compact(messages)
+            # Task writes of this iteration are committed together when it ends
+            with self.unit_of_work():
+                tool_futures = None
+                if self.stream:
+                    response, tool_futures = await self.send_messages_stream(
+                        messages, self.tool_executor.batch(guard.memo), on_final_delta, stats, selection)
+                else:
+                    response = await self.send_messages(messages, stats, selection=selection)
+                self.widen_selection(selection, response, stats)
+
+                if response.content:
+                    log(f"Assistant initial response: {response.content}")
+
+                final_response = get_final_response(response)
+                if final_response is not None:
+                    await asyncio.gather(*[asyncio.wrap_future(f) for f in tool_futures or []],
+                                         return_exceptions=True)
+                    messages.append({
+                        "role": "assistant",
+                        "content": final_response
+                    })
+                    return self.finish_turn(stats, final_response, guard)
+
+                messages.append(build_assistant_message(response))
+
+                if not response.tool_calls:
+                    final_response = response.content
+                    break
+
+                guard.observe(response.tool_calls)
+                # Tools are blocking, await their futures without holding a loop thread
+                if tool_futures is not None:
+                    tool_results = await asyncio.gather(*[asyncio.wrap_future(f) for f in tool_futures])
+                else:
+                    batch = self.tool_executor.batch(guard.memo)
+                    tool_results = await asyncio.gather(*[
+                        asyncio.wrap_future(batch.submit(tool_call)) for tool_call in response.tool_calls
+                    ])
+                append_tool_results(messages, response.tool_calls, tool_results)
+
+                stats.tool_calls += len(response.tool_calls)
+
+        return self.finish_turn(stats, final_response, guard)
+
+
+class StreamAccumulator:
+    """Builds an assistant message from streamed deltas
+
+    A tool call is complete once the next one starts or the stream ends. A
+    parallel-safe one is then submitted to the batch, calls with side effects
+    and the ones after them wait for the end of the message: like without
+    streaming, they do not run when it also calls final_response. The content
+    argument of final_response is forwarded to on_final_delta while it is
+    still being generated.
+    """
+    def __init__(self, batch, on_final_delta=None):
+        self.batch = batch
+        self.on_final_delta = on_final_delta
+        self.content = []
+        self.tool_calls = []
+        self.futures = []
+        self.deferred = False
+        self.final_content = None
+        self.usage = None
+
+    def add_chunk(self, chunk):
+        # With include_usage the last chunk has no choices, only usage
+        if getattr(chunk, "usage", None):
+            self.usage = chunk.usage
+        if chunk.choices:
+            self.add(chunk.choices[0].delta)
+
+    def add(self, delta):
+        if delta.content:
+            self.content.append(delta.content)
+
+        for tc in delta.tool_calls or []:
+            while tc.index >= len(self.tool_calls):
+                self._complete_last()
+                self.tool_calls.append(SimpleNamespace(
+                    id=None, type="function",
+                    function=SimpleNamespace(name="", arguments="")
+                ))
+            tool_call = self.tool_calls[tc.index]
+            if tc.id:
+                tool_call.id = tc.id
+            if tc.function is None:
+                continue
+            if tc.function.name:
+                tool_call.function.name += tc.function.name
+                if tool_call.function.name == "final_response" and self.on_final_delta:
+                    self.final_content = JsonStringField("content", self.on_final_delta)
+            if tc.function.arguments:
+                tool_call.function.arguments += tc.function.arguments
+                if tool_call.function.name == "final_response" and self.final_content:
+                    self.final_content.feed(tc.function.arguments)
+
+    def _complete_last(self):
+        if len(self.futures) == len(self.tool_calls):
+            return
+        tool_call = self.tool_calls[-1]
+        if tool_call.function.name == "final_response":
+            self.futures.append(None)
+        elif self.deferred or tool_call.function.name not in self.batch.executor.parallel_safe:
+            # Started in finish(), in order, once the message has no final_response
+            self.deferred = True
+            self.futures.append(None)
+        else:
+            self.futures.append(self.batch.submit(tool_call))
+
+    def finish(self):
+        self._complete_last()
+        message = SimpleNamespace(
+            role="assistant",
+            content="".join(self.content) or None,
+            tool_calls=self.tool_calls or None
+        )
+        final = any(tool_call.function.name == "final_response" for tool_call in self.tool_calls)
+        futures = []
+        for tool_call, future in zip(self.tool_calls, self.futures):
+            if future is None and not final and tool_call.function.name != "final_response":
+                future = self.batch.submit(tool_call)
+            if future is not None:
+                futures.append(future)
+        return message, futures
+
+
+def replay_cached(message, batch, on_final_delta=None):
+    """Streaming result of a cached message: tools are started, final content is emitted at once
+
+    As without streaming, the other tool calls of a message with final_response do not run.
+    """
+    futures = []
+    final = any(tool_call.function.name == "final_response" for tool_call in message.tool_calls or [])
+    for tool_call in message.tool_calls or []:
+        if tool_call.function.name != "final_response":
+            if not final:
+                futures.append(batch.submit(tool_call))
+        elif on_final_delta:
+            on_final_delta(json.loads(tool_call.function.arguments)["content"])
+    return message, futures
+
+
+class JsonStringField:
+    """Decodes one string field of a JSON object that arrives in fragments"""
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self, field, callback):
+        self.key = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self.callback = callback
+        self.buffer = ""
+        self.position = None
+        self.done = False
+
+    def feed(self, fragment):
+        self.buffer += fragment
+        if self.done:
+            return
+        if self.position is None:
+            match = self.key.search(self.buffer)
+            if not match:
+                return
+            self.position = match.end()
+
+        decoded = []
+        buffer, i = self.buffer, self.position
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.done = True
+                break
+            if char != '\\':
+                decoded.append(char)
+                i += 1
+                continue
+            if i + 1 >= len(buffer):
+                break
+            if buffer[i + 1] != 'u':
+                decoded.append(self.ESCAPES.get(buffer[i + 1], buffer[i + 1]))
+                i += 2
+                continue
+            # \uXXXX, a high surrogate needs its low half before decoding
+            if i + 6 > len(buffer):
+                break
+            size = 12 if 0xD800 <= int(buffer[i + 2:i + 6], 16) <= 0xDBFF else 6
+            if i + size > len(buffer):
+                break
+            decoded.append(json.loads(f'"{buffer[i:i + size]}"'))
+            i += size
+        self.position = i
+
+        if decoded:
+            self.callback("".join(decoded))
+
+
+def get_final_response(response):
+    """Return the content of the final_response tool call, if the model made one"""
+    for tool_call in response.tool_calls or []:
+        if tool_call.function.name == "final_response":
+            final_args = json.loads(tool_call.function.arguments)
+            return final_args['content']
+    return None
+
+def build_assistant_message(response):
+    assistant_message = {
+        "role": "assistant",
+        "content": response.content
+    }
+    
+    if response.tool_calls:
+        assistant_message["tool_calls"] = [
+            {
+                "id": tc.id,
+                "type": tc.type,
+                "function": {
+                    "name": tc.function.name,
+                    "arguments": tc.function.arguments
+                }
+            }
+            for tc in response.tool_calls
+        ]
+    return assistant_message
+
+def append_tool_results(messages, tool_calls, tool_results):
+    for tool_call, tool_result in zip(tool_calls, tool_results):
+        messages.append({
+            "role": "tool",
+            "name": tool_call.function.name,
+            "content": tool_result,
+            "tool_call_id": tool_call.id
+        })
+        log(f"Tool result: {tool_result}")
 
 # Example usage
 if __name__ == "__main__":
-    agent = Agent()
-    messages = [agent.system_prompt]
+    import argparse
+    import uuid
+    from session_log import SessionLog
+
+    parser = argparse.ArgumentParser(description="Chat with the agent")
+    parser.add_argument("--session", help="id of a previous session to resume")
+    args = parser.parse_args()
+
+    CONFIG = get_config()
+    set_verbose(CONFIG.get("verbose", True))
+    metrics = Metrics([JsonLinesSink(CONFIG["metrics_file"])]) if CONFIG.get("metrics_file") else None
+    agent = Agent(stream=CONFIG.get("stream", False), metrics=metrics)
+    if CONFIG.get("max_context_tokens"):
+        agent.context_manager = ContextManager(
+            max_tokens=CONFIG["max_context_tokens"],
+            summarize=agent.summarize if CONFIG.get("summarize_context") else None
+        )
+    if CONFIG.get("response_cache"):
+        agent.response_cache = ResponseCache(directory=CONFIG.get("response_cache_dir"))
+    session_log = SessionLog(**CONFIG.get("session_log", {}))
+    session_id = args.session or uuid.uuid4().hex
     
     print("\n=== AI Assistant ===")
+    print(f"Session {session_id}, resume it with --session {session_id}")
     print("Type 'exit' to quit\n")
     
     while True:
@@ -129,11 +633,30 @@ if __name__ == "__main__":
         if user_input.lower() == 'exit':
             break
             
+        # Only the recent messages are loaded, the whole conversation is in the session log
+        size = session_log.size(session_id)
+        messages = session_log.load(session_id, agent.system_prompt)
         messages.append({"role": "user", "content": user_input})
         print("\n=== Processing... ===")
-        result = agent.process_conversation(messages)
+        streamed = []
+
+        def print_delta(text):
+            if not streamed:
+                print("\nAssistant: ", end="")
+            streamed.append(text)
+            print(text, end="", flush=True)
+
+        try:
+            result = agent.process_conversation(messages, on_final_delta=print_delta)
+        except BaseException:
+            session_log.rollback(session_id, size)
+            raise
+        finally:
+            session_log.release(session_id)
         
-        print(f"\nAssistant: {result}")
-        messages.append({"role": "assistant", "content": result})
+        if streamed:
+            print()
+        else:
+            print(f"\nAssistant: {result}")
         
     print("\nGoodbye!")
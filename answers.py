@@ -0,0 +1,117 @@
+import re
+from fractions import Fraction
+
+# The few-shot prompts end every solution with "The answer is: N"
+ANSWER_MARKER = re.compile(r"(?:final\s+answer|the\s+answer)\s*(?:is|=|:)\s*:?", re.IGNORECASE)
+
+NUMBER_WORDS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+    "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15,
+    "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19, "twenty": 20,
+}
+
+# A number with its unit: "$1,234.50", "-3", "1 1/2", "3/4", "50%", "2.5 hours", "five apples"
+NUMBER = re.compile(
+    r"(?P<sign>-)?\s*(?P<currency>[$€£])?\s*(?:"
+    r"(?P<whole>\d+)\s+(?P<mixed_num>\d+)/(?P<mixed_den>\d+)"
+    r"|(?P<num>\d+)/(?P<den>\d+)"
+    r"|(?P<decimal>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d*\.\d+|\d+)"
+    r"|\b(?P<word>" + "|".join(NUMBER_WORDS) + r")\b"
+    r")\s*(?P<percent>%|percent\b)?\s*(?P<unit>[a-z]+)?",
+    re.IGNORECASE,
+)
+
+SCALES = {"dozen": 12, "hundred": 100, "thousand": 1000, "million": 10 ** 6, "billion": 10 ** 9}
+
+CURRENCY_WORDS = {"dollar", "dollars", "euro", "euros", "pound", "pounds", "usd", "eur"}
+
+# Words after a number that are not its unit
+NOT_UNITS = {"and", "or", "the", "a", "so", "is", "are", "in", "of", "to", "for", "because", "which", "that", "then"}
+
+
+class Answer:
+    """Final number of a solution, with the unit written after it"""
+    def __init__(self, value, unit=None, percent=False, approximate=False):
+        self.value = value
+        self.unit = unit
+        self.percent = percent
+        # Written as a decimal, it may be a rounded fraction
+        self.approximate = approximate
+
+    def __repr__(self):
+        return f"Answer({self.value}, unit={self.unit!r}, percent={self.percent})"
+
+
+def _unit(word):
+    if not word or word.lower() in NOT_UNITS:
+        return None
+    word = word.lower()
+    if word in CURRENCY_WORDS:
+        return "currency"
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+
+def _parse(match):
+    if match.group("whole"):
+        value = int(match.group("whole")) + Fraction(int(match.group("mixed_num")), int(match.group("mixed_den")))
+    elif match.group("num"):
+        if int(match.group("den")) == 0:
+            return None
+        value = Fraction(int(match.group("num")), int(match.group("den")))
+    elif match.group("decimal"):
+        value = Fraction(match.group("decimal").replace(",", ""))
+    else:
+        value = Fraction(NUMBER_WORDS[match.group("word").lower()])
+    if match.group("sign"):
+        value = -value
+    unit = _unit(match.group("unit"))
+    if unit in SCALES:
+        value, unit = value * SCALES[unit], None
+    if match.group("currency"):
+        unit = "currency"
+    return Answer(value, unit, bool(match.group("percent")), "." in (match.group("decimal") or ""))
+
+
+def extract_answer(text):
+    """Answer after the last "the answer is" of a text, None when there is none or it is unclear
+
+    Only the sentence after the marker is read. When it holds a calculation
+    the result after the last "=" is the answer, several numbers without one
+    are unclear.
+    """
+    if not text:
+        return None
+    markers = list(ANSWER_MARKER.finditer(text))
+    if not markers:
+        return None
+    sentence = re.split(r"(?<!\d)\.(?!\d)|\n|;", text[markers[-1].end():], maxsplit=1)[0]
+    if "=" in sentence:
+        sentence = sentence.rsplit("=", 1)[1]
+    numbers = [answer for answer in map(_parse, NUMBER.finditer(sentence)) if answer is not None]
+    if len(numbers) != 1:
+        return None
+    return numbers[0]
+
+
+def _values(answer, other):
+    # "50%" and "0.5" are the same answer, "50%" and "50" too when the question asks for a percentage
+    if answer.percent and not other.percent:
+        return {answer.value, answer.value / 100}
+    return {answer.value}
+
+
+def compare_answers(first, second):
+    """True or False when both texts have a clear final number, None when an LLM has to decide"""
+    a, b = extract_answer(first), extract_answer(second)
+    if a is None or b is None:
+        return None
+    if a.unit and b.unit and a.unit != b.unit:
+        # "2 hours" and "120 minutes": conversions are left to the LLM
+        return None
+    if _values(a, b) & _values(b, a):
+        return True
+    if a.approximate or b.approximate:
+        # 0.33 and 1/3 differ only by the rounding
+        if abs(a.value - b.value) <= Fraction(1, 100) * max(abs(a.value), abs(b.value)):
+            return None
+    return False
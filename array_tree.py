@@ -0,0 +1,269 @@
+from array import array
+from math import log, sqrt
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import tree_of_thought
+from answers import extract_answer
+from cache import SampleCounter
+
+ROOT = 0
+NO_NODE = -1
+
+# With fewer children a Python loop is faster than NumPy views
+VECTORIZE_MIN_CHILDREN = 32
+
+
+class ArrayTree:
+    """MCTS tree stored in parallel arrays, a node is an index
+
+    parent, first_child, last_child and next_sibling link the nodes, visits
+    and score hold the statistics and step the id of the node's text in
+    `texts`, where equal steps are stored once. Traversals are iterative, the
+    leaves are kept up to date as nodes are added and UCT over many children
+    is computed with NumPy when it is installed.
+
+    mcts_round does what tree_of_thought.Tree.mcts_round does, with the same
+    width and legacy options, and leaves the same statistics: it is meant for
+    trees too large or too deep for Node objects. Rounds run one at a time.
+    """
+    def __init__(self, query, width=3, legacy=False):
+        self.width = width
+        self.legacy = legacy
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.last_child = array('i')
+        self.next_sibling = array('i')
+        self.depth = array('i')
+        self.visits = array('q')
+        self.score = array('d')
+        self.step = array('i')
+        self.texts = []
+        self._text_ids = {}
+        # Leaf indices in insertion order, a dict used as an ordered set
+        self.leaves = {}
+        self.samples = SampleCounter()
+        self.add(NO_NODE, query)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def text(self, node):
+        return self.texts[self.step[node]]
+
+    def _intern(self, text):
+        text_id = self._text_ids.get(text)
+        if text_id is None:
+            text_id = self._text_ids[text] = len(self.texts)
+            self.texts.append(text)
+        return text_id
+
+    def add(self, parent, text):
+        node = len(self.parent)
+        self.parent.append(parent)
+        self.first_child.append(NO_NODE)
+        self.last_child.append(NO_NODE)
+        self.next_sibling.append(NO_NODE)
+        self.depth.append(self.depth[parent] + 1 if parent != NO_NODE else 0)
+        self.visits.append(0)
+        self.score.append(0.0)
+        self.step.append(self._intern(text))
+        if parent != NO_NODE:
+            if self.first_child[parent] == NO_NODE:
+                self.first_child[parent] = node
+                del self.leaves[parent]
+            else:
+                self.next_sibling[self.last_child[parent]] = node
+            self.last_child[parent] = node
+        self.leaves[node] = None
+        return node
+
+    def add_trajectory(self, parent, steps):
+        """Chain of steps below parent, returns its first node"""
+        first = None
+        for text in steps:
+            parent = self.add(parent, text)
+            if first is None:
+                first = parent
+        return first
+
+    def children(self, node):
+        children = []
+        child = self.first_child[node]
+        while child != NO_NODE:
+            children.append(child)
+            child = self.next_sibling[child]
+        return children
+
+    def trajectory(self, node):
+        """Nodes from the root to node"""
+        path = []
+        while node != NO_NODE:
+            path.append(node)
+            node = self.parent[node]
+        path.reverse()
+        return path
+
+    def text_trajectory(self, node):
+        texts = [self.text(n) for n in self.trajectory(node)]
+        return [text for text in texts if text]
+
+    def leaves_under(self, node):
+        """Leaves of the subtree of node, in the order of Node.get_leaf_nodes"""
+        first_child, next_sibling, parent = self.first_child, self.next_sibling, self.parent
+        leaves = []
+        current = node
+        # Walks the sibling links down and back up, no stack
+        while True:
+            child = first_child[current]
+            if child != NO_NODE:
+                current = child
+                continue
+            leaves.append(current)
+            while current != node and next_sibling[current] == NO_NODE:
+                current = parent[current]
+            if current == node:
+                return leaves
+            current = next_sibling[current]
+
+    def uct_scores(self, children, exploration_constant=sqrt(2)):
+        """UCT of sibling nodes, like Node.uct_score"""
+        parent_visits = self.visits[self.parent[children[0]]]
+        log_parent = log(max(parent_visits, 1))
+        if np is not None and len(children) >= VECTORIZE_MIN_CHILDREN:
+            index = np.array(children, dtype=np.intp)
+            visits = np.frombuffer(self.visits, dtype=np.int64)[index].astype(np.float64)
+            score = np.frombuffer(self.score, dtype=np.float64)[index]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                uct = score / visits + exploration_constant * np.sqrt(log_parent / visits)
+            uct[visits == 0] = np.inf
+            return uct
+        scores = []
+        for child in children:
+            visits = self.visits[child]
+            if visits == 0:
+                scores.append(float('inf'))
+            else:
+                scores.append(self.score[child] / visits + exploration_constant * sqrt(log_parent / visits))
+        return scores
+
+    def select_best_child(self, node=ROOT):
+        children = self.children(node)
+        if not children:
+            return node
+        scores = self.uct_scores(children)
+        if np is not None and isinstance(scores, np.ndarray):
+            return children[int(np.argmax(scores))]
+        # max keeps the first of equal scores, as Node.select_best_child does
+        return children[max(range(len(children)), key=scores.__getitem__)]
+
+    def is_terminal(self, node):
+        return node != ROOT and self.first_child[node] == NO_NODE and extract_answer(self.text(node)) is not None
+
+    def child_limit(self, node):
+        return max(self.width, int(sqrt(self.visits[node])))
+
+    def select(self):
+        node = ROOT
+        while len(self.children(node)) >= self.child_limit(node):
+            node = self.select_best_child(node)
+        return node
+
+    def expand(self, node, rounds=3):
+        """Add `rounds` rollouts below node, returns the last step of each one"""
+        question = self.text(ROOT)
+        previous_steps = self.text_trajectory(node)[1:]
+        last_steps = []
+        for _ in range(rounds):
+            steps = tree_of_thought.propose_steps(question, previous_steps, self.samples)
+            if steps:
+                self.add_trajectory(node, steps)
+                last_steps.append(len(self) - 1)
+        return last_steps
+
+    def simulation_results(self, leaf, rounds=3):
+        query = self.text(ROOT)
+        answer = self.text(leaf)
+        text_trajectory = self.text_trajectory(leaf)
+        results = []
+        for _ in range(rounds):
+            completion = tree_of_thought.complete_masked_steps(query, text_trajectory, self.samples)
+            results.append(tree_of_thought.judge_consistency(query, answer, completion).result)
+        return results
+
+    def simulate(self, leaf, rounds=3):
+        for result in self.simulation_results(leaf, rounds):
+            self.score[leaf] += 1 if result else -1
+
+    def backpropagate(self, leaf, results):
+        """Count the simulations as visits of leaf and its ancestors, O(depth)"""
+        score = sum(1 if result else -1 for result in results)
+        node = leaf
+        while node != NO_NODE:
+            self.visits[node] += len(results)
+            self.score[node] += score
+            node = self.parent[node]
+
+    def add_visits(self, leaves):
+        """One visit on the path of every leaf, the paths are updated in one pass"""
+        path = []
+        for leaf in leaves:
+            path.extend(self.trajectory(leaf))
+        if np is not None and len(path) >= VECTORIZE_MIN_CHILDREN:
+            np.add.at(np.frombuffer(self.visits, dtype=np.int64), np.array(path, dtype=np.intp), 1)
+        else:
+            for node in path:
+                self.visits[node] += 1
+
+    def mcts_round(self):
+        if self.legacy:
+            return self.legacy_round()
+        selected = self.select()
+        if self.is_terminal(selected):
+            leaves = [selected]
+        else:
+            leaves = self.expand(selected, max(self.child_limit(selected) - len(self.children(selected)), 1))
+        results = [self.simulation_results(leaf) for leaf in leaves]
+        for leaf, leaf_results in zip(leaves, results):
+            self.backpropagate(leaf, leaf_results)
+
+    def legacy_round(self):
+        selected = self.select_best_child(ROOT)
+        self.expand(selected)
+
+        # Leaves grouped by child of the selected node, computed once for simulation and backpropagation
+        groups = [(child, self.leaves_under(child)) for child in self.children(selected)]
+        for _, leaves in groups:
+            for leaf in leaves:
+                self.simulate(leaf)
+
+        for child, leaves in groups:
+            self.add_visits(leaves)
+            for leaf in leaves:
+                self.score[child] += self.score[leaf]
+
+    def search(self, rounds=3):
+        for _ in range(rounds):
+            self.mcts_round()
+        return self.best_leaf()
+
+    def best_leaf(self):
+        """End of the most visited path, with legacy the leaf with the best score
+        per visit, the first added winning a tie"""
+        if not self.legacy:
+            node = ROOT
+            while self.first_child[node] != NO_NODE:
+                node = max(self.children(node), key=lambda child: (self.visits[child], self.score[child]))
+            return node
+        leaves = list(self.leaves)
+        if np is not None and len(leaves) >= VECTORIZE_MIN_CHILDREN:
+            index = np.array(leaves, dtype=np.intp)
+            visits = np.frombuffer(self.visits, dtype=np.int64)[index]
+            score = np.frombuffer(self.score, dtype=np.float64)[index]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio = np.where(visits > 0, score / np.maximum(visits, 1), -np.inf)
+            return leaves[int(np.argmax(ratio))]
+        return max(leaves, key=lambda leaf: self.score[leaf] / self.visits[leaf] if self.visits[leaf] else float('-inf'))
@@ -0,0 +1,137 @@
+"""Run the prompts of a JSONL file through the agent, non-interactively.
+
+Every input line is {"id": ..., "prompt": ...} (id defaults to the line
+number). Every output line is {"id", "answer", "iterations", "latency",
+"tokens"} or {"id", "error"}, appended as soon as the prompt is done, so an
+interrupted run resumes by skipping the ids already answered.
+
+python batch.py prompts.jsonl results.jsonl [--workers 8]
+"""
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import log, set_verbose
+
+
+def read_prompts(path):
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            yield str(record.get("id", line_number)), record["prompt"]
+
+
+def completed_ids(path):
+    """Ids already answered in an output file, a line cut by a crash is ignored"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "answer" in record:
+                done.add(str(record["id"]))
+    return done
+
+
+def _default_agent():
+    from agent import Agent
+    return Agent()
+
+
+class BatchRunner:
+    """Bounded pool of worker threads, one Agent per thread
+
+    At most `workers * 2` prompts are read ahead of the results, so the input
+    file is streamed whatever its size.
+    """
+    def __init__(self, make_agent=_default_agent, workers=4):
+        self.make_agent = make_agent
+        self.workers = workers
+        self.local = threading.local()
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def agent(self):
+        if not hasattr(self.local, "agent"):
+            self.local.agent = self.make_agent()
+        return self.local.agent
+
+    def run_one(self, prompt_id, prompt):
+        agent = self.agent()
+        messages = [agent.system_prompt, {"role": "user", "content": prompt}]
+        try:
+            answer = agent.process_conversation(messages)
+        except Exception as e:
+            return {"id": prompt_id, "error": f"{type(e).__name__}: {e}"}
+        stats = agent.last_turn
+        return {
+            "id": prompt_id,
+            "answer": answer,
+            "iterations": stats.iterations if stats else None,
+            "latency": stats.latency if stats else None,
+            "tokens": stats.total_tokens if stats else None,
+        }
+
+    def run(self, input_path, output_path):
+        done = completed_ids(output_path)
+        slots = threading.BoundedSemaphore(self.workers * 2)
+        write_lock = threading.Lock()
+
+        # Terminate a line left half written by an interrupted run
+        if os.path.exists(output_path) and os.path.getsize(output_path):
+            with open(output_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        else:
+            needs_newline = False
+
+        with open(output_path, 'a', encoding='utf-8') as out, \
+                ThreadPoolExecutor(max_workers=self.workers) as executor:
+            if needs_newline:
+                out.write("\n")
+
+            def work(prompt_id, prompt):
+                try:
+                    result = self.run_one(prompt_id, prompt)
+                    with write_lock:
+                        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                        out.flush()
+                        if "error" in result:
+                            self.failed += 1
+                            log(f"Prompt {prompt_id} failed: {result['error']}")
+                        else:
+                            self.completed += 1
+                finally:
+                    slots.release()
+
+            for prompt_id, prompt in read_prompts(input_path):
+                if prompt_id in done:
+                    self.skipped += 1
+                    continue
+                slots.acquire()
+                executor.submit(work, prompt_id, prompt)
+
+        return {"completed": self.completed, "failed": self.failed, "skipped": self.skipped}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through the agent")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--verbose", action="store_true", help="print the agent loop debug output")
+    args = parser.parse_args()
+
+    set_verbose(args.verbose)
+    summary = BatchRunner(workers=args.workers).run(args.input, args.output)
+    print(json.dumps(summary))
@@ -0,0 +1,74 @@
+"""Accuracy of the rule-based answer comparison on labelled answer pairs.
+
+Each fixture of consistency_fixtures.json is a question, two answers and
+whether they reach the same result. The rules decide the pairs whose final
+numbers are clear, the others would go to the discriminator. With --llm
+the discriminator of tree_of_thought (Ollama at OLLAMA_HOST) is run on
+every pair too, to compare both:
+
+    python -m benchmarks.consistency [--llm]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+
+from answers import compare_answers
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "consistency_fixtures.json")
+
+
+def load_fixtures(path=FIXTURES):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def rule_based_report(fixtures):
+    decided = [(compare_answers(case["first"], case["second"]), case["consistent"]) for case in fixtures]
+    decided = [(result, expected) for result, expected in decided if result is not None]
+    correct = sum(result == expected for result, expected in decided)
+    return {
+        "pairs": len(fixtures),
+        "decided": len(decided),
+        "coverage": len(decided) / len(fixtures),
+        "accuracy": correct / len(decided) if decided else None,
+    }
+
+
+def llm_report(fixtures):
+    """Accuracy of the discriminator alone and of the rules with the discriminator as fallback"""
+    import tree_of_thought
+
+    llm_correct = hybrid_correct = 0
+    previous = tree_of_thought.RULE_BASED_CONSISTENCY
+    tree_of_thought.RULE_BASED_CONSISTENCY = False
+    try:
+        for case in fixtures:
+            root = tree_of_thought.Node()
+            root.step = case["question"]
+            node = tree_of_thought.Node(root)
+            node.step = case["first"]
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = node.check_consistency(case["second"]).result
+            rule = compare_answers(case["first"], case["second"])
+            llm_correct += result == case["consistent"]
+            hybrid_correct += (result if rule is None else rule) == case["consistent"]
+    finally:
+        tree_of_thought.RULE_BASED_CONSISTENCY = previous
+    return {"llm_accuracy": llm_correct / len(fixtures), "hybrid_accuracy": hybrid_correct / len(fixtures)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rule-based vs LLM answer consistency on labelled pairs")
+    parser.add_argument("--fixtures", default=FIXTURES)
+    parser.add_argument("--llm", action="store_true", help="also run the discriminator on every pair")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    report = rule_based_report(fixtures)
+    if args.llm:
+        report.update(llm_report(fixtures))
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["accuracy"] in (None, 1.0) else 1)
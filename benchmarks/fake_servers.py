@@ -0,0 +1,217 @@
+"""Local stand-ins for the OpenAI chat completions API and Ollama /api/generate.
+
+Both run a stdlib HTTP server on a background thread and answer after
+`latency` seconds plus the generated tokens at `tokens_per_second`, so the
+benchmarks exercise the real SDKs and HTTP stacks without a model.
+
+    with FakeOpenAIServer(script=[...], latency=0.05) as server:
+        client = OpenAI(api_key="x", base_url=server.url)
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Default conversation: check the weather, then answer through final_response
+WEATHER_SCRIPT = [
+    {"tool_calls": [{"name": "get_weather", "arguments": {"location": "Rome, Italy"}}]},
+    {"tool_calls": [{"name": "final_response", "arguments": {"content": "It is 24℃ in Rome."}}]},
+]
+
+DEFAULT_STEPS = [
+    "Find the age difference. When you were 6 your sister was 3, so she is 3 years younger.",
+    "The age difference never changes, so now she is 56 - 3 = 53.",
+    "The answer is 53.",
+]
+
+
+def count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes, without this Nagle adds ~40ms per response
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def read_json(self):
+        return json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        try:
+            request = self.read_json()
+        except ValueError:
+            return self.send_json({"error": {"message": "invalid JSON"}}, 400)
+        self.server.owner.requests += 1
+        self.server.owner.handle(self, self.path.split("?")[0], request)
+
+
+class FakeServer:
+    def __init__(self, latency=0.0, tokens_per_second=None):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.requests = 0
+        self.httpd = None
+
+    def generation_time(self, tokens):
+        return self.latency + (tokens / self.tokens_per_second if self.tokens_per_second else 0)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.owner = self
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeOpenAIServer(FakeServer):
+    """POST /chat/completions, plain or streamed (server-sent events)
+
+    script lists the assistant turns of a conversation, each one
+    {"content": ...} or {"tool_calls": [{"name": ..., "arguments": {...}}]}.
+    The turn played is the number of assistant messages after the last user
+    message, so concurrent conversations do not interfere.
+    """
+    def __init__(self, script=None, latency=0.0, tokens_per_second=None):
+        super().__init__(latency, tokens_per_second)
+        self.script = script or WEATHER_SCRIPT
+
+    def next_turn(self, messages):
+        turn = 0
+        for message in reversed(messages):
+            if message.get("role") == "user":
+                break
+            if message.get("role") == "assistant":
+                turn += 1
+        step = self.script[min(turn, len(self.script) - 1)]
+        tool_calls = [
+            {"id": f"call_{turn}_{i}", "type": "function",
+             "function": {"name": call["name"], "arguments": json.dumps(call["arguments"])}}
+            for i, call in enumerate(step.get("tool_calls", []))
+        ]
+        return step.get("content"), tool_calls
+
+    def handle(self, handler, path, request):
+        if not path.endswith("/chat/completions"):
+            return handler.send_json({"error": {"message": "not found"}}, 404)
+        content, tool_calls = self.next_turn(request.get("messages", []))
+        prompt_tokens = sum(count_tokens(json.dumps(m)) for m in request.get("messages", []))
+        completion_tokens = count_tokens((content or "") + json.dumps(tool_calls))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": request.get("model", "fake")}
+        finish_reason = "tool_calls" if tool_calls else "stop"
+
+        if not request.get("stream"):
+            time.sleep(self.generation_time(completion_tokens))
+            message = {"role": "assistant", "content": content}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            return handler.send_json({**base, "object": "chat.completion", "usage": usage,
+                                      "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}]})
+
+        time.sleep(self.latency)
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        token_delay = 1 / self.tokens_per_second if self.tokens_per_second else 0
+
+        def event(choices, **extra):
+            chunk = {**base, "object": "chat.completion.chunk", "choices": choices, **extra}
+            handler.send_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        def delta(fields, finish=None):
+            event([{"index": 0, "delta": fields, "finish_reason": finish}])
+
+        delta({"role": "assistant"})
+        for word in (content or "").split():
+            time.sleep(token_delay)
+            delta({"content": word + " "})
+        for i, call in enumerate(tool_calls):
+            time.sleep(token_delay * count_tokens(call["function"]["arguments"]))
+            delta({"tool_calls": [{"index": i, **call}]})
+        delta({}, finish_reason)
+        if request.get("stream_options", {}).get("include_usage"):
+            event([], usage=usage)
+        handler.send_chunk(b"data: [DONE]\n\n")
+        handler.send_chunk(b"")
+
+
+class FakeOllamaServer(FakeServer):
+    """POST /api/generate (non streaming)
+
+    Free text prompts get `steps` as "Step N: ..." lines. Prompts with a JSON
+    schema format get an object with its properties filled in, booleans are
+    true with probability `consistency`.
+    """
+    def __init__(self, steps=None, consistency=0.7, latency=0.0, tokens_per_second=None, seed=0):
+        super().__init__(latency, tokens_per_second)
+        self.steps = steps or DEFAULT_STEPS
+        self.consistency = consistency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def structured(self, schema):
+        result = {}
+        for name, prop in schema.get("properties", {}).items():
+            kind = prop.get("type")
+            if kind == "boolean":
+                with self.lock:
+                    result[name] = self.random.random() < self.consistency
+            elif kind in ("integer", "number"):
+                result[name] = 53
+            else:
+                result[name] = self.steps[-1]
+        return json.dumps(result)
+
+    def handle(self, handler, path, request):
+        if path != "/api/generate":
+            return handler.send_json({"error": "not found"}, 404)
+        schema = request.get("format")
+        if isinstance(schema, dict):
+            text = self.structured(schema)
+        else:
+            text = "\n".join(f"Step {i + 1}: {step}" for i, step in enumerate(self.steps))
+        tokens = count_tokens(text)
+        time.sleep(self.generation_time(tokens))
+        handler.send_json({
+            "model": request.get("model", "fake"),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "response": text,
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": count_tokens(request.get("prompt", "")),
+            "eval_count": tokens,
+        })
@@ -0,0 +1,116 @@
+"""LLM calls the tree search needs to reach the right answer, full-depth vs legacy rounds.
+
+A seeded stub stands in for Ollama. A rollout from the question starts with
+the right first step with probability --good-start, and ends with 53 (the
+right answer) mostly when its steps hold that first step. A completion of a
+masked trajectory answers 53 with probability --completion-accuracy, more
+often when the visible steps are the right ones. Each search runs rounds
+until it made --max-calls calls. The report gives, over --runs seeds, the
+share of searches whose best leaf answered 53 at some point, the calls
+spent until then, and the share still answering 53 when the budget ran out:
+
+    python -m benchmarks.mcts_calls [--runs 50] [--max-calls 200]
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import sys
+from types import SimpleNamespace
+
+import tree_of_thought
+from answers import extract_answer
+
+QUERY = "When I was 6 my sister was 3. Now I'm 56 how old is my sister?"
+TARGET = 53
+
+GOOD_STEP = "The age gap stays the same: 6 - 3 = 3 years."
+BAD_STEP = "When I was 6 my sister was half my age."
+
+
+class StubClient:
+    """ollama.Client answering from a seeded random generator, counts the calls per model"""
+    def __init__(self, seed, good_start, completion_accuracy):
+        self.random = random.Random(seed)
+        self.good_start = good_start
+        self.completion_accuracy = completion_accuracy
+        self.calls = {}
+
+    def generate(self, model, prompt, format=None):
+        self.calls[model] = self.calls.get(model, 0) + 1
+        # Rollouts below the root still solve the user's query, not an intermediate step
+        assert format is not None or QUERY in prompt, "rollout prompt without the query"
+        # Only the text after the few-shot examples depends on the tree
+        steps = prompt.rsplit(QUERY, 1)[-1]
+        if format is None:
+            return SimpleNamespace(response=self.rollout(steps))
+        if GOOD_STEP in steps:
+            accuracy = 0.9
+        elif BAD_STEP in steps:
+            accuracy = 0.4
+        else:
+            accuracy = self.completion_accuracy
+        answer = TARGET if self.random.random() < accuracy else 28
+        return SimpleNamespace(response=json.dumps({"response": f"The answer is {answer}."}))
+
+    def rollout(self, steps):
+        if GOOD_STEP in steps or BAD_STEP in steps:
+            first = []
+            good = GOOD_STEP in steps
+        else:
+            good = self.random.random() < self.good_start
+            first = [GOOD_STEP if good else BAD_STEP]
+        answer = TARGET if self.random.random() < (0.9 if good else 0.15) else 28
+        rest = ["Subtract the gap from my age.", f"The answer is {answer}."]
+        return "\n".join(f"Step {i + 1}: {step}" for i, step in enumerate(first + rest))
+
+
+def answers_target(tree):
+    answer = extract_answer(tree.get_best_leaf().step)
+    return answer is not None and answer.value == TARGET
+
+
+def search_calls(legacy, seed, max_calls, good_start, completion_accuracy):
+    """Calls and rounds made until the best leaf first answered TARGET (None, None when it never
+    did) and whether it still does after max_calls"""
+    client = StubClient(seed, good_start, completion_accuracy)
+    previous = tree_of_thought.client, tree_of_thought.generation_cache
+    tree_of_thought.client, tree_of_thought.generation_cache = client, None
+    reached_calls = reached_rounds = None
+    try:
+        tree = tree_of_thought.Tree(QUERY, legacy=legacy)
+        rounds = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            while sum(client.calls.values()) < max_calls:
+                tree.mcts_round()
+                rounds += 1
+                if reached_calls is None and answers_target(tree):
+                    reached_calls, reached_rounds = sum(client.calls.values()), rounds
+        return reached_calls, reached_rounds, answers_target(tree)
+    finally:
+        tree_of_thought.client, tree_of_thought.generation_cache = previous
+
+
+def report(legacy, runs, max_calls, good_start, completion_accuracy):
+    results = [search_calls(legacy, seed, max_calls, good_start, completion_accuracy) for seed in range(runs)]
+    reached = [(calls, rounds) for calls, rounds, _ in results if calls is not None]
+    return {
+        "reached": len(reached) / runs,
+        "mean_calls": sum(calls for calls, _ in reached) / len(reached) if reached else None,
+        "mean_rounds": sum(rounds for _, rounds in reached) / len(reached) if reached else None,
+        "correct_at_budget": sum(final for _, _, final in results) / runs,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM calls to reach the target answer, full-depth vs legacy MCTS")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--max-calls", type=int, default=200, help="LLM call budget of a search")
+    parser.add_argument("--good-start", type=float, default=0.3, help="probability of the right first step")
+    parser.add_argument("--completion-accuracy", type=float, default=0.6)
+    args = parser.parse_args()
+
+    options = (args.runs, args.max_calls, args.good_start, args.completion_accuracy)
+    print(json.dumps({"full_depth": report(False, *options), "legacy": report(True, *options)}, indent=2))
+    sys.exit(0)
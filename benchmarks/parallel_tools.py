@@ -0,0 +1,63 @@
+"""Turn latency of a multi-tool assistant turn, sequential vs concurrent.
+
+Run from the repository root: python -m benchmarks.parallel_tools
+"""
+import json
+import time
+from types import SimpleNamespace
+
+from tools import ToolExecutor
+
+# Simulated latency (seconds) of each tool call of the turn
+LATENCIES = {
+    "Rome, Italy": 0.10,
+    "Paris, France": 0.20,
+    "Berlin, Germany": 0.15,
+    "Madrid, Spain": 0.30,
+    "London, UK": 0.25,
+}
+LIST_TASKS_LATENCY = 0.05
+
+
+def make_turn():
+    calls = [
+        SimpleNamespace(id=f"call_{i}", type="function", function=SimpleNamespace(
+            name="get_weather", arguments=json.dumps({"location": location})))
+        for i, location in enumerate(LATENCIES)
+    ]
+    calls.append(SimpleNamespace(id="call_tasks", type="function", function=SimpleNamespace(
+        name="list_all_tasks", arguments="{}")))
+    return calls
+
+
+def slow_handler(tool_call):
+    args = json.loads(tool_call.function.arguments)
+    if tool_call.function.name == "get_weather":
+        time.sleep(LATENCIES[args["location"]])
+        return f"{args['location']}: 24℃"
+    time.sleep(LIST_TASKS_LATENCY)
+    return "No scheduled tasks found"
+
+
+def measure(max_workers, repeat=5):
+    executor = ToolExecutor(max_workers=max_workers, handler=slow_handler)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        executor.map(make_turn())
+        timings.append(time.perf_counter() - start)
+    executor.shutdown()
+    return min(timings)
+
+
+if __name__ == "__main__":
+    slowest = max(max(LATENCIES.values()), LIST_TASKS_LATENCY)
+    total = sum(LATENCIES.values()) + LIST_TASKS_LATENCY
+    sequential = measure(max_workers=1)
+    concurrent = measure(max_workers=8)
+
+    print(f"Slowest tool:      {slowest:.3f}s")
+    print(f"Sum of all tools:  {total:.3f}s")
+    print(f"Sequential turn:   {sequential:.3f}s")
+    print(f"Concurrent turn:   {concurrent:.3f}s")
+    print(f"Speedup:           {sequential / concurrent:.1f}x")
@@ -0,0 +1,63 @@
+"""Scheduler throughput on a simulated clock, no network and no waiting.
+
+Run from the repository root: python -m benchmarks.scheduler [--tasks 100000]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from cron import CronExpression
+from scheduler import Scheduler, SimulatedClock
+from task_store import SqliteTaskStore
+
+
+def random_cron(rng):
+    minute = rng.choice(["*/5", "*/15", str(rng.randrange(60))])
+    hour = rng.choice(["*", "9-17", str(rng.randrange(24))])
+    weekday = rng.choice(["*", "1-5", "0,6"])
+    return f"{minute} {hour} * * {weekday}"
+
+
+def main(task_count, groups, days):
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        store = SqliteTaskStore(os.path.join(directory, "tasks.db"))
+        expressions = list({random_cron(rng) for _ in range(groups * 3)})[:groups]
+        per_group = task_count // len(expressions)
+        start = time.perf_counter()
+        for expression in expressions:
+            store.add(expression, [f"objective {i} of {expression}" for i in range(per_group)])
+        print(f"Stored {per_group * len(expressions)} objectives in {len(expressions)} cron groups "
+              f"in {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        for expression in expressions:
+            CronExpression(expression)
+        print(f"Compiled {len(expressions)} expressions in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+        clock = SimulatedClock(datetime(2025, 1, 6))
+        scheduler = Scheduler(store, dispatch=lambda objective: None, clock=clock,
+                              max_workers=8, max_queued=10000, reload_interval=None)
+        start = time.perf_counter()
+        scheduler.reload()
+        print(f"Built heap in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+        start = time.perf_counter()
+        scheduler.run(until=clock.now() + timedelta(days=days))
+        scheduler.shutdown()
+        elapsed = time.perf_counter() - start
+
+        print(f"Simulated {days} day(s): {scheduler.fired} wakeups, {scheduler.dispatched} dispatches "
+              f"in {elapsed:.2f}s ({scheduler.dispatched / elapsed:,.0f} dispatches/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=100000)
+    parser.add_argument("--groups", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=1)
+    args = parser.parse_args()
+    main(args.tasks, args.groups, args.days)
@@ -0,0 +1,264 @@
+"""Offline benchmark suite: agent turns, task-store tools and MCTS rounds.
+
+The LLMs are replaced by the local servers of benchmarks.fake_servers, so
+the numbers measure this code (SDK, HTTP, tool dispatch, stores, tree
+search) plus the configured fake latency. Results are written as JSON and
+can be compared with a previous run to catch regressions:
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --output after.json --baseline before.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from benchmarks.fake_servers import FakeOllamaServer, FakeOpenAIServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non empty list"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed, **extra):
+    return {
+        "count": len(latencies),
+        "throughput": len(latencies) / elapsed if elapsed else None,
+        "mean": sum(latencies) / len(latencies),
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies),
+        **extra,
+    }
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def bench_agent(server, conversations, concurrency, stream):
+    from agent import Agent
+    config = {"api_key": "fake", "model": "fake-model", "base_url": server.url}
+    local = threading.local()
+
+    def conversation(i):
+        if not hasattr(local, "agent"):
+            local.agent = Agent(stream=stream, config=config)
+        agent = local.agent
+        messages = [agent.system_prompt, {"role": "user", "content": f"Weather in Rome? ({i})"}]
+        return timed(agent.process_conversation, messages)
+
+    # Warm up: SDK import, client creation and the first connection are not per turn costs
+    conversation(-1)
+    requests = server.requests
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(conversation, range(conversations)))
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, elapsed, concurrency=concurrency, llm_requests=server.requests - requests)
+
+
+def tool_call(name, **arguments):
+    return SimpleNamespace(function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+
+
+def bench_task_store(backend, tasks, groups, operations):
+    """Latency of the task tools through handle_tool_call, on a pre-filled store
+
+    The tool cache is off: repeated reads would be cache hits, not store reads.
+    """
+    import tools
+    from task_store import JsonTaskStore, SqliteTaskStore
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        if backend == "sqlite":
+            store = SqliteTaskStore(os.path.join(directory, "tasks.db"))
+        else:
+            store = JsonTaskStore(os.path.join(directory, "tasks.json"))
+        per_group = tasks // groups
+        for group in range(groups):
+            store.add(f"{group % 60} * * * *", [f"objective {group}-{i} report" for i in range(per_group)])
+        previous = tools._task_store
+        previous_cache = tools.get_tool_cache()
+        tools.set_task_store(store)
+        tools.set_tool_cache(None)
+        try:
+            scenarios = {
+                "schedule_task": lambda i: tool_call(
+                    "schedule_task", cron_expression="0 9 * * 1-5", objectives=[f"new objective {i}"]),
+                "search_tasks": lambda i: tool_call("search_tasks", objective=f"objective {i % groups}-"),
+                "list_all_tasks": lambda i: tool_call("list_all_tasks"),
+                "delete_task_by_objective": lambda i: tool_call("delete_task_by_objective", objective=f"new objective {i}"),
+            }
+            for name, make_call in scenarios.items():
+                count = operations if name != "list_all_tasks" else max(1, operations // 10)
+                latencies = [timed(tools.handle_tool_call, make_call(i)) for i in range(count)]
+                results[name] = summarize(latencies, sum(latencies), tasks=tasks)
+        finally:
+            tools.set_task_store(previous)
+            tools.set_tool_cache(previous_cache)
+    return results
+
+
+def bench_mcts(rounds, latency, tokens_per_second):
+    from ollama import Client
+    from cache import GenerationCache
+    import tree_of_thought
+
+    with FakeOllamaServer(latency=latency, tokens_per_second=tokens_per_second) as server:
+        previous = tree_of_thought.client
+        tree_of_thought.client = Client(host=server.url)
+        checks = dict(tree_of_thought.consistency_checks)
+        previous_cache = tree_of_thought.generation_cache
+        tree_of_thought.generation_cache = cache = GenerationCache()
+        try:
+            tree = tree_of_thought.Tree("When I was 6 my sister was 3. Now I'm 56 how old is my sister?")
+            latencies = []
+            start = time.perf_counter()
+            # The tree search prints its progress, keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(rounds):
+                    latencies.append(timed(tree.mcts_round))
+            elapsed = time.perf_counter() - start
+        finally:
+            tree_of_thought.client = previous
+            tree_of_thought.generation_cache = previous_cache
+        return summarize(latencies, elapsed, llm_requests=server.requests,
+                         checks_avoided=tree_of_thought.consistency_checks["rule_based"] - checks["rule_based"],
+                         generation_cache_hit_rate=cache.stats()["hit_rate"])
+
+
+def bench_search(rounds, workers, searches, latency, tokens_per_second, cached=False):
+    """Latency of whole Tree.search calls of the same query
+
+    Without cached, every search generates again: this measures the workers.
+    With it, the first search fills a generation cache the others replay.
+    """
+    from ollama import Client
+    from cache import GenerationCache
+    import tree_of_thought
+
+    with FakeOllamaServer(latency=latency, tokens_per_second=tokens_per_second) as server:
+        previous = tree_of_thought.client
+        tree_of_thought.client = Client(host=server.url)
+        checks = dict(tree_of_thought.consistency_checks)
+        previous_cache = tree_of_thought.generation_cache
+        tree_of_thought.generation_cache = cache = GenerationCache() if cached else None
+        try:
+            latencies = []
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(searches):
+                    tree = tree_of_thought.Tree("When I was 6 my sister was 3. Now I'm 56 how old is my sister?",
+                                                workers=workers)
+                    latencies.append(timed(tree.search, rounds))
+            elapsed = time.perf_counter() - start
+        finally:
+            tree_of_thought.client = previous
+            tree_of_thought.generation_cache = previous_cache
+        return summarize(latencies, elapsed, workers=workers, llm_requests=server.requests,
+                         checks_avoided=tree_of_thought.consistency_checks["rule_based"] - checks["rule_based"],
+                         generation_cache_hit_rate=cache.stats()["hit_rate"] if cached else None)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Benchmarks whose p50 or p99 got slower than baseline by more than tolerance"""
+    regressions = []
+    for name, current in results["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if not previous:
+            continue
+        for metric in ("p50", "p99"):
+            if previous[metric] and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {previous[metric] * 1000:.2f}ms -> {current[metric] * 1000:.2f}ms")
+    return regressions
+
+
+def run(args):
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from metrics import set_verbose
+    set_verbose(False)
+
+    benchmarks = {}
+    with FakeOpenAIServer(latency=args.llm_latency, tokens_per_second=args.tokens_per_second) as server:
+        for stream in (False, True):
+            name = "agent.process_conversation" + (".stream" if stream else "")
+            benchmarks[name] = bench_agent(server, args.conversations, args.concurrency, stream)
+    for backend in ("json", "sqlite"):
+        for name, result in bench_task_store(backend, args.tasks, args.groups, args.operations).items():
+            benchmarks[f"tools.{name}.{backend}"] = result
+    benchmarks["tree_of_thought.mcts_round"] = bench_mcts(args.rounds, args.llm_latency, args.tokens_per_second)
+    for workers in sorted({1, args.mcts_workers}):
+        benchmarks[f"tree_of_thought.search.w{workers}"] = bench_search(
+            args.rounds, workers, args.searches, args.llm_latency, args.tokens_per_second)
+    benchmarks["tree_of_thought.search.cached"] = bench_search(
+        args.rounds, 1, args.searches, args.llm_latency, args.tokens_per_second, cached=True)
+
+    return {
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": vars(args),
+        "benchmarks": benchmarks,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks with fake LLM servers")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="previous results file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown, 0.2 = 20%%")
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--llm-latency", type=float, default=0.02, help="fake LLM latency in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=2000)
+    parser.add_argument("--tasks", type=int, default=10000)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--operations", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--searches", type=int, default=3, help="searches per tree_of_thought.search benchmark")
+    parser.add_argument("--mcts-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    results = run(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for name, result in results["benchmarks"].items():
+        throughput = f"{result['throughput']:10.1f}/s" if result["throughput"] else ""
+        print(f"{name:42} p50 {result['p50'] * 1000:9.2f}ms  p99 {result['p99'] * 1000:9.2f}ms {throughput}")
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
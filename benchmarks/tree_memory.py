@@ -0,0 +1,160 @@
+"""Memory and bookkeeping time of the MCTS tree: Node objects vs ArrayTree.
+
+Both trees are grown to the same shape, chains of 3 steps added 3 at a time
+below nodes picked pseudo-randomly, as search rounds do. The step texts are
+shared, so bytes per node is the cost of the structure alone. Rounds run the
+real mcts_round of each engine with instant fake generations, to time the
+selection, traversal and backpropagation. The deep case is one chain, the
+trajectory of a candidate far down a long rollout:
+
+    python -m benchmarks.tree_memory [--nodes 100000] [--depth 20000]
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import array_tree
+import tree_of_thought
+from array_tree import ArrayTree
+from tree_of_thought import Node, Tree
+
+QUERY = "When I was 6 my sister was 3. Now I'm 56 how old is my sister?"
+
+STEPS = [
+    "The age difference between me and my sister is 6 - 3 = 3 years.",
+    "The age difference stays the same as we get older.",
+    "Now I am 56, so my sister is 56 - 3 = 53. The answer is 53.",
+]
+
+
+def add_node_chain(parent, steps):
+    first = None
+    for step in steps:
+        node = Node(parent)
+        node.step = step
+        parent.child.append(node)
+        parent = node
+        first = first or node
+    return first
+
+
+def grow(add_chain, root, nodes, branching=3):
+    """Add chains of len(STEPS) nodes until the tree has `nodes` nodes"""
+    candidates = [root]
+    count, seed = 1, 12345
+    while count < nodes:
+        seed = (seed * 1103515245 + 12345) % 2 ** 31
+        parent = candidates[seed % len(candidates)]
+        for _ in range(branching):
+            candidates.append(add_chain(parent, STEPS))
+            count += len(STEPS)
+
+
+def build_node_tree(nodes):
+    tree = Tree(QUERY)
+    grow(add_node_chain, tree.root, nodes)
+    return tree
+
+
+def build_array_tree(nodes):
+    tree = ArrayTree(QUERY)
+    grow(tree.add_trajectory, array_tree.ROOT, nodes)
+    return tree
+
+
+def measure(build, nodes):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    tree = build(nodes)
+    elapsed = time.perf_counter() - start
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return tree, {"bytes_per_node": used / nodes, "build_seconds": elapsed}
+
+
+@contextlib.contextmanager
+def instant_generations():
+    """propose_steps, complete_masked_steps and judge_consistency answer at once"""
+    originals = (tree_of_thought.propose_steps, tree_of_thought.complete_masked_steps,
+                 tree_of_thought.judge_consistency)
+    check = tree_of_thought._model("ConsistencyCheck")(text_response="", result=True)
+    tree_of_thought.propose_steps = lambda question, previous_steps, counter=None: list(STEPS)
+    tree_of_thought.complete_masked_steps = lambda query, trajectory, counter=None: STEPS[-1]
+    tree_of_thought.judge_consistency = lambda query, first, second: check
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        (tree_of_thought.propose_steps, tree_of_thought.complete_masked_steps,
+         tree_of_thought.judge_consistency) = originals
+
+
+def timed(function, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_nodes(nodes, rounds):
+    tree, node_report = measure(build_node_tree, nodes)
+    with instant_generations():
+        node_report["round_seconds"] = timed(tree.mcts_round, rounds)
+    node_report["leaves_seconds"] = timed(tree.root.get_leaf_nodes)
+    node_report["best_leaf_seconds"] = timed(tree.get_best_leaf)
+    del tree
+
+    tree, array_report = measure(build_array_tree, nodes)
+    with instant_generations():
+        array_report["round_seconds"] = timed(tree.mcts_round, rounds)
+    array_report["leaves_seconds"] = timed(lambda: tree.leaves_under(array_tree.ROOT))
+    array_report["best_leaf_seconds"] = timed(tree.best_leaf)
+    return {"nodes": nodes, "node": node_report, "array": array_report}
+
+
+def bench_depth(depth):
+    """Trajectory and leaves of one chain `depth` steps long"""
+    report = {"depth": depth}
+    root = Node()
+    root.step = QUERY
+    leaf = root
+    for i in range(depth):
+        leaf = add_node_chain(leaf, [STEPS[i % len(STEPS)]])
+    try:
+        start = time.perf_counter()
+        leaf.get_trajectory()
+        root.get_leaf_nodes()
+        report["node"] = time.perf_counter() - start
+    except RecursionError:
+        report["node"] = "RecursionError"
+
+    tree = ArrayTree(QUERY)
+    leaf = array_tree.ROOT
+    for i in range(depth):
+        leaf = tree.add(leaf, STEPS[i % len(STEPS)])
+    start = time.perf_counter()
+    tree.trajectory(leaf)
+    tree.leaves_under(array_tree.ROOT)
+    report["array"] = time.perf_counter() - start
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory and bookkeeping time of Node vs ArrayTree")
+    parser.add_argument("--nodes", type=int, default=100000)
+    parser.add_argument("--rounds", type=int, default=5, help="mcts rounds timed on the grown tree")
+    parser.add_argument("--depth", type=int, default=20000)
+    args = parser.parse_args()
+
+    report = {"numpy": array_tree.np is not None}
+    report["tree"] = bench_nodes(args.nodes, args.rounds)
+    report["deep"] = bench_depth(args.depth)
+    print(json.dumps(report, indent=2))
+    sys.exit(0)
@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from tools import MUTATING_TOOLS
+
+
+class LRUCache:
+    """Thread-safe LRU mapping evicting by total size in bytes"""
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key][0]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+            self.items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.items.popitem(last=False)
+                self.size -= evicted_size
+
+    def __len__(self):
+        return len(self.items)
+
+
+class DiskCache:
+    """One JSON file per key, written with an atomic rename"""
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        tmp_path = f"{self.path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, self.path(key))
+
+
+def stable_hash(*parts):
+    """sha256 of a canonical JSON encoding, equal requests give equal keys"""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def mutated_state(messages):
+    """True if a tool that changes state was called earlier in the conversation"""
+    for message in messages:
+        for tool_call in message.get("tool_calls") or []:
+            if tool_call["function"]["name"] in MUTATING_TOOLS:
+                return True
+    return False
+
+
+def serialize_message(message):
+    data = {"content": message.content, "tool_calls": None}
+    if message.tool_calls:
+        data["tool_calls"] = [
+            {"id": tc.id, "type": tc.type,
+             "function": {"name": tc.function.name, "arguments": tc.function.arguments}}
+            for tc in message.tool_calls
+        ]
+    return data
+
+
+def deserialize_message(data):
+    tool_calls = None
+    if data["tool_calls"]:
+        tool_calls = [
+            SimpleNamespace(id=tc["id"], type=tc["type"], function=SimpleNamespace(**tc["function"]))
+            for tc in data["tool_calls"]
+        ]
+    return SimpleNamespace(role="assistant", content=data["content"], tool_calls=tool_calls)
+
+
+class ResponseCache:
+    """Opt-in cache of chat completions keyed on (model, messages, tools)
+
+    Memory tier is an LRU bounded in bytes, the disk tier is used when a
+    directory is given. Conversations in which a mutating tool already ran
+    bypass the cache, their answers depend on state the key does not capture.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None):
+        self.memory = LRUCache(max_bytes)
+        self.disk = DiskCache(directory) if directory else None
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+    def key(self, model, messages, tools):
+        """Cache key of a request, None when the request must not be cached"""
+        if mutated_state(messages):
+            self.bypasses += 1
+            return None
+        return stable_hash(model, messages, tools)
+
+    def get(self, key):
+        data = self.memory.get(key)
+        if data is None and self.disk:
+            data = self.disk.get(key)
+            if data is not None:
+                self.memory.put(key, data, len(json.dumps(data)))
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return deserialize_message(data)
+
+    def put(self, key, message):
+        data = serialize_message(message)
+        self.memory.put(key, data, len(json.dumps(data)))
+        if self.disk:
+            self.disk.put(key, data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.memory),
+            "bytes": self.memory.size,
+        }
+
+
+class SampleCounter:
+    """Numbers identical requests: the n-th one of a run reads sample slot n"""
+    def __init__(self):
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def next(self, request, samples=None):
+        with self.lock:
+            count = self.counts.get(request, 0)
+            self.counts[request] = count + 1
+        # With `samples` the slots are reused once that many samples exist
+        return count if samples is None else count % samples
+
+
+class GenerationCache:
+    """Cache of Ollama generations keyed on (model, prompt, format, options) and a sample slot
+
+    Repeating a request within a run gives a new slot, so sampling several
+    times still gives different samples, unless the caller bounds the
+    samples it wants. A new run (a new SampleCounter) starts again from slot
+    0 and replays the same generations, from disk when a directory is given.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None):
+        self.memory = LRUCache(max_bytes)
+        self.disk = DiskCache(directory) if directory else None
+        self.counter = SampleCounter()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        data = self.memory.get(key)
+        if data is None and self.disk:
+            data = self.disk.get(key)
+            if data is not None:
+                self.memory.put(key, data, len(json.dumps(data)))
+                with self.lock:
+                    self.disk_hits += 1
+        with self.lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def put(self, key, data):
+        self.memory.put(key, data, len(json.dumps(data)))
+        if self.disk:
+            self.disk.put(key, data)
+
+    def generate(self, generate, model, prompt, format=None, options=None, samples=None, counter=None):
+        """Cached generate(model, prompt=..., format=..., options=...), the result has .response"""
+        request = stable_hash(model, prompt, format, options)
+        key = stable_hash(request, (counter or self.counter).next(request, samples))
+        data = self.get(key)
+        if data is not None:
+            return SimpleNamespace(response=data["response"])
+        kwargs = {"format": format} if format is not None else {}
+        if options:
+            kwargs["options"] = options
+        response = generate(model, prompt=prompt, **kwargs)
+        self.put(key, {"response": response.response})
+        return response
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.memory),
+            "bytes": self.memory.size,
+        }
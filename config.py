@@ -0,0 +1,46 @@
+import json
+import os
+import threading
+
+# Environment variables overriding config.json keys
+ENV_VARS = {
+    "api_key": "OPENAI_API_KEY",
+    "base_url": "OPENAI_BASE_URL",
+    "model": "AGENT_MODEL",
+}
+
+_config = None
+_lock = threading.Lock()
+
+
+def load_config(path=None, overrides=None):
+    """Config from the JSON file, then environment variables, then overrides
+
+    The file is AGENT_CONFIG or config.json, a missing file is an empty config.
+    """
+    path = path or os.environ.get("AGENT_CONFIG", "config.json")
+    config = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+    for key, variable in ENV_VARS.items():
+        if os.environ.get(variable):
+            config[key] = os.environ[variable]
+    config.update(overrides or {})
+    return config
+
+
+def get_config():
+    """Process-wide config, read on first use"""
+    global _config
+    if _config is None:
+        with _lock:
+            if _config is None:
+                _config = load_config()
+    return _config
+
+
+def set_config(config):
+    """Replace the process-wide config, None reloads it on next use"""
+    global _config
+    _config = config
@@ -0,0 +1,155 @@
+import json
+
+# tiktoken encoding, loaded on first count: importing it and reading its BPE file is slow
+_encoding = None
+_encoding_loaded = False
+
+TRUNCATION_MARKER = "\n[... tool output truncated ...]"
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+# Fixed cost of a message on top of its content (role, separators)
+MESSAGE_OVERHEAD = 4
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+
+def count_text_tokens(text):
+    """Token count of a string, approximated with 4 characters per token without tiktoken"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def count_message_tokens(message):
+    tokens = MESSAGE_OVERHEAD + count_text_tokens(message.get("content"))
+    if message.get("tool_calls"):
+        tokens += count_text_tokens(json.dumps(message["tool_calls"]))
+    return tokens
+
+
+class ContextManager:
+    """Keeps a conversation under a token budget
+
+    Token counts are cached per message, so only new or rewritten messages are
+    counted again. When the budget is exceeded, old tool outputs are truncated
+    first, then the oldest turns are dropped (or summarized when a summarize
+    callable is given). The system prompt and the most recent messages are
+    never touched, nor is the latest user message, and an assistant
+    tool_calls message is always kept or dropped together with its tool
+    results.
+    """
+    def __init__(self, max_tokens=32000, keep_recent=6, tool_output_chars=500, summarize=None, max_cached=100000):
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.tool_output_chars = tool_output_chars
+        self.summarize = summarize
+        self.max_cached = max_cached
+        self._counts = {}
+
+    def message_tokens(self, message):
+        entry = self._counts.get(id(message))
+        if entry and entry[0] is message and entry[1] is message.get("content"):
+            return entry[2]
+        if len(self._counts) >= self.max_cached:
+            self._counts.clear()
+        tokens = count_message_tokens(message)
+        self._counts[id(message)] = (message, message.get("content"), tokens)
+        return tokens
+
+    def count(self, messages):
+        return sum(self.message_tokens(message) for message in messages)
+
+    def _forget(self, messages):
+        for message in messages:
+            self._counts.pop(id(message), None)
+
+    def _protected_tail(self, messages, start):
+        """Index of the first message of the recent window"""
+        tail = max(start, len(messages) - self.keep_recent)
+        # Never split tool results from the assistant message that requested them
+        while start < tail < len(messages) and messages[tail]["role"] == "tool":
+            tail -= 1
+        return tail
+
+    def _latest_question(self, messages, start, tail):
+        """Index of the last user message before the recent window, None when it is in the window"""
+        for i in range(len(messages) - 1, start - 1, -1):
+            if messages[i]["role"] == "user":
+                return i if i < tail else None
+        return None
+
+    def compact(self, messages):
+        """Shrink messages in place until they fit the budget, returns the token count"""
+        total = self.count(messages)
+        if total <= self.max_tokens:
+            return total
+
+        start = 1 if messages and messages[0]["role"] == "system" else 0
+        summary = None
+        if start < len(messages) and messages[start]["role"] == "system" \
+                and str(messages[start].get("content", "")).startswith(SUMMARY_PREFIX):
+            summary = messages[start]
+            start += 1
+        tail = self._protected_tail(messages, start)
+
+        # 1. Truncate old tool outputs
+        for i in range(start, tail):
+            if total <= self.max_tokens:
+                return total
+            message = messages[i]
+            content = message.get("content") or ""
+            if message["role"] != "tool" or len(content) <= self.tool_output_chars:
+                continue
+            before = self.message_tokens(message)
+            truncated = dict(message, content=content[:self.tool_output_chars] + TRUNCATION_MARKER)
+            messages[i] = truncated
+            total += self.message_tokens(truncated) - before
+            self._forget([message])
+
+        if total <= self.max_tokens:
+            return total
+
+        # 2. Drop the oldest turns, a tool_calls message goes with its results. The
+        # latest user message stays: the model must still see the request it answers
+        question = self._latest_question(messages, start, tail)
+        end = start
+        while end < tail and total > self.max_tokens:
+            if end != question:
+                total -= self.message_tokens(messages[end])
+            end += 1
+            while end < tail and messages[end]["role"] == "tool":
+                total -= self.message_tokens(messages[end])
+                end += 1
+
+        dropped = [message for i, message in enumerate(messages[start:end], start) if i != question]
+        if not dropped:
+            return total
+        messages[start:end] = [messages[question]] if question is not None and question < end else []
+        self._forget(dropped)
+
+        if self.summarize:
+            previous = [summary] if summary else []
+            text = self.summarize(previous + dropped)
+            new_summary = {"role": "system", "content": SUMMARY_PREFIX + text}
+            if summary:
+                total -= self.message_tokens(summary)
+                self._forget([summary])
+                messages[start - 1] = new_summary
+            else:
+                messages.insert(start, new_summary)
+            total += self.message_tokens(new_summary)
+
+        return total
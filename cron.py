@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+
+# (name, first value, last value) of the 5 cron fields
+FIELDS = [
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day of month", 1, 31),
+    ("month", 1, 12),
+    ("day of week", 0, 7),
+]
+
+MONTH_NAMES = {name: i + 1 for i, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"])}
+DAY_NAMES = {name: i for i, name in enumerate(["sun", "mon", "tue", "wed", "thu", "fri", "sat"])}
+
+# A valid expression fires at least once in 28 years (the Gregorian weekday cycle)
+MAX_YEARS = 28
+
+
+def _next_bit(mask, start):
+    """Lowest set bit of mask at position >= start, None if there is none"""
+    shifted = mask >> start
+    if not shifted:
+        return None
+    return start + (shifted & -shifted).bit_length() - 1
+
+
+def _parse_value(text, names, field):
+    text = text.lower()
+    if names and text in names:
+        return names[text]
+    if not text.isdigit():
+        raise ValueError(f"Invalid {field} value: {text!r}")
+    return int(text)
+
+
+def _parse_field(text, field, low, high, names=None):
+    """Bitset with bit i set when value i matches the field"""
+    mask = 0
+    for part in text.split(","):
+        expr, _, step = part.partition("/")
+        step = int(step) if step.isdigit() and int(step) > 0 else (1 if not step else None)
+        if step is None:
+            raise ValueError(f"Invalid step in {field}: {part!r}")
+
+        if expr == "*":
+            start, end = low, high
+        elif "-" in expr:
+            start, end = (_parse_value(v, names, field) for v in expr.split("-", 1))
+        else:
+            start = _parse_value(expr, names, field)
+            end = high if step != 1 or "/" in part else start
+
+        if not (low <= start <= end <= high):
+            raise ValueError(f"Invalid {field} range: {part!r} (allowed {low}-{high})")
+        for value in range(start, end + 1, step):
+            mask |= 1 << value
+    return mask
+
+
+class CronExpression:
+    """Standard 5-field cron expression compiled into bitsets
+
+    Supports *, lists, ranges, steps and month/day names. As in cron, when
+    both day of month and day of week are restricted a day matching either
+    one fires.
+    """
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError("Invalid cron expression - must have 5 parts")
+        self.expression = expression
+
+        names = [None, None, None, MONTH_NAMES, DAY_NAMES]
+        masks = [_parse_field(text, field, low, high, n)
+                 for text, (field, low, high), n in zip(parts, FIELDS, names)]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = masks
+        # Sunday is both 0 and 7
+        if self.weekdays & (1 << 7):
+            self.weekdays = (self.weekdays | 1) & ~(1 << 7)
+        # As in Vixie cron, a field starting with "*" (also "*/N") does not restrict the day
+        self.any_day = parts[2].startswith("*")
+        self.any_weekday = parts[4].startswith("*")
+
+        if self.next_fire(datetime(2000, 1, 1)) is None:
+            raise ValueError(f"Cron expression never fires: {expression!r}")
+
+    def __repr__(self):
+        return f"CronExpression({self.expression!r})"
+
+    def _day_matches(self, date):
+        day = bool(self.days >> date.day & 1)
+        weekday = bool(self.weekdays >> (date.isoweekday() % 7) & 1)
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_fire(self, after):
+        """First firing time strictly after the given datetime, None if there is none"""
+        current = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = after.year + MAX_YEARS
+
+        while current.year <= limit:
+            if not self.months >> current.month & 1:
+                month = _next_bit(self.months, current.month + 1)
+                if month is None:
+                    current = datetime(current.year + 1, 1, 1)
+                else:
+                    current = datetime(current.year, month, 1)
+                continue
+
+            if not self._day_matches(current):
+                current = datetime(current.year, current.month, current.day) + timedelta(days=1)
+                continue
+
+            hour = _next_bit(self.hours, current.hour)
+            if hour is None:
+                current = datetime(current.year, current.month, current.day) + timedelta(days=1)
+                continue
+            if hour != current.hour:
+                current = current.replace(hour=hour, minute=0)
+
+            minute = _next_bit(self.minutes, current.minute)
+            if minute is None:
+                current = current.replace(minute=0) + timedelta(hours=1)
+                continue
+            return current.replace(minute=minute)
+
+        return None
+
+
+def validate_cron(expression):
+    """Raise ValueError if the expression is not a valid cron expression"""
+    CronExpression(expression)
@@ -0,0 +1,82 @@
+import json
+import time
+
+from tools import PARALLEL_SAFE_TOOLS, ToolMemo
+
+FORCE_FINAL_PROMPT = (
+    "Stop calling tools ({reason}). Use the final_response tool now to answer the user "
+    "with the results gathered so far, and say what could not be completed."
+)
+
+# tool_choice forcing the model to answer through final_response
+FINAL_TOOL_CHOICE = {"type": "function", "function": {"name": "final_response"}}
+
+
+class LoopGuard:
+    """Limits of one process_conversation call
+
+    When a cap is reached, or the model issues the same set of tool calls
+    max_repeats times with no state-changing call in between, the agent stops
+    running tools and forces a final_response. None disables a cap.
+    """
+    def __init__(self, max_iterations=20, max_seconds=None, max_tokens=None, max_repeats=3, memoize=True):
+        self.max_iterations = max_iterations
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.max_repeats = max_repeats
+        # Answer repeated parallel-safe calls from the earlier result
+        self.memoize = memoize
+
+    def start(self, parallel_safe=PARALLEL_SAFE_TOOLS):
+        return ConversationGuard(self, parallel_safe)
+
+
+class ConversationGuard:
+    """Loop guard state of a single conversation turn"""
+    def __init__(self, limits, parallel_safe=PARALLEL_SAFE_TOOLS):
+        self.limits = limits
+        self.parallel_safe = parallel_safe
+        self.started = time.perf_counter()
+        self.memo = ToolMemo() if limits.memoize else None
+        self.seen = {}
+        self.cycle = None
+
+    def observe(self, tool_calls):
+        """Record the tool calls of an iteration, detecting repeated sets of calls"""
+        signature = tuple(sorted(ToolMemo.key(tc) for tc in tool_calls))
+        if any(tc.function.name not in self.parallel_safe for tc in tool_calls):
+            # The state changes, reading it again afterwards is not a cycle, repeating this change is
+            self.seen = {signature: self.seen.get(signature, 0)}
+        count = self.seen[signature] = self.seen.get(signature, 0) + 1
+        if self.limits.max_repeats and count >= self.limits.max_repeats:
+            names = ", ".join(sorted({str(name) for name, _ in signature}))
+            self.cycle = f"repeated the same calls {count} times: {names}"
+
+    def check(self, stats):
+        """Reason to stop the loop before the next LLM call, None to go on"""
+        limits = self.limits
+        if self.cycle:
+            return self.cycle
+        if limits.max_iterations and stats.iterations >= limits.max_iterations:
+            return f"reached {limits.max_iterations} iterations"
+        if limits.max_seconds and time.perf_counter() - self.started >= limits.max_seconds:
+            return f"exceeded {limits.max_seconds}s"
+        if limits.max_tokens and stats.total_tokens >= limits.max_tokens:
+            return f"used {stats.total_tokens} of {limits.max_tokens} tokens"
+        return None
+
+    @property
+    def memo_hits(self):
+        return self.memo.hits if self.memo else 0
+
+
+def force_final_messages(messages, reason):
+    """Messages of the last LLM call, the instruction is not kept in the conversation"""
+    return messages + [{"role": "system", "content": FORCE_FINAL_PROMPT.format(reason=reason)}]
+
+
+def fallback_response(reason, messages):
+    """Used when even the forced call gives no answer: the last tool results"""
+    results = [m["content"] for m in messages if m.get("role") == "tool"][-3:]
+    return f"Stopped before completing the request ({reason}). Last results:\n" + "\n".join(
+        r if isinstance(r, str) else json.dumps(r) for r in results)
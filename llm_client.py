@@ -0,0 +1,206 @@
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from types import SimpleNamespace
+
+from context import count_message_tokens
+
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket, reserve() returns how long to wait instead of sleeping"""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Amounts larger than the bucket would never fit, let them drain it
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """Requests/sec and tokens/min limits shared by every client of a base_url"""
+    def __init__(self, requests_per_second=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_second) if requests_per_second else None
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, tokens=0):
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def acquire(self, tokens=0):
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        wait = self.reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def adjust(self, estimated, actual):
+        """Charge the difference between estimated and actual token usage"""
+        if not self.tokens or actual is None:
+            return
+        if actual > estimated:
+            self.tokens.reserve(actual - estimated)
+        else:
+            self.tokens.refund(estimated - actual)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, Retry-After wins when the server sends it"""
+    def __init__(self, max_retries=5, base_delay=0.5, max_delay=30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, exc, attempt):
+        if attempt >= self.max_retries:
+            return False
+        status = getattr(exc, "status_code", None)
+        if status is not None:
+            return status in RETRY_STATUS_CODES
+        # Connection errors and timeouts have no status code
+        return type(exc).__name__ in ("APIConnectionError", "APITimeoutError")
+
+    def delay(self, exc, attempt):
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+def _retry_after(exc):
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(kwargs):
+    return sum(count_message_tokens(message) for message in kwargs.get("messages", []))
+
+
+class LLMClient:
+    """OpenAI-compatible client with shared rate limiting and retries
+
+    Exposes chat.completions.create like the wrapped client, so it is a
+    drop-in replacement for Agent.client.
+    """
+    def __init__(self, client, limiter=None, retry=None):
+        self.client = client
+        self.limiter = limiter or RateLimiter()
+        self.retry = retry or RetryPolicy()
+        self.retries = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        estimated = estimate_tokens(kwargs)
+        attempt = 0
+        while True:
+            self.limiter.acquire(estimated)
+            try:
+                response = self.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                if not self.retry.should_retry(e, attempt):
+                    raise
+                self.retries += 1
+                time.sleep(self.retry.delay(e, attempt))
+                attempt += 1
+                continue
+            usage = getattr(response, "usage", None)
+            self.limiter.adjust(estimated, getattr(usage, "total_tokens", None))
+            return response
+
+
+class AsyncLLMClient(LLMClient):
+    async def create(self, **kwargs):
+        estimated = estimate_tokens(kwargs)
+        attempt = 0
+        while True:
+            await self.limiter.acquire_async(estimated)
+            try:
+                response = await self.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                if not self.retry.should_retry(e, attempt):
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.retry.delay(e, attempt))
+                attempt += 1
+                continue
+            usage = getattr(response, "usage", None)
+            self.limiter.adjust(estimated, getattr(usage, "total_tokens", None))
+            return response
+
+
+_limiters = {}
+_clients = {}
+_lock = threading.Lock()
+
+
+def shared_client(factory, api_key, base_url, asynchronous=False, requests_per_second=None,
+                  tokens_per_minute=None, max_retries=5):
+    """One client per (base_url, api_key), one rate limiter per base_url and limits
+
+    factory is the OpenAI (or AsyncOpenAI) class. Sharing its instance shares
+    its pool of keep-alive connections. The SDK's own retries are disabled in
+    favour of RetryPolicy. Callers with the same limits share their budget,
+    other limits get their own limiter. The connections of an async client
+    belong to the event loop they were opened on, so each running loop gets
+    its own async client.
+    """
+    loop = None
+    if asynchronous:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+    with _lock:
+        limits = (base_url, requests_per_second, tokens_per_minute)
+        limiter = _limiters.get(limits)
+        if limiter is None:
+            limiter = _limiters[limits] = RateLimiter(requests_per_second, tokens_per_minute)
+
+        key = (base_url, api_key, asynchronous, limits, loop)
+        if key not in _clients:
+            # Clients of loops that are closed can't be used again
+            for closed in [k for k in _clients if k[4] is not None and k[4].is_closed()]:
+                del _clients[closed]
+            client = factory(api_key=api_key, base_url=base_url, max_retries=0)
+            wrapper = AsyncLLMClient if asynchronous else LLMClient
+            _clients[key] = wrapper(client, limiter, RetryPolicy(max_retries))
+        return _clients[key]
@@ -0,0 +1,151 @@
+import json
+import os
+import sys
+import threading
+import time
+
+# Debug prints of the agent loop and the tools, silence them with set_verbose(False)
+VERBOSE = True
+
+
+def set_verbose(verbose):
+    global VERBOSE
+    VERBOSE = verbose
+
+
+def log(*args, **kwargs):
+    if VERBOSE:
+        print(*args, **kwargs)
+
+
+class TurnStats:
+    """Measurements of one process_conversation call"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.latency = None
+        self.iterations = 0
+        self.llm_calls = 0
+        self.cache_hits = 0
+        self.tool_calls = 0
+        self.memo_hits = 0
+        # Prompt tokens of tool schemas the tool selection did not send
+        self.tool_tokens_saved = 0
+        # Times the model called a tool that was left out, every tool was sent afterwards
+        self.tool_fallbacks = 0
+        # Why the loop guard stopped the turn, None when the model answered on its own
+        self.stopped = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add_usage(self, usage):
+        if usage is not None:
+            self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+            self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def finish(self):
+        self.latency = time.perf_counter() - self.started
+        return self
+
+    def as_dict(self):
+        return {
+            "iterations": self.iterations,
+            "llm_calls": self.llm_calls,
+            "cache_hits": self.cache_hits,
+            "tool_calls": self.tool_calls,
+            "memo_hits": self.memo_hits,
+            "tool_tokens_saved": self.tool_tokens_saved,
+            "tool_fallbacks": self.tool_fallbacks,
+            "stopped": self.stopped,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "latency": self.latency,
+        }
+
+
+class Metrics:
+    """Forwards agent loop events to sinks, emit() is a no-op without sinks
+
+    Events: llm_call (latency, tokens, cached, tool_tokens_saved), tool_call (tool, latency),
+    turn (TurnStats fields).
+    """
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def emit(self, event, **fields):
+        if not self.sinks:
+            return
+        fields["event"] = event
+        fields["ts"] = time.time()
+        for sink in self.sinks:
+            sink.handle(fields)
+
+
+NULL_METRICS = Metrics()
+
+
+class JsonLinesSink:
+    """One JSON object per event, to a file path or an open stream"""
+    def __init__(self, target=sys.stderr):
+        self.stream = open(target, 'a') if isinstance(target, str) else target
+        self.lock = threading.Lock()
+
+    def handle(self, record):
+        line = json.dumps(record, default=str)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+class PrometheusSink:
+    """Aggregates events into counters, render() returns the Prometheus text format"""
+    def __init__(self, prefix="agent"):
+        self.prefix = prefix
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def _add(self, name, value, labels=""):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def handle(self, record):
+        event = record["event"]
+        with self.lock:
+            if event == "llm_call":
+                self._add("llm_calls_total", 1)
+                self._add("llm_latency_seconds_sum", record["latency"])
+                self._add("llm_cache_hits_total", 1 if record.get("cached") else 0)
+                self._add("tokens_total", record.get("prompt_tokens", 0), 'type="prompt"')
+                self._add("tokens_total", record.get("completion_tokens", 0), 'type="completion"')
+                self._add("tool_schema_tokens_saved_total", record.get("tool_tokens_saved", 0))
+            elif event == "tool_call":
+                labels = f'tool="{record["tool"]}"'
+                self._add("tool_calls_total", 1, labels)
+                self._add("tool_latency_seconds_sum", record["latency"], labels)
+            elif event == "turn":
+                self._add("turns_total", 1)
+                self._add("turn_iterations_sum", record["iterations"])
+                self._add("turn_latency_seconds_sum", record["latency"])
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"{metric}{{{labels}}} {value}" if labels else f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the metrics atomically, e.g. for the node_exporter textfile collector"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
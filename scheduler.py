@@ -0,0 +1,195 @@
+import argparse
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from cron import CronExpression
+from metrics import log
+
+
+class SystemClock:
+    def now(self):
+        return datetime.now()
+
+    def wait(self, condition, deadline):
+        """Sleep on condition until deadline (None: until notified)"""
+        timeout = None if deadline is None else max(0.0, (deadline - self.now()).total_seconds())
+        condition.wait(timeout)
+
+
+class SimulatedClock:
+    """Clock that jumps straight to the next deadline, for offline tests and benchmarks"""
+    def __init__(self, start=None):
+        self.current = start or datetime(2025, 1, 1)
+
+    def now(self):
+        return self.current
+
+    def wait(self, condition, deadline):
+        if deadline is not None and deadline > self.current:
+            self.current = deadline
+
+
+def run_objective(objective):
+    """Default dispatch: one fresh conversation per objective, one Agent per worker thread"""
+    from agent import Agent
+    local = run_objective.local
+    if not hasattr(local, "agent"):
+        local.agent = Agent()
+    agent = local.agent
+    messages = [agent.system_prompt, {"role": "user", "content": objective}]
+    return agent.process_conversation(messages)
+
+run_objective.local = threading.local()
+
+
+class Scheduler:
+    """Fires the objectives of a task store at their cron times
+
+    Cron expressions are compiled once per distinct expression. A min-heap
+    holds one entry per cron group with its next firing time. The loop sleeps
+    until the earliest one, so a wakeup costs O(log n) whatever the number
+    of tasks. Objectives of a due group are read from the store at firing time
+    and handed to a bounded worker pool.
+    """
+    def __init__(self, store=None, dispatch=run_objective, clock=None, max_workers=4,
+                 max_queued=None, reload_interval=60):
+        if store is None:
+            from tools import get_task_store
+            store = get_task_store()
+        self.store = store
+        self.dispatch = dispatch
+        self.clock = clock or SystemClock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Dispatching blocks once this many objectives are queued or running
+        self.slots = threading.BoundedSemaphore(max_queued or max_workers * 4)
+        self.reload_interval = timedelta(seconds=reload_interval) if reload_interval else None
+
+        self.condition = threading.Condition()
+        self.compiled = {}
+        self.heap = []
+        self.sequence = itertools.count()
+        self.store_version = None
+        self.next_reload = None
+        self.stopped = False
+        self.fired = 0
+        self.dispatched = 0
+        self.failed = 0
+
+    def compile(self, expression):
+        cron = self.compiled.get(expression)
+        if cron is None:
+            cron = self.compiled[expression] = CronExpression(expression)
+        return cron
+
+    def reload(self):
+        """Rebuild the heap from the store, keeping compiled expressions
+
+        Groups still in the store keep their pending firing time, even one
+        already past, so a late reload never skips a firing. Only new
+        expressions are scheduled from now.
+        """
+        with self.condition:
+            self.store_version = self.store.version()
+            now = self.clock.now()
+            pending = {expression: fire_time for fire_time, _, expression in self.heap}
+            heap = []
+            for expression in self.store.cron_expressions():
+                if expression in pending:
+                    heap.append((pending[expression], next(self.sequence), expression))
+                    continue
+                try:
+                    cron = self.compile(expression)
+                except ValueError as e:
+                    log(f"Skipping invalid cron expression {expression!r}: {e}")
+                    continue
+                fire_time = cron.next_fire(now)
+                if fire_time:
+                    heap.append((fire_time, next(self.sequence), expression))
+            heapq.heapify(heap)
+            self.heap = heap
+            if self.reload_interval:
+                self.next_reload = now + self.reload_interval
+            self.condition.notify_all()
+
+    def notify(self):
+        """Wake the loop, e.g. after tasks were added in this process"""
+        with self.condition:
+            self.store_version = None
+            self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def _run_one(self, objective):
+        try:
+            self.dispatch(objective)
+        except Exception as e:
+            # Workers fail concurrently, the counter is shared state like the heap
+            with self.condition:
+                self.failed += 1
+            log(f"Scheduled objective failed: {objective!r}: {e}")
+        finally:
+            self.slots.release()
+
+    def _fire(self, expression):
+        self.fired += 1
+        for objective in self.store.by_cron(expression):
+            self.slots.acquire()
+            self.dispatched += 1
+            self.executor.submit(self._run_one, objective)
+
+    def run(self, until=None):
+        """Fire due groups until stop() or until the clock passes `until`"""
+        if self.store_version is None:
+            self.reload()
+        simulated = isinstance(self.clock, SimulatedClock)
+        while True:
+            with self.condition:
+                if self.stopped:
+                    break
+                now = self.clock.now()
+                if self.store_version is None or self.next_reload and now >= self.next_reload:
+                    if self.store.version() != self.store_version:
+                        self.reload()
+                    elif self.reload_interval:
+                        self.next_reload = now + self.reload_interval
+
+                if not self.heap or self.heap[0][0] > now:
+                    if until is not None and now >= until or simulated and not self.heap and until is None:
+                        break
+                    deadline = self.heap[0][0] if self.heap else None
+                    for limit in (self.next_reload, until):
+                        if limit is not None and (deadline is None or limit < deadline):
+                            deadline = limit
+                    self.clock.wait(self.condition, deadline)
+                    continue
+
+                fire_time, _, expression = heapq.heappop(self.heap)
+                next_time = self.compiled[expression].next_fire(fire_time)
+                if next_time:
+                    heapq.heappush(self.heap, (next_time, next(self.sequence), expression))
+
+            # Outside the lock: dispatching may block on a full worker pool
+            self._fire(expression)
+
+    def shutdown(self, wait=True):
+        self.stop()
+        self.executor.shutdown(wait=wait)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the scheduled tasks through the agent")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    scheduler = Scheduler(max_workers=args.workers)
+    print("Scheduler running, Ctrl+C to stop")
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.shutdown(wait=False)
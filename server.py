@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import json
+import uuid
+
+from agent import AsyncAgent
+from session_log import SessionLog
+from tools import get_tool_cache
+
+MAX_BODY_SIZE = 1024 * 1024
+
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class Session:
+    """Messages are in the session log, loaded for the length of a turn"""
+    def __init__(self):
+        # One turn at a time per session, different sessions run concurrently
+        self.lock = asyncio.Lock()
+
+
+class AgentServer:
+    """Local HTTP service, every session has its own log of messages
+
+    Sessions survive a restart: a session id found in the log is resumed.
+
+    POST   /sessions                 -> {"session_id": ...}
+    POST   /sessions/<id>/messages   {"content": ...} -> {"response": ...}
+    GET    /sessions/<id>            -> {"messages": [...]}
+    DELETE /sessions/<id>
+    GET    /stats                    -> tool and response cache statistics
+    """
+    def __init__(self, agent=None, session_log=None):
+        self.agent = agent or AsyncAgent()
+        self.session_log = session_log or SessionLog(**self.agent.config.get("session_log", {}))
+        self.sessions = {}
+
+    def session(self, session_id):
+        """Session of an id, resumed from the log after a restart, None when unknown"""
+        session = self.sessions.get(session_id)
+        if session is None and self.session_log.exists(session_id):
+            session = self.sessions[session_id] = Session()
+        return session
+
+    def stats(self):
+        tool_cache = get_tool_cache()
+        response_cache = self.agent.response_cache
+        return {
+            "sessions": len(self.sessions),
+            "tool_cache": tool_cache.stats() if tool_cache is not None else None,
+            "response_cache": response_cache.stats() if response_cache is not None else None,
+        }
+
+    async def handle_request(self, method, path, body):
+        parts = [p for p in path.split("?")[0].split("/") if p]
+
+        if parts == ["stats"]:
+            if method != "GET":
+                return 405, {"error": "Method not allowed"}
+            return 200, self.stats()
+
+        if parts == ["sessions"]:
+            if method != "POST":
+                return 405, {"error": "Method not allowed"}
+            session_id = uuid.uuid4().hex
+            self.session_log.create(session_id)
+            self.sessions[session_id] = Session()
+            return 201, {"session_id": session_id}
+
+        if len(parts) < 2 or parts[0] != "sessions":
+            return 404, {"error": "Not found"}
+
+        session = self.session(parts[1])
+        if session is None:
+            return 404, {"error": f"Unknown session: {parts[1]}"}
+
+        if len(parts) == 2:
+            if method == "GET":
+                messages = await asyncio.to_thread(self.session_log.read, parts[1])
+                return 200, {"messages": [self.agent.system_prompt] + messages}
+            if method == "DELETE":
+                async with session.lock:
+                    self.sessions.pop(parts[1], None)
+                    self.session_log.delete(parts[1])
+                return 200, {"deleted": parts[1]}
+            return 405, {"error": "Method not allowed"}
+
+        if parts[2:] == ["messages"] and method == "POST":
+            try:
+                content = json.loads(body)["content"]
+            except (ValueError, KeyError, TypeError):
+                return 400, {"error": "Body must be a JSON object with a 'content' field"}
+            async with session.lock:
+                size = await asyncio.to_thread(self.session_log.size, parts[1])
+                messages = await asyncio.to_thread(self.session_log.load, parts[1], self.agent.system_prompt)
+                try:
+                    messages.append({"role": "user", "content": content})
+                    result = await self.agent.process_conversation(messages)
+                except BaseException:
+                    # A failed turn leaves no trace, a retry does not send the question twice
+                    await asyncio.to_thread(self.session_log.rollback, parts[1], size)
+                    raise
+                finally:
+                    # The reply is sent once the turn is on disk
+                    await asyncio.to_thread(self.session_log.release, parts[1])
+            return 200, {"response": result}
+
+        return 404, {"error": "Not found"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode("latin-1").split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_SIZE:
+                    await self.write_response(writer, 413, {"error": "Body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                try:
+                    status, payload = await self.handle_request(method, path, body)
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                await self.write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def write_response(self, writer, status, payload, keep_alive=True):
+        body = json.dumps(payload).encode()
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode() + body)
+        await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8000):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Agent service listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the agent over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    asyncio.run(AgentServer().serve(args.host, args.port))
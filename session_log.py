@@ -0,0 +1,218 @@
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def _lines_backwards(path, block_size=65536):
+    """Non empty lines of a file from the last one to the first"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        rest = b""
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + rest).split(b"\n")
+            rest = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield line
+        if rest.strip():
+            yield rest
+
+
+def _decode(line):
+    # The last line of a session that crashed mid write is not valid JSON
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+class SessionMessages(list):
+    """Messages sent to the model, the ones appended are written to the session log
+
+    Only append is logged: it is how the agent loop adds messages, while the
+    ContextManager rewrites the list in place without changing the history.
+    """
+    def __init__(self, log, session_id, messages=()):
+        super().__init__(messages)
+        self.log = log
+        self.session_id = session_id
+
+    def append(self, message):
+        self.log.append(self.session_id, message)
+        super().append(message)
+
+
+def _fsync(fd):
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _ActiveSession:
+    """Open log file of a session running a turn"""
+    def __init__(self, f):
+        self.file = f
+        # Appends not fsynced yet
+        self.pending = 0
+        # Background fsync of the last batch, if any
+        self.syncing = None
+        # Orders the writes of this session, the other sessions never wait on it
+        self.lock = threading.Lock()
+
+
+class SessionLog:
+    """Append-only JSON lines file per session, one record per message
+
+    append() only writes the record to the OS, it never fsyncs: it runs on
+    the event loop of the server. Every sync_every appends the batch is
+    fsynced on a background thread, and release() fsyncs the rest before the
+    reply is sent, so a turn costs one or a few fsyncs and none on the loop.
+    load() reads the last `window` messages from the end of the file,
+    starting at a user message so tool calls keep their results: memory holds
+    the window of the sessions running a turn, nothing for the idle ones.
+    """
+    def __init__(self, directory="sessions", window=50, sync_every=16):
+        self.directory = directory
+        self.window = window
+        self.sync_every = sync_every
+        # session id -> _ActiveSession, only for active sessions
+        self._files = {}
+        # Guards _files, never held while writing or syncing
+        self._lock = threading.Lock()
+        self._syncer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-fsync")
+
+    def path(self, session_id):
+        if not SESSION_ID.match(session_id):
+            raise ValueError(f"invalid session id: {session_id!r}")
+        return os.path.join(self.directory, f"{session_id}.jsonl")
+
+    def exists(self, session_id):
+        try:
+            return os.path.exists(self.path(session_id))
+        except ValueError:
+            return False
+
+    def create(self, session_id):
+        os.makedirs(self.directory, exist_ok=True)
+        open(self.path(session_id), 'a').close()
+
+    def _open(self, session_id):
+        with self._lock:
+            entry = self._files.get(session_id)
+            if entry is None:
+                os.makedirs(self.directory, exist_ok=True)
+                path = self.path(session_id)
+                f = open(path, 'ab')
+                # Terminate a line left half written by a crash
+                if f.tell():
+                    with open(path, 'rb') as last:
+                        last.seek(-1, os.SEEK_END)
+                        if last.read(1) != b"\n":
+                            f.write(b"\n")
+                entry = self._files[session_id] = _ActiveSession(f)
+            return entry
+
+    def append(self, session_id, message):
+        line = json.dumps(message, ensure_ascii=False, default=str).encode() + b"\n"
+        entry = self._open(session_id)
+        with entry.lock:
+            entry.file.write(line)
+            # Reaches the OS at once, a worker crash loses nothing
+            entry.file.flush()
+            entry.pending += 1
+            if entry.pending >= self.sync_every:
+                entry.pending = 0
+                # The copy of the descriptor stays valid if the session is released meanwhile
+                entry.syncing = self._syncer.submit(_fsync, os.dup(entry.file.fileno()))
+
+    def _sync(self, entry):
+        with entry.lock:
+            if entry.syncing is not None:
+                entry.syncing.result()
+                entry.syncing = None
+            if entry.pending:
+                os.fsync(entry.file.fileno())
+                entry.pending = 0
+
+    def sync(self, session_id=None):
+        """fsync the pending appends of a session, or of every active session, blocks"""
+        with self._lock:
+            entries = [self._files.get(session_id)] if session_id is not None else list(self._files.values())
+        for entry in entries:
+            if entry is not None:
+                self._sync(entry)
+
+    def release(self, session_id):
+        """The session is idle: fsync its appends and close its file, blocks"""
+        with self._lock:
+            entry = self._files.pop(session_id, None)
+        if entry:
+            self._sync(entry)
+            entry.file.close()
+
+    def size(self, session_id):
+        """Length of the session log, a point rollback() can return to"""
+        with self._lock:
+            entry = self._files.get(session_id)
+        if entry:
+            with entry.lock:
+                entry.file.flush()
+        try:
+            return os.path.getsize(self.path(session_id))
+        except FileNotFoundError:
+            return 0
+
+    def rollback(self, session_id, size):
+        """Drop the records appended after size, those of a turn that failed"""
+        entry = self._open(session_id)
+        with entry.lock:
+            entry.file.truncate(size)
+            os.fsync(entry.file.fileno())
+            entry.pending = 0
+
+    def close(self):
+        for session_id in list(self._files):
+            self.release(session_id)
+
+    def read(self, session_id):
+        """Every message of a session, oldest first"""
+        if not self.exists(session_id):
+            return []
+        with open(self.path(session_id), 'rb') as f:
+            return [message for message in map(_decode, f) if message is not None]
+
+    def recent(self, session_id, window=None):
+        """The last messages of a session, the first one is a user message when there is one"""
+        window = window or self.window
+        if not self.exists(session_id):
+            return []
+        messages = []
+        for line in _lines_backwards(self.path(session_id)):
+            message = _decode(line)
+            if message is None:
+                continue
+            messages.append(message)
+            # Past the window, go on back to the user message that starts the turn
+            if len(messages) >= window and message.get("role") == "user":
+                break
+        messages.reverse()
+        return messages
+
+    def load(self, session_id, system_prompt=None, window=None):
+        """SessionMessages of a session: the system prompt, then its recent messages"""
+        head = [system_prompt] if system_prompt else []
+        return SessionMessages(self, session_id, head + self.recent(session_id, window))
+
+    def delete(self, session_id):
+        self.release(session_id)
+        if self.exists(session_id):
+            os.remove(self.path(session_id))
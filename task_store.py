@@ -0,0 +1,460 @@
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock shared by threads and processes, held on a side file"""
+    with open(path, 'a+') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ObjectiveIndex:
+    """Trigram index answering case-insensitive substring queries over objectives"""
+    def __init__(self, version=None):
+        self.version = version
+        self.entries = {}
+        self.postings = defaultdict(set)
+        self.next_id = 0
+
+    def add(self, entry_id, cron_expression, objective):
+        self.entries[entry_id] = (cron_expression, objective)
+        self.next_id = max(self.next_id, entry_id + 1)
+        for gram in trigrams(objective.lower()):
+            self.postings[gram].add(entry_id)
+
+    def remove(self, entry_id):
+        cron_expression, objective = self.entries.pop(entry_id)
+        for gram in trigrams(objective.lower()):
+            ids = self.postings[gram]
+            ids.discard(entry_id)
+            if not ids:
+                del self.postings[gram]
+
+    def search(self, text):
+        """Ids of the objectives containing text, in insertion order"""
+        text = text.lower()
+        grams = trigrams(text)
+        if grams:
+            postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set.intersection(*postings) if postings[0] else set()
+        else:
+            # Queries shorter than 3 characters have no trigram, check every entry
+            candidates = self.entries.keys()
+        return sorted(i for i in candidates if text in self.entries[i][1].lower())
+
+
+class TaskStore:
+    """Scheduled objectives grouped by cron expression
+
+    Every backend keeps an ObjectiveIndex in sync with its own writes. The
+    index is rebuilt when version() shows another process changed the store.
+    """
+    def add(self, cron_expression, objectives):
+        raise NotImplementedError
+
+    def all(self):
+        """Return {cron_expression: [objective, ...]} in insertion order"""
+        raise NotImplementedError
+
+    def by_cron(self, cron_expression):
+        return self.all().get(cron_expression, [])
+
+    def cron_expressions(self):
+        return list(self.all())
+
+    def delete_matching(self, text):
+        """Delete objectives containing text (case-insensitive), returns how many were deleted"""
+        raise NotImplementedError
+
+    def version(self):
+        """Changes every time the stored tasks change"""
+        raise NotImplementedError
+
+    def apply(self, operations):
+        """Replay staged ("add", cron_expression, objectives) and ("delete", text) operations
+
+        Backends override it to apply them all in one atomic write.
+        """
+        for operation in operations:
+            if operation[0] == "add":
+                self.add(operation[1], operation[2])
+            else:
+                self.delete_matching(operation[1])
+
+    def _rows(self):
+        """(id, cron_expression, objective) of every stored objective"""
+        raise NotImplementedError
+
+    def index(self):
+        with self._index_lock:
+            version = self.version()
+            if self._index is None or self._index.version != version:
+                index = ObjectiveIndex(version)
+                for entry_id, cron_expression, objective in self._rows():
+                    index.add(entry_id, cron_expression, objective)
+                self._index = index
+            return self._index
+
+    def _update_index(self, old_version, new_version, added=(), removed=()):
+        """Apply our own write to the index, or drop it if it missed a write"""
+        with self._index_lock:
+            if self._index is None or self._index.version != old_version:
+                self._index = None
+                return
+            for entry_id in removed:
+                self._index.remove(entry_id)
+            for entry_id, cron_expression, objective in added:
+                self._index.add(entry_id, cron_expression, objective)
+            self._index.version = new_version
+
+    def search(self, text):
+        """(cron_expression, objective) pairs containing text, without deleting them"""
+        index = self.index()
+        with self._index_lock:
+            return [index.entries[i] for i in index.search(text) if i in index.entries]
+
+
+class JsonTaskStore(TaskStore):
+    """The original scheduled_tasks.json layout
+
+    Writes take a lock file and replace the file with an atomic rename, reads
+    reuse the parsed content until the file changes on disk.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self._cached = None
+        self._cached_stat = None
+        self._index = None
+        self._index_lock = threading.RLock()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _read(self):
+        stat = self._stat()
+        if stat is None:
+            return {}
+        if stat != self._cached_stat:
+            with open(self.path, 'r') as f:
+                self._cached = json.load(f)
+            self._cached_stat = stat
+        return self._cached
+
+    def _write(self, tasks):
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(tasks, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def version(self):
+        return self._stat()
+
+    def _rows(self):
+        entry_id = 0
+        for cron_expr, objectives in self._read().items():
+            for objective in objectives:
+                yield entry_id, cron_expr, objective
+                entry_id += 1
+
+    def add(self, cron_expression, objectives):
+        with file_lock(self.lock_path):
+            old_version = self.version()
+            tasks = {cron: list(objs) for cron, objs in self._read().items()}
+            tasks.setdefault(cron_expression, []).extend(objectives)
+            self._write(tasks)
+
+            next_id = self._index.next_id if self._index else 0
+            added = [(next_id + i, cron_expression, objective) for i, objective in enumerate(objectives)]
+            self._update_index(old_version, self.version(), added=added)
+
+    def all(self):
+        return {cron: list(objectives) for cron, objectives in self._read().items()}
+
+    def by_cron(self, cron_expression):
+        return list(self._read().get(cron_expression, []))
+
+    def cron_expressions(self):
+        return list(self._read())
+
+    def delete_matching(self, text):
+        with file_lock(self.lock_path):
+            index = self.index()
+            ids = index.search(text)
+            if not ids:
+                return 0
+
+            # Every objective with a matched (cron, text) pair contains text too
+            matched = {index.entries[i] for i in ids}
+            remaining = {}
+            for cron_expr, objectives in self._read().items():
+                kept = [obj for obj in objectives if (cron_expr, obj) not in matched]
+                if kept:
+                    remaining[cron_expr] = kept
+            old_version = index.version
+            self._write(remaining)
+            self._update_index(old_version, self.version(), removed=ids)
+        return len(ids)
+
+    def apply(self, operations):
+        with file_lock(self.lock_path):
+            tasks = {cron: list(objs) for cron, objs in self._read().items()}
+            for operation in operations:
+                if operation[0] == "add":
+                    tasks.setdefault(operation[1], []).extend(operation[2])
+                else:
+                    tasks = _delete_matching(tasks, operation[1])
+            self._write(tasks)
+            # Rebuilt on the next search
+            with self._index_lock:
+                self._index = None
+
+
+class SqliteTaskStore(TaskStore):
+    """SQLite backend in WAL mode, objectives are indexed by cron expression"""
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    cron_expression TEXT NOT NULL,
+                    objective TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_cron ON tasks (cron_expression)")
+            # Bumped by every write, tells other processes their index is stale
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+        self._index = None
+        self._index_lock = threading.RLock()
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # Same case-insensitive match as the index, SQLite lower() only folds ASCII
+            conn.create_function("contains_text", 2, lambda objective, text: text in objective.lower(),
+                                 deterministic=True)
+            self.local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._conn())
+
+    def version(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def _bump_version(self, conn):
+        old_version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+        conn.execute("UPDATE meta SET value = ? WHERE key = 'version'", (old_version + 1,))
+        return old_version
+
+    def _rows(self):
+        return self._conn().execute("SELECT id, cron_expression, objective FROM tasks ORDER BY id")
+
+    def add(self, cron_expression, objectives):
+        added = []
+        with self._transaction() as conn:
+            old_version = self._bump_version(conn)
+            for objective in objectives:
+                cursor = conn.execute(
+                    "INSERT INTO tasks (cron_expression, objective) VALUES (?, ?)",
+                    (cron_expression, objective)
+                )
+                added.append((cursor.lastrowid, cron_expression, objective))
+        self._update_index(old_version, old_version + 1, added=added)
+
+    def all(self):
+        tasks = {}
+        rows = self._conn().execute("SELECT cron_expression, objective FROM tasks ORDER BY id")
+        for cron_expr, objective in rows:
+            tasks.setdefault(cron_expr, []).append(objective)
+        return tasks
+
+    def cron_expressions(self):
+        rows = self._conn().execute("SELECT DISTINCT cron_expression FROM tasks")
+        return [cron_expr for (cron_expr,) in rows]
+
+    def by_cron(self, cron_expression):
+        rows = self._conn().execute(
+            "SELECT objective FROM tasks WHERE cron_expression = ? ORDER BY id", (cron_expression,))
+        return [objective for (objective,) in rows]
+
+    def delete_matching(self, text):
+        with self._transaction() as conn:
+            # Writers are serialized by BEGIN IMMEDIATE, the index can't change under us
+            ids = self.index().search(text)
+            if not ids:
+                return 0
+            old_version = self._bump_version(conn)
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                conn.execute(f"DELETE FROM tasks WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+        self._update_index(old_version, old_version + 1, removed=ids)
+        return len(ids)
+
+    def apply(self, operations):
+        with self._transaction() as conn:
+            self._bump_version(conn)
+            for operation in operations:
+                if operation[0] == "add":
+                    conn.executemany("INSERT INTO tasks (cron_expression, objective) VALUES (?, ?)",
+                                     [(operation[1], objective) for objective in operation[2]])
+                else:
+                    conn.execute("DELETE FROM tasks WHERE contains_text(objective, ?)", (operation[1].lower(),))
+        with self._index_lock:
+            self._index = None
+
+
+class StagedTaskStore(TaskStore):
+    """Writes of a unit of work, kept in memory until commit()
+
+    Reads see the underlying store with the staged writes applied. commit()
+    hands the operations to store.apply(), a single write for the JSON and
+    SQLite backends, rollback() forgets them.
+    """
+    # Staged stores are short lived, their id() is reused: version() carries a token instead
+    _tokens = itertools.count()
+
+    def __init__(self, store):
+        self.store = store
+        self.token = next(self._tokens)
+        self.operations = []
+        self.tasks = None
+        self.lock = threading.RLock()
+
+    def _view(self):
+        if self.tasks is None:
+            self.tasks = self.store.all()
+        return self.tasks
+
+    def add(self, cron_expression, objectives):
+        with self.lock:
+            self._view().setdefault(cron_expression, []).extend(objectives)
+            self.operations.append(("add", cron_expression, list(objectives)))
+
+    def all(self):
+        with self.lock:
+            if not self.operations:
+                return self.store.all()
+            return {cron: list(objectives) for cron, objectives in self._view().items()}
+
+    def delete_matching(self, text):
+        with self.lock:
+            tasks = self._view()
+            before = sum(len(objectives) for objectives in tasks.values())
+            self.tasks = _delete_matching(tasks, text)
+            deleted = before - sum(len(objectives) for objectives in self.tasks.values())
+            if deleted:
+                self.operations.append(("delete", text))
+            return deleted
+
+    def search(self, text):
+        with self.lock:
+            if not self.operations:
+                return self.store.search(text)
+            text = text.lower()
+            return [(cron, objective) for cron, objectives in self._view().items()
+                    for objective in objectives if text in objective.lower()]
+
+    def version(self):
+        return (self.token, self.store.version(), len(self.operations))
+
+    def commit(self):
+        """Apply the staged writes, returns how many operations were applied"""
+        with self.lock:
+            operations, self.operations, self.tasks = self.operations, [], None
+        if operations:
+            self.store.apply(operations)
+        return len(operations)
+
+    def rollback(self):
+        with self.lock:
+            self.operations, self.tasks = [], None
+
+
+def _delete_matching(tasks, text):
+    """Copy of tasks without the objectives containing text (case-insensitive)"""
+    text = text.lower()
+    remaining = {}
+    for cron_expr, objectives in tasks.items():
+        kept = [objective for objective in objectives if text not in objective.lower()]
+        if kept:
+            remaining[cron_expr] = kept
+    return remaining
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, rolled back if the block raises"""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def open_task_store(path):
+    """SQLite for .db/.sqlite/.sqlite3 paths, the JSON layout otherwise"""
+    if os.path.splitext(path)[1] in (".db", ".sqlite", ".sqlite3"):
+        return SqliteTaskStore(path)
+    return JsonTaskStore(path)
+
+
+def migrate(source, destination):
+    """Copy every task of source into destination, returns the number of objectives copied"""
+    copied = 0
+    for cron_expr, objectives in source.all().items():
+        destination.add(cron_expr, objectives)
+        copied += len(objectives)
+    return copied
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "migrate":
+        print("Usage: python task_store.py migrate scheduled_tasks.json tasks.db")
+        sys.exit(1)
+    count = migrate(open_task_store(sys.argv[2]), open_task_store(sys.argv[3]))
+    print(f"Migrated {count} objectives from {sys.argv[2]} to {sys.argv[3]}")
@@ -1,9 +1,38 @@
 import unittest
-from unittest.mock import patch, MagicMock
+import asyncio
+from unittest.mock import patch, MagicMock, AsyncMock
+from contextlib import redirect_stdout
+import io
 import json
-from pathlib import Path
-from agent import Agent
-from tools import tools, handle_tool_call, TASKS_FILE
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+from fractions import Fraction
+from agent import Agent, AsyncAgent, StreamAccumulator
+from server import AgentServer
+from session_log import SessionLog
+from cache import GenerationCache, ResponseCache, SampleCounter
+from task_store import JsonTaskStore, SqliteTaskStore, ObjectiveIndex, migrate
+from cron import CronExpression
+from scheduler import Scheduler, SimulatedClock
+from metrics import Metrics, PrometheusSink, set_verbose
+from config import load_config
+from guard import FINAL_TOOL_CHOICE, LoopGuard
+from tool_selection import ToolSelector
+from answers import compare_answers, extract_answer
+import array_tree
+from array_tree import ArrayTree
+from benchmarks.consistency import load_fixtures, rule_based_report
+from batch import BatchRunner, completed_ids
+from llm_client import LLMClient, RateLimiter, RetryPolicy, TokenBucket, shared_client
+from context import ContextManager, TRUNCATION_MARKER, SUMMARY_PREFIX
+from typing import Annotated
+import tools as tools_module
+from tools import tools, handle_tool_call, tool, TOOLS, TASKS_FILE, ToolExecutor, ToolMemo, ToolCache, get_tool_cache, set_tool_cache, unit_of_work
 
 class TestAgent(unittest.TestCase):
     def setUp(self):
@@ -75,11 +104,304 @@ class TestAgent(unittest.TestCase):
         
         self.assertEqual(result, "Final answer")
 
+class TestStreaming(unittest.TestCase):
+    def chunk(self, content=None, index=None, call_id=None, name=None, arguments=None):
+        tool_calls = None
+        if index is not None:
+            tool_calls = [SimpleNamespace(index=index, id=call_id,
+                                          function=SimpleNamespace(name=name, arguments=arguments))]
+        delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+        return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+    def test_stream_tool_calls_and_final_response(self):
+        weather_args = json.dumps({'location': 'Rome, Italy'})
+        final_args = json.dumps({'content': 'It is 24℃ in Rome'})
+        first_turn = [
+            self.chunk(index=0, call_id='call_1', name='get_weather', arguments=''),
+            self.chunk(index=0, arguments=weather_args[:10]),
+            self.chunk(index=0, arguments=weather_args[10:]),
+        ]
+        second_turn = [self.chunk(index=0, call_id='call_2', name='final_response', arguments='')]
+        second_turn += [self.chunk(index=0, arguments=final_args[i:i + 4]) for i in range(0, len(final_args), 4)]
+
+        agent = Agent(stream=True)
+        agent.client = MagicMock()
+        agent.client.chat.completions.create.side_effect = [iter(first_turn), iter(second_turn)]
+
+        deltas = []
+        messages = [{'role': 'user', 'content': 'test'}]
+        result = agent.process_conversation(messages, on_final_delta=deltas.append)
+
+        self.assertEqual(result, 'It is 24℃ in Rome')
+        self.assertEqual(''.join(deltas), result)
+        self.assertGreater(len(deltas), 1)
+        self.assertEqual(messages[2]['tool_call_id'], 'call_1')
+        self.assertEqual(messages[2]['content'], 'Rome, Italy: 24℃')
+
+    def test_calls_beside_final_response_do_not_run(self):
+        schedule_args = json.dumps({'cron_expression': '0 9 * * *', 'objectives': ['report']})
+        turn = [
+            self.chunk(index=0, call_id='call_1', name='get_weather', arguments=json.dumps({'location': 'Rome'})),
+            self.chunk(index=1, call_id='call_2', name='schedule_task', arguments=schedule_args),
+            self.chunk(index=2, call_id='call_3', name='final_response', arguments=json.dumps({'content': 'Done'})),
+        ]
+        for stream in (False, True):
+            with self.subTest(stream=stream):
+                agent = Agent(stream=stream, max_tool_workers=1)
+                called = []
+                agent.tool_executor.handler = lambda tool_call: called.append(tool_call.function.name) or 'ok'
+                agent.client = MagicMock()
+                if stream:
+                    agent.client.chat.completions.create.return_value = iter(turn)
+                else:
+                    accumulator = StreamAccumulator(MagicMock())
+                    for chunk in turn:
+                        accumulator.add_chunk(chunk)
+                    message = SimpleNamespace(content=None, tool_calls=accumulator.tool_calls)
+                    agent.client.chat.completions.create.return_value.choices = [SimpleNamespace(message=message)]
+                self.assertEqual(agent.process_conversation([{'role': 'user', 'content': 'test'}]), 'Done')
+                self.assertNotIn('schedule_task', called)
+
+class TestMetrics(unittest.TestCase):
+    class ListSink:
+        def __init__(self):
+            self.records = []
+
+        def handle(self, record):
+            self.records.append(dict(record))
+
+    def completion(self, name, arguments, call_id):
+        tool_call = SimpleNamespace(id=call_id, type='function',
+                                    function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+        message = SimpleNamespace(content=None, tool_calls=[tool_call])
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+    def test_turn_events_and_silent_logs(self):
+        sink, prometheus = self.ListSink(), PrometheusSink()
+        agent = Agent(metrics=Metrics([sink, prometheus]))
+        agent.client = MagicMock()
+        agent.client.chat.completions.create.side_effect = [
+            self.completion('get_weather', {'location': 'Rome, Italy'}, 'call_1'),
+            self.completion('final_response', {'content': 'Done'}, 'call_2'),
+        ]
+
+        set_verbose(False)
+        self.addCleanup(set_verbose, True)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            result = agent.process_conversation([{'role': 'user', 'content': 'test'}])
+
+        self.assertEqual(result, 'Done')
+        self.assertEqual(output.getvalue(), '')
+        events = [record['event'] for record in sink.records]
+        self.assertEqual(events, ['llm_call', 'tool_call', 'llm_call', 'turn'])
+        self.assertEqual(sink.records[1]['tool'], 'get_weather')
+        self.assertEqual(sink.records[-1]['iterations'], 2)
+        self.assertEqual(agent.last_turn.total_tokens, 240)
+        self.assertIn('agent_tokens_total{type="prompt"} 200', prometheus.render())
+        self.assertIn('agent_tool_calls_total{tool="get_weather"} 1', prometheus.render())
+
+    def test_disabled_metrics_emit_nothing(self):
+        metrics = Metrics()
+        self.assertFalse(metrics.enabled)
+        metrics.emit('turn', iterations=1)
+
+class TestAsyncAgent(unittest.IsolatedAsyncioTestCase):
+    def make_response(self, content=None, tool_calls=None):
+        response = MagicMock()
+        response.content = content
+        response.tool_calls = tool_calls
+        return response
+
+    def make_call(self, call_id, name, arguments):
+        mock_call = MagicMock()
+        mock_call.id = call_id
+        mock_call.type = 'function'
+        mock_call.function.name = name
+        mock_call.function.arguments = json.dumps(arguments)
+        return mock_call
+
+    async def test_process_conversation_runs_tools(self):
+        agent = AsyncAgent()
+        agent.send_messages = AsyncMock(side_effect=[
+            self.make_response(tool_calls=[
+                self.make_call('call_1', 'get_weather', {'location': 'Rome, Italy'}),
+                self.make_call('call_2', 'get_weather', {'location': 'Oslo, Norway'}),
+            ]),
+            self.make_response(tool_calls=[
+                self.make_call('call_3', 'final_response', {'content': 'Sunny everywhere'}),
+            ]),
+        ])
+
+        messages = [{'role': 'user', 'content': 'test'}]
+        result = await agent.process_conversation(messages)
+
+        self.assertEqual(result, 'Sunny everywhere')
+        tool_messages = [m for m in messages if m['role'] == 'tool']
+        self.assertEqual([m['tool_call_id'] for m in tool_messages], ['call_1', 'call_2'])
+        self.assertEqual(tool_messages[1]['content'], 'Oslo, Norway: 24℃')
+
+    async def test_tools_run_off_the_event_loop(self):
+        agent = AsyncAgent(max_tool_workers=1)
+        loop_thread = threading.get_ident()
+        threads = []
+        agent.tool_executor.handler = lambda tool_call: threads.append(threading.get_ident()) or 'ok'
+        agent.send_messages = AsyncMock(side_effect=[
+            self.make_response(tool_calls=[self.make_call('call_1', 'get_weather', {'location': 'Rome, Italy'})]),
+            self.make_response(tool_calls=[self.make_call('call_2', 'final_response', {'content': 'Sunny'})]),
+        ])
+        self.assertEqual(await agent.process_conversation([{'role': 'user', 'content': 'test'}]), 'Sunny')
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], loop_thread)
+
+    async def test_server_sessions_are_independent(self):
+        agent = AsyncAgent()
+        agent.send_messages = AsyncMock(return_value=self.make_response(content='Hello'))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        server = AgentServer(agent, SessionLog(directory.name))
+
+        status, first = await server.handle_request('POST', '/sessions', b'')
+        self.assertEqual(status, 201)
+        _, second = await server.handle_request('POST', '/sessions', b'')
+
+        status, reply = await server.handle_request(
+            'POST', f"/sessions/{first['session_id']}/messages", json.dumps({'content': 'hi'}).encode())
+        self.assertEqual(status, 200)
+        self.assertEqual(reply['response'], 'Hello')
+
+        _, history = await server.handle_request('GET', f"/sessions/{second['session_id']}", b'')
+        self.assertEqual(len(history['messages']), 1)
+
+        status, _ = await server.handle_request('POST', '/sessions/missing/messages', b'{}')
+        self.assertEqual(status, 404)
+
+class TestContextManager(unittest.TestCase):
+    def conversation(self, turns):
+        messages = [{'role': 'system', 'content': 'You are an assistant'}]
+        for i in range(turns):
+            messages.append({'role': 'user', 'content': f'question {i}'})
+            messages.append({'role': 'assistant', 'content': None, 'tool_calls': [
+                {'id': f'call_{i}', 'type': 'function',
+                 'function': {'name': 'list_all_tasks', 'arguments': '{}'}}
+            ]})
+            messages.append({'role': 'tool', 'name': 'list_all_tasks',
+                             'content': 'x' * 2000, 'tool_call_id': f'call_{i}'})
+            messages.append({'role': 'assistant', 'content': f'answer {i}'})
+        return messages
+
+    def test_under_budget_is_untouched(self):
+        messages = self.conversation(2)
+        original = list(messages)
+        ContextManager(max_tokens=100000).compact(messages)
+        self.assertEqual(messages, original)
+
+    def test_truncates_old_tool_outputs_first(self):
+        messages = self.conversation(4)
+        manager = ContextManager(max_tokens=1500, keep_recent=4)
+        total = manager.compact(messages)
+
+        self.assertLessEqual(total, 1500)
+        self.assertEqual(len(messages), 17)
+        self.assertTrue(messages[3]['content'].endswith(TRUNCATION_MARKER))
+        self.assertEqual(messages[-2]['content'], 'x' * 2000)
+        self.assertEqual(total, manager.count(messages))
+
+    def test_drops_old_turns_and_keeps_pairs(self):
+        messages = self.conversation(6)
+        summarize = MagicMock(return_value='earlier questions')
+        manager = ContextManager(max_tokens=900, keep_recent=4, summarize=summarize)
+        total = manager.compact(messages)
+
+        self.assertEqual(messages[0]['content'], 'You are an assistant')
+        self.assertTrue(messages[1]['content'].startswith(SUMMARY_PREFIX))
+        self.assertEqual(messages[-1]['content'], 'answer 5')
+        call_ids = {c['id'] for m in messages for c in m.get('tool_calls') or []}
+        for message in messages:
+            if message['role'] == 'tool':
+                self.assertIn(message['tool_call_id'], call_ids)
+        self.assertEqual(total, manager.count(messages))
+
+    def test_keeps_the_latest_question(self):
+        messages = [{'role': 'system', 'content': 'You are an assistant'},
+                    {'role': 'user', 'content': 'schedule my reports ' * 20}]
+        for i in range(4):
+            messages.append({'role': 'assistant', 'content': None, 'tool_calls': [
+                {'id': f'call_{i}', 'type': 'function', 'function': {'name': 'list_all_tasks', 'arguments': '{}'}}]})
+            messages.append({'role': 'tool', 'name': 'list_all_tasks', 'content': 'x' * 200, 'tool_call_id': f'call_{i}'})
+        manager = ContextManager(max_tokens=50, keep_recent=2)
+        total = manager.compact(messages)
+
+        self.assertEqual([m['role'] for m in messages], ['system', 'user', 'assistant', 'tool'])
+        self.assertEqual(messages[-1]['tool_call_id'], 'call_3')
+        self.assertEqual(total, manager.count(messages))
+
+    def test_no_recent_window(self):
+        messages = [{'role': 'system', 'content': 'You are an assistant'},
+                    {'role': 'user', 'content': 'list my reports'},
+                    {'role': 'assistant', 'content': None, 'tool_calls': [
+                        {'id': 'call_1', 'type': 'function', 'function': {'name': 'list_all_tasks', 'arguments': '{}'}}]},
+                    {'role': 'tool', 'name': 'list_all_tasks', 'content': 'x' * 400, 'tool_call_id': 'call_1'}]
+        manager = ContextManager(max_tokens=30, keep_recent=0)
+        total = manager.compact(messages)
+
+        self.assertEqual([m['role'] for m in messages], ['system', 'user'])
+        self.assertEqual(total, manager.count(messages))
+
+class TestResponseCache(unittest.TestCase):
+    def make_message(self, content):
+        return SimpleNamespace(content=content, tool_calls=[SimpleNamespace(
+            id='call_1', type='function',
+            function=SimpleNamespace(name='final_response', arguments=json.dumps({'content': content}))
+        )])
+
+    def test_hit_after_miss(self):
+        agent = Agent(response_cache=ResponseCache())
+        agent.client = MagicMock()
+        agent.client.chat.completions.create.return_value.choices = [MagicMock(message=self.make_message('ok'))]
+
+        messages = [{'role': 'user', 'content': 'list my tasks'}]
+        first = agent.send_messages(list(messages))
+        second = agent.send_messages(list(messages))
+
+        agent.client.chat.completions.create.assert_called_once()
+        self.assertEqual(second.tool_calls[0].function.arguments, first.tool_calls[0].function.arguments)
+        self.assertEqual(agent.response_cache.stats()['hits'], 1)
+        self.assertEqual(agent.response_cache.stats()['misses'], 1)
+
+    def test_bypass_after_mutating_tool(self):
+        cache = ResponseCache()
+        messages = [
+            {'role': 'user', 'content': 'schedule standup'},
+            {'role': 'assistant', 'content': None, 'tool_calls': [
+                {'id': 'call_1', 'type': 'function',
+                 'function': {'name': 'schedule_task', 'arguments': '{}'}}
+            ]},
+        ]
+        self.assertIsNone(cache.key('model', messages, tools))
+        self.assertEqual(cache.stats()['bypasses'], 1)
+
+    def test_disk_tier_and_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(max_bytes=200, directory=directory)
+            keys = [cache.key('model', [{'role': 'user', 'content': str(i)}], tools) for i in range(5)]
+            for i, key in enumerate(keys):
+                cache.put(key, self.make_message(f'answer {i}'))
+            self.assertLessEqual(cache.memory.size, 200)
+
+            restored = ResponseCache(directory=directory)
+            self.assertEqual(restored.get(keys[0]).content, 'answer 0')
+            self.assertEqual(restored.stats()['hits'], 1)
+
 class TestTools(unittest.TestCase):
     def setUp(self):
-        # Clear any existing tasks before each test
-        if Path(TASKS_FILE).exists():
-            Path(TASKS_FILE).unlink()
+        # Each test starts with no tasks, in a file outside the working directory
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(tools_module.set_task_store, tools_module._task_store)
+        self.tasks_file = os.path.join(self.tmp.name, TASKS_FILE)
+        tools_module.set_task_store(JsonTaskStore(self.tasks_file))
 
     def test_handle_tool_call_weather(self):
         mock_call = MagicMock()
@@ -101,7 +423,7 @@ class TestTools(unittest.TestCase):
         self.assertEqual(result, "Tasks scheduled with cron expression: 0 9 * * 1-5")
         
         # Verify task was saved
-        with open(TASKS_FILE, 'r') as f:
+        with open(self.tasks_file, 'r') as f:
             tasks = json.load(f)
             self.assertIn('0 9 * * 1-5', tasks)
             self.assertEqual(tasks['0 9 * * 1-5'], ['Daily standup'])
@@ -118,13 +440,13 @@ class TestTools(unittest.TestCase):
         self.assertEqual(result, "Tasks scheduled with cron expression: 0 12 * * *")
         
         # Verify tasks were saved
-        with open(TASKS_FILE, 'r') as f:
+        with open(self.tasks_file, 'r') as f:
             tasks = json.load(f)
             self.assertEqual(tasks['0 12 * * *'], ['Lunch break', 'Team sync'])
 
     def test_handle_tool_call_list_all_tasks(self):
         # First add some test data
-        with open(TASKS_FILE, 'w') as f:
+        with open(self.tasks_file, 'w') as f:
             json.dump({
                 '0 9 * * 1-5': ['Daily standup'],
                 '0 12 * * *': ['Lunch break']
@@ -145,6 +467,20 @@ class TestTools(unittest.TestCase):
 """
         self.assertEqual(result, expected_output)
 
+    def test_handle_tool_call_search_tasks(self):
+        with open(self.tasks_file, 'w') as f:
+            json.dump({'0 9 * * 1-5': ['Daily standup', 'Check email']}, f)
+
+        mock_call = MagicMock()
+        mock_call.function.name = 'search_tasks'
+        mock_call.function.arguments = json.dumps({'objective': 'standup'})
+
+        result = handle_tool_call(mock_call)
+        self.assertIn('- Daily standup', result)
+        self.assertNotIn('Check email', result)
+        with open(self.tasks_file, 'r') as f:
+            self.assertEqual(len(json.load(f)['0 9 * * 1-5']), 2)
+
     def test_handle_tool_call_unknown(self):
         mock_call = MagicMock()
         mock_call.function.name = 'unknown_tool'
@@ -153,5 +489,1190 @@ class TestTools(unittest.TestCase):
         result = handle_tool_call(mock_call)
         self.assertEqual(result, "Unknown tool")
 
+class TestTaskStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def stores(self):
+        return [
+            JsonTaskStore(os.path.join(self.tmp.name, 'tasks.json')),
+            SqliteTaskStore(os.path.join(self.tmp.name, 'tasks.db')),
+        ]
+
+    def test_add_list_delete(self):
+        for store in self.stores():
+            store.add('0 9 * * 1-5', ['Daily standup', 'Check email'])
+            store.add('0 12 * * *', ['Lunch break'])
+            store.add('0 9 * * 1-5', ['Review PRs'])
+
+            self.assertEqual(store.all(), {
+                '0 9 * * 1-5': ['Daily standup', 'Check email', 'Review PRs'],
+                '0 12 * * *': ['Lunch break'],
+            })
+            self.assertEqual(store.by_cron('0 12 * * *'), ['Lunch break'])
+            self.assertEqual(store.delete_matching('LUNCH'), 1)
+            self.assertEqual(store.delete_matching('missing'), 0)
+            self.assertNotIn('0 12 * * *', store.all())
+
+    def test_concurrent_writers_lose_nothing(self):
+        path = os.path.join(self.tmp.name, 'tasks.json')
+        for make_store in (JsonTaskStore, SqliteTaskStore):
+            if make_store is SqliteTaskStore:
+                path = os.path.join(self.tmp.name, 'tasks.db')
+
+            def writer(worker):
+                store = make_store(path)
+                for i in range(20):
+                    store.add('* * * * *', [f'task {worker}-{i}'])
+
+            threads = [threading.Thread(target=writer, args=(w,)) for w in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(make_store(path).by_cron('* * * * *')), 80)
+
+    def test_index_follows_writes(self):
+        for store in self.stores():
+            store.add('0 9 * * 1-5', ['Daily standup', 'Weekly report'])
+            self.assertEqual(store.search('STAND'), [('0 9 * * 1-5', 'Daily standup')])
+
+            store.add('0 18 * * 5', ['Send report to team'])
+            self.assertEqual([obj for _, obj in store.search('report')], ['Weekly report', 'Send report to team'])
+
+            self.assertEqual(store.delete_matching('weekly'), 1)
+            self.assertEqual(store.search('report'), [('0 18 * * 5', 'Send report to team')])
+            self.assertEqual(len(store.search('a')), 2)
+
+    def test_index_sees_other_writers(self):
+        for first, second in zip(self.stores(), self.stores()):
+            first.add('* * * * *', ['Backup database'])
+            self.assertEqual(len(first.search('backup')), 1)
+            second.delete_matching('backup')
+            second.add('* * * * *', ['Rotate backup logs'])
+            self.assertEqual(first.search('backup'), [('* * * * *', 'Rotate backup logs')])
+
+    def test_trigram_index(self):
+        index = ObjectiveIndex()
+        for i, text in enumerate(['Daily standup', 'Stand-up notes', 'Call Ståle']):
+            index.add(i, '* * * * *', text)
+        self.assertEqual(index.search('stand'), [0, 1])
+        self.assertEqual(index.search('STÅ'), [2])
+        self.assertEqual(index.search('up'), [0, 1])
+        index.remove(0)
+        self.assertEqual(index.search('stand'), [1])
+        self.assertEqual(index.search('missing'), [])
+
+    def test_migrate_json_to_sqlite(self):
+        source, destination = self.stores()
+        source.add('0 9 * * 1-5', ['Daily standup'])
+        source.add('0 12 * * *', ['Lunch break', 'Team sync'])
+
+        self.assertEqual(migrate(source, destination), 3)
+        self.assertEqual(destination.all(), source.all())
+
+class TestCron(unittest.TestCase):
+    def test_next_fire(self):
+        sunday = datetime(2026, 10, 18, 10, 30)
+        cases = {
+            '0 9 * * 1-5': datetime(2026, 10, 19, 9, 0),
+            '*/15 * * * *': datetime(2026, 10, 18, 10, 45),
+            '30 10 * * sun': datetime(2026, 10, 25, 10, 30),
+            '0 0 29 2 *': datetime(2028, 2, 29, 0, 0),
+            '0 12 1 * mon': datetime(2026, 10, 19, 12, 0),
+            '0 12 */2 * tue': datetime(2026, 10, 27, 12, 0),
+            '5/20 8-9 * jan,dec *': datetime(2026, 12, 1, 8, 5),
+        }
+        for expression, expected in cases.items():
+            self.assertEqual(CronExpression(expression).next_fire(sunday), expected, expression)
+
+    def test_invalid_expressions(self):
+        for expression in ['* * *', '61 * * * *', '0 0 31 2 *', '*/0 * * * *', 'x * * * *']:
+            with self.assertRaises(ValueError):
+                CronExpression(expression)
+
+    def test_schedule_task_rejects_invalid_cron(self):
+        mock_call = MagicMock()
+        mock_call.function.name = 'schedule_task'
+        mock_call.function.arguments = json.dumps({'cron_expression': '99 * * * *', 'objectives': ['x']})
+        self.assertTrue(handle_tool_call(mock_call).startswith('Error scheduling task'))
+
+class TestScheduler(unittest.TestCase):
+    def test_simulated_day(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = JsonTaskStore(os.path.join(directory, 'tasks.json'))
+            store.add('0 9 * * 1-5', ['Daily standup'])
+            store.add('*/30 * * * *', ['Check queue', 'Ping server'])
+
+            fired = []
+            lock = threading.Lock()
+
+            def dispatch(objective):
+                with lock:
+                    fired.append(objective)
+
+            clock = SimulatedClock(datetime(2026, 10, 19))
+            scheduler = Scheduler(store, dispatch=dispatch, clock=clock, reload_interval=None)
+            scheduler.run(until=clock.now() + timedelta(days=1))
+            scheduler.shutdown()
+
+            self.assertEqual(fired.count('Daily standup'), 1)
+            self.assertEqual(fired.count('Check queue'), 48)
+            self.assertEqual(scheduler.fired, 49)
+
+    def test_reload_picks_up_new_groups(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SqliteTaskStore(os.path.join(directory, 'tasks.db'))
+            store.add('0 * * * *', ['Hourly'])
+            fired = []
+            clock = SimulatedClock(datetime(2026, 10, 19))
+            scheduler = Scheduler(store, dispatch=fired.append, clock=clock, max_workers=1, reload_interval=60)
+            scheduler.run(until=clock.now() + timedelta(minutes=90))
+
+            SqliteTaskStore(os.path.join(directory, 'tasks.db')).add('45 * * * *', ['Late'])
+            scheduler.run(until=clock.now() + timedelta(hours=1))
+            scheduler.shutdown()
+
+            self.assertEqual(fired.count('Hourly'), 2)
+            self.assertEqual(fired.count('Late'), 1)
+
+    def test_failures_are_logged_silently(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = JsonTaskStore(os.path.join(directory, 'tasks.json'))
+            store.add('0 9 * * *', ['Broken'])
+
+            def dispatch(objective):
+                raise RuntimeError('agent down')
+
+            set_verbose(False)
+            self.addCleanup(set_verbose, True)
+            clock = SimulatedClock(datetime(2026, 10, 19))
+            scheduler = Scheduler(store, dispatch=dispatch, clock=clock, max_workers=1, reload_interval=None)
+            output = io.StringIO()
+            with redirect_stdout(output):
+                scheduler.run(until=clock.now() + timedelta(days=1))
+                scheduler.shutdown()
+
+            self.assertEqual(scheduler.failed, 1)
+            self.assertEqual(output.getvalue(), '')
+
+    def test_reload_after_due_time_keeps_the_firing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = JsonTaskStore(os.path.join(directory, 'tasks.json'))
+            store.add('0 9 * * *', ['Morning'])
+            fired = []
+            clock = SimulatedClock(datetime(2026, 10, 19, 8, 59, 30))
+            scheduler = Scheduler(store, dispatch=fired.append, clock=clock, max_workers=1, reload_interval=60)
+            scheduler.reload()
+
+            # The reload runs late, after the group was due
+            clock.current = datetime(2026, 10, 19, 9, 0, 30)
+            store.add('0 10 * * *', ['Later'])
+            scheduler.run(until=datetime(2026, 10, 19, 9, 5))
+            scheduler.shutdown()
+
+            self.assertEqual(fired, ['Morning'])
+
+class TestToolRegistry(unittest.TestCase):
+    def make_call(self, name, arguments):
+        mock_call = MagicMock()
+        mock_call.function.name = name
+        mock_call.function.arguments = arguments
+        return mock_call
+
+    def test_generated_schema(self):
+        schema = TOOLS['schedule_task'].schema['function']['parameters']
+        self.assertEqual(schema['required'], ['cron_expression', 'objectives'])
+        self.assertEqual(schema['properties']['objectives'], {
+            'type': 'array', 'items': {'type': 'string'}, 'description': 'List of objectives to schedule'
+        })
+        listing = TOOLS['list_all_tasks'].schema['function']['parameters']
+        self.assertNotIn('required', listing)
+        self.assertEqual(listing['properties']['view']['enum'], ['auto', 'summary', 'list'])
+        self.assertEqual([t['function']['name'] for t in tools], list(TOOLS))
+
+    def test_register_new_tool(self):
+        @tool("Add two numbers", parallel_safe=True)
+        def add_numbers(a: Annotated[int, "First number"], b: Annotated[float, "Second number"] = 1.5):
+            return str(a + b)
+        self.addCleanup(lambda: (TOOLS.pop('add_numbers'), tools.pop(), tools_module.PARALLEL_SAFE_TOOLS.discard('add_numbers')))
+
+        self.assertEqual(handle_tool_call(self.make_call('add_numbers', '{"a": 2}')), '3.5')
+        self.assertEqual(TOOLS['add_numbers'].schema['function']['parameters']['required'], ['a'])
+        self.assertIn('add_numbers', tools_module.PARALLEL_SAFE_TOOLS)
+
+    def test_invalid_arguments_fail_fast(self):
+        cases = {
+            '{"location": ': 'invalid JSON',
+            '{}': "missing required argument 'location'",
+            '{"location": 42}': "must be of type string",
+            '{"location": "Rome", "units": "C"}': 'unknown argument',
+            '["Rome"]': 'must be a JSON object',
+        }
+        for arguments, message in cases.items():
+            result = handle_tool_call(self.make_call('get_weather', arguments))
+            self.assertTrue(result.startswith('Error'), result)
+            self.assertIn(message, result)
+
+        result = handle_tool_call(self.make_call('schedule_task', json.dumps({
+            'cron_expression': '* * * * *', 'objectives': ['ok', 3]})))
+        self.assertIn("items of 'objectives' must be of type string", result)
+
+    def test_null_optional_argument_is_none(self):
+        @tool("Echo a label")
+        def echo_label(label: Annotated[str, "Label"] = None):
+            return repr(label)
+        self.addCleanup(lambda: (TOOLS.pop('echo_label'), tools.pop()))
+
+        self.assertEqual(handle_tool_call(self.make_call('echo_label', '{"label": null}')), 'None')
+        self.assertIn("must be of type string", handle_tool_call(self.make_call('get_weather', '{"location": null}')))
+
+class TestToolExecutor(unittest.TestCase):
+    def make_call(self, name, **arguments):
+        mock_call = MagicMock()
+        mock_call.function.name = name
+        mock_call.function.arguments = json.dumps(arguments)
+        return mock_call
+
+    def test_results_keep_call_order(self):
+        delays = {'Rome, Italy': 0.2, 'Paris, France': 0.0, 'Oslo, Norway': 0.1}
+
+        def handler(tool_call):
+            location = json.loads(tool_call.function.arguments)['location']
+            time.sleep(delays[location])
+            return location
+
+        executor = ToolExecutor(max_workers=4, handler=handler)
+        calls = [self.make_call('get_weather', location=location) for location in delays]
+        start = time.perf_counter()
+        results = executor.map(calls)
+        elapsed = time.perf_counter() - start
+        executor.shutdown()
+
+        self.assertEqual(results, list(delays))
+        self.assertLess(elapsed, sum(delays.values()))
+
+    def test_unsafe_tools_keep_their_order(self):
+        events = []
+
+        def handler(tool_call):
+            args = json.loads(tool_call.function.arguments)
+            if tool_call.function.name == 'get_weather':
+                time.sleep(0.05)
+            events.append(args['tag'])
+            return args['tag']
+
+        executor = ToolExecutor(max_workers=4, handler=handler)
+        calls = [
+            self.make_call('get_weather', tag='read-1'),
+            self.make_call('schedule_task', tag='write-1'),
+            self.make_call('get_weather', tag='read-2'),
+            self.make_call('delete_task_by_objective', tag='write-2'),
+        ]
+        results = executor.map(calls)
+        executor.shutdown()
+
+        self.assertEqual(results, ['read-1', 'write-1', 'read-2', 'write-2'])
+        self.assertEqual(events, ['read-1', 'write-1', 'read-2', 'write-2'])
+
+class TestLLMClient(unittest.TestCase):
+    def test_token_bucket_waits_once_empty(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+
+    def test_rate_limiter_adjusts_to_actual_usage(self):
+        limiter = RateLimiter(tokens_per_minute=600)
+        self.assertEqual(limiter.reserve(tokens=600), 0)
+        limiter.adjust(estimated=600, actual=100)
+        self.assertEqual(limiter.reserve(tokens=400), 0)
+        self.assertGreater(limiter.reserve(tokens=200), 0)
+
+    def test_retries_rate_limits_and_server_errors(self):
+        from openai import OpenAI
+        statuses = [429, 503, 200]
+        requests = []
+        completion = {
+            "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "test",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "ok"}}],
+            "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6},
+        }
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                status = statuses[len(requests)]
+                requests.append(status)
+                body = json.dumps(completion if status == 200 else {"error": {"message": "busy"}}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 429:
+                    self.send_header("Retry-After", "0")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            sdk = OpenAI(api_key="x", base_url=f"http://127.0.0.1:{server.server_address[1]}", max_retries=0)
+            client = LLMClient(sdk, RateLimiter(requests_per_second=100), RetryPolicy(base_delay=0.01))
+            response = client.chat.completions.create(model="test", messages=[{"role": "user", "content": "hi"}])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(response.choices[0].message.content, "ok")
+        self.assertEqual(requests, [429, 503, 200])
+        self.assertEqual(client.retries, 2)
+
+    def test_does_not_retry_client_errors(self):
+        error = Exception("bad request")
+        error.status_code = 400
+        self.assertFalse(RetryPolicy().should_retry(error, 0))
+        error.status_code = 429
+        self.assertTrue(RetryPolicy(max_retries=1).should_retry(error, 0))
+        self.assertFalse(RetryPolicy(max_retries=1).should_retry(error, 1))
+
+    def test_shared_client_per_limits_and_event_loop(self):
+        factory = lambda **kwargs: SimpleNamespace(**kwargs)
+        url = 'http://limits.test'
+        first = shared_client(factory, 'key', url, requests_per_second=1)
+        self.assertIs(shared_client(factory, 'key', url, requests_per_second=1), first)
+        self.assertIsNot(shared_client(factory, 'key', url, requests_per_second=5).limiter, first.limiter)
+
+        async def client():
+            return shared_client(factory, 'key', url, asynchronous=True)
+        self.assertIsNot(asyncio.run(client()), asyncio.run(client()))
+
+class TestBatch(unittest.TestCase):
+    class FakeAgent:
+        system_prompt = {"role": "system", "content": "test"}
+
+        def __init__(self, calls):
+            self.calls = calls
+            self.last_turn = None
+
+        def process_conversation(self, messages):
+            prompt = messages[-1]["content"]
+            self.calls.append(prompt)
+            if prompt == "boom":
+                raise RuntimeError("failed")
+            self.last_turn = SimpleNamespace(iterations=1, latency=0.01, total_tokens=7)
+            return prompt.upper()
+
+    def test_runs_prompts_and_resumes(self):
+        calls = []
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, 'prompts.jsonl')
+            output_path = os.path.join(directory, 'results.jsonl')
+            with open(input_path, 'w') as f:
+                for i, prompt in enumerate(['a', 'b', 'boom']):
+                    f.write(json.dumps({"id": i, "prompt": prompt}) + "\n")
+                f.write(json.dumps({"prompt": "no id"}) + "\n")
+            # Left by an interrupted run: one answer and a half written line
+            with open(output_path, 'w') as f:
+                f.write(json.dumps({"id": "0", "answer": "A"}) + "\n" + '{"id": "1", "ans')
+
+            runner = BatchRunner(make_agent=lambda: self.FakeAgent(calls), workers=2)
+            summary = runner.run(input_path, output_path)
+
+            self.assertEqual(summary, {"completed": 2, "failed": 1, "skipped": 1})
+            self.assertEqual(sorted(calls), ['b', 'boom', 'no id'])
+            self.assertEqual(completed_ids(output_path), {'0', '1', '4'})
+            with open(output_path) as f:
+                results = [json.loads(line) for line in f.readlines()[2:]]
+            by_id = {r["id"]: r for r in results}
+            self.assertEqual(by_id["1"], {"id": "1", "answer": "B", "iterations": 1, "latency": 0.01, "tokens": 7})
+            self.assertIn("RuntimeError", by_id["2"]["error"])
+
+            # Only the failed prompt runs again
+            calls.clear()
+            BatchRunner(make_agent=lambda: self.FakeAgent(calls)).run(input_path, output_path)
+            self.assertEqual(calls, ['boom'])
+
+class TestConfig(unittest.TestCase):
+    def test_file_then_environment_then_overrides(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'config.json')
+            with open(path, 'w') as f:
+                json.dump({"api_key": "file", "model": "file-model", "stream": True}, f)
+            with patch.dict(os.environ, {"AGENT_MODEL": "env-model"}):
+                config = load_config(path, overrides={"stream": False})
+            self.assertEqual(config, {"api_key": "file", "model": "env-model", "stream": False})
+            self.assertEqual(load_config(os.path.join(directory, 'missing.json')).get("model"),
+                             os.environ.get("AGENT_MODEL"))
+
+    def test_import_does_not_load_sdks_or_config(self):
+        import subprocess
+        import sys
+        code = ("import sys, agent, tree_of_thought; "
+                "print(sorted(m for m in ('openai', 'ollama', 'pydantic') if m in sys.modules))")
+        with tempfile.TemporaryDirectory() as directory:
+            env = {**os.environ, "PYTHONPATH": os.path.dirname(os.path.abspath(__file__))}
+            result = subprocess.run([sys.executable, "-c", code], cwd=directory, env=env,
+                                    capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+    def test_agent_config_argument(self):
+        agent = Agent(config={"model": "other-model"})
+        agent.client = MagicMock()
+        agent.client.chat.completions.create.return_value.choices = [MagicMock()]
+        agent.send_messages([{'role': 'user', 'content': 'test'}])
+        self.assertEqual(agent.client.chat.completions.create.call_args.kwargs['model'], 'other-model')
+
+class TestLoopGuard(unittest.TestCase):
+    def make_call(self, call_id, name, **arguments):
+        return SimpleNamespace(id=call_id, type='function',
+                               function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+
+    def make_agent(self, turns, loop_guard=None):
+        """Agent whose model replies with the given tool calls, then with the last ones forever"""
+        executed = []
+
+        def handler(tool_call):
+            executed.append(tool_call.function.name)
+            return f"{tool_call.function.name} result"
+
+        agent = Agent(loop_guard=loop_guard)
+        agent.tool_executor = ToolExecutor(max_workers=1, handler=handler)
+        agent.requests = []
+
+        def send_messages(messages, stats=None, tool_choice=None, selection=None):
+            agent.requests.append(tool_choice)
+            if tool_choice:
+                return SimpleNamespace(content=None, tool_calls=[
+                    self.make_call('final', 'final_response', content='Forced answer')])
+            turn = turns[min(len(agent.requests) - 1, len(turns) - 1)]
+            return SimpleNamespace(content=None, tool_calls=turn)
+
+        agent.send_messages = send_messages
+        return agent, executed
+
+    def test_repeated_read_only_calls_are_memoized(self):
+        weather = self.make_call('1', 'get_weather', location='Rome, Italy')
+        same_weather = self.make_call('2', 'get_weather', location='Rome, Italy')
+        agent, executed = self.make_agent([
+            [weather], [same_weather], [self.make_call('3', 'final_response', content='Sunny')]])
+
+        result = agent.process_conversation([{'role': 'user', 'content': 'weather?'}])
+
+        self.assertEqual(result, 'Sunny')
+        self.assertEqual(executed, ['get_weather'])
+        self.assertEqual(agent.last_turn.memo_hits, 1)
+        self.assertIsNone(agent.last_turn.stopped)
+
+    def test_cycle_forces_final_response(self):
+        agent, executed = self.make_agent([[self.make_call('1', 'list_all_tasks')]],
+                                          loop_guard=LoopGuard(max_repeats=3))
+        messages = [{'role': 'user', 'content': 'tasks?'}]
+
+        result = agent.process_conversation(messages)
+
+        self.assertEqual(result, 'Forced answer')
+        self.assertEqual(agent.requests, [None, None, None, FINAL_TOOL_CHOICE])
+        self.assertEqual(executed, ['list_all_tasks'])
+        self.assertIn('repeated', agent.last_turn.stopped)
+        self.assertEqual(messages[-1], {'role': 'assistant', 'content': 'Forced answer'})
+        self.assertFalse(any(m['role'] == 'system' for m in messages))
+
+    def test_iteration_cap(self):
+        turns = [[self.make_call(str(i), 'get_weather', location=f'City {i}')] for i in range(10)]
+        agent, executed = self.make_agent(turns, loop_guard=LoopGuard(max_iterations=3))
+
+        agent.process_conversation([{'role': 'user', 'content': 'weather everywhere'}])
+
+        self.assertEqual(len(executed), 3)
+        self.assertEqual(agent.requests[-1], FINAL_TOOL_CHOICE)
+        self.assertEqual(agent.last_turn.stopped, 'reached 3 iterations')
+
+    def test_state_changes_invalidate_the_memo(self):
+        executed = []
+        executor = ToolExecutor(max_workers=4, handler=lambda tc: executed.append(tc.function.name))
+        memo = ToolMemo()
+        executor.map([self.make_call('1', 'list_all_tasks')], memo)
+        executor.map([self.make_call('2', 'list_all_tasks')], memo)
+        executor.map([self.make_call('3', 'schedule_task', cron_expression='0 9 * * *', objectives=['x']),
+                      self.make_call('4', 'list_all_tasks')], memo)
+        executor.shutdown()
+
+        self.assertEqual(executed, ['list_all_tasks', 'schedule_task', 'list_all_tasks'])
+        self.assertEqual(memo.hits, 1)
+
+class TestToolCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.now = 0.0
+        self.cache = ToolCache(max_entries=3, clock=lambda: self.now)
+        previous_cache, previous_store = get_tool_cache(), tools_module._task_store
+        self.addCleanup(set_tool_cache, previous_cache)
+        self.addCleanup(tools_module.set_task_store, previous_store)
+        set_tool_cache(self.cache)
+        tools_module.set_task_store(SqliteTaskStore(os.path.join(self.tmp.name, 'tasks.db')))
+
+    def call(self, name, **arguments):
+        return handle_tool_call(SimpleNamespace(function=SimpleNamespace(name=name, arguments=json.dumps(arguments))))
+
+    def test_ttl_expiry(self):
+        self.call('get_weather', location='Rome, Italy')
+        self.call('get_weather', location='Rome, Italy')
+        self.now += 601
+        self.call('get_weather', location='Rome, Italy')
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['expired']), (1, 2, 1))
+
+    def test_writes_invalidate_task_views(self):
+        self.call('schedule_task', cron_expression='0 9 * * 1-5', objectives=['Daily standup'])
+        self.assertIn('Daily standup', self.call('list_all_tasks'))
+        self.assertIn('Daily standup', self.call('list_all_tasks'))
+
+        self.call('schedule_task', cron_expression='0 12 * * *', objectives=['Lunch'])
+        self.assertIn('Lunch', self.call('list_all_tasks'))
+        self.call('delete_task_by_objective', objective='Lunch')
+        self.assertNotIn('Lunch', self.call('list_all_tasks'))
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['invalidations'], 2)
+
+    def test_external_writes_change_the_key(self):
+        self.assertEqual(self.call('list_all_tasks'), "No scheduled tasks found")
+        # Written behind the tools' back, e.g. by another process
+        tools_module.get_task_store().add('0 9 * * *', ['Backup'])
+        self.assertIn('Backup', self.call('list_all_tasks'))
+
+    def test_units_of_work_do_not_share_task_views(self):
+        # A staged store can get the id() of one rolled back and collected before it
+        with patch.object(tools_module, 'id', lambda obj: 0, create=True):
+            with self.assertRaises(RuntimeError):
+                with unit_of_work():
+                    self.call('schedule_task', cron_expression='0 9 * * *', objectives=['Rolled back'])
+                    self.assertIn('Rolled back', self.call('list_all_tasks'))
+                    raise RuntimeError('turn failed')
+            with unit_of_work() as staged:
+                # Written behind the tools' back, nothing invalidates the cache
+                staged.add('0 9 * * *', ['Kept'])
+                result = self.call('list_all_tasks')
+        self.assertIn('Kept', result)
+        self.assertNotIn('Rolled back', result)
+
+    def test_bounded_size_and_overrides(self):
+        self.cache.ttls['get_weather'] = 0
+        for city in ['A', 'B', 'C', 'D']:
+            self.call('get_weather', location=city)
+            self.call('search_tasks', objective=city)
+        stats = self.cache.stats()
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertTrue(all(key[0] == 'search_tasks' for key in self.cache.entries))
+
+class TestTaskPagination(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        previous_store = tools_module._task_store
+        self.addCleanup(tools_module.set_task_store, previous_store)
+        self.store = JsonTaskStore(os.path.join(self.tmp.name, 'tasks.json'))
+        tools_module.set_task_store(self.store)
+        self.store.add('0 9 * * 1-5', [f'Morning report {i}' for i in range(60)])
+        self.store.add('0 18 * * *', [f'Evening backup {i}' for i in range(40)])
+
+    def call(self, name, **arguments):
+        return handle_tool_call(SimpleNamespace(function=SimpleNamespace(name=name, arguments=json.dumps(arguments))))
+
+    def test_summary_by_default_for_large_sets(self):
+        result = self.call('list_all_tasks')
+        self.assertIn('100 tasks in 2 cron groups', result)
+        self.assertIn('- 0 9 * * 1-5: 60 tasks', result)
+        self.assertNotIn('Morning report', result)
+
+    def test_cursor_walks_every_task_once(self):
+        seen = []
+        arguments = {'view': 'list', 'limit': 30}
+        while True:
+            page = self.call('get_scheduled_tasks', **arguments)
+            seen.extend(line[3:] for line in page.splitlines() if line.startswith(' - '))
+            if 'Next page: ' not in page:
+                break
+            arguments = {**json.loads(page.split('Next page: ')[1]), 'limit': 30}
+        self.assertEqual(len(seen), 100)
+        self.assertEqual(len(set(seen)), 100)
+
+    def test_filters(self):
+        result = self.call('list_all_tasks', cron_expression='0 18 * * *', limit=5)
+        self.assertIn('- Evening backup 4', result)
+        self.assertNotIn('Morning', result)
+        self.assertIn('Showing tasks 1-5 of 40', result)
+
+        result = self.call('list_all_tasks', contains='report 5')
+        self.assertEqual(result.count('- Morning report 5'), 11)
+        self.assertNotIn('Next page', result)
+
+    def test_size_cap(self):
+        self.store.add('0 0 * * *', ['x' * 3000 for _ in range(5)])
+        result = self.call('list_all_tasks', cron_expression='0 0 * * *')
+        self.assertLessEqual(len(result), tools_module.MAX_TOOL_OUTPUT_CHARS + 200)
+        self.assertIn('Showing tasks 1-2 of 5', result)
+
+        self.assertIn("must be one of auto, summary, list", self.call('list_all_tasks', view='everything'))
+
+    def test_invalid_cursors(self):
+        for cursor in ['-1', '100', 'page2']:
+            with self.subTest(cursor=cursor):
+                result = self.call('list_all_tasks', view='list', cursor=cursor)
+                self.assertIn("argument 'cursor' must be a 'Next page' cursor between 0 and 99", result)
+        self.assertIn("between 0 and 1", self.call('list_all_tasks', view='summary', cursor='2'))
+        self.assertIn('- Evening backup 39', self.call('list_all_tasks', view='list', cursor='99'))
+
+class TestUnitOfWork(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(tools_module.set_task_store, tools_module._task_store)
+
+    def use_store(self, store):
+        tools_module.set_task_store(store)
+        store.add('0 9 * * *', ['Existing report'])
+        return store
+
+    def make_call(self, call_id, name, **arguments):
+        return SimpleNamespace(id=call_id, type='function',
+                               function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+
+    def test_one_write_per_unit(self):
+        store = self.use_store(JsonTaskStore(os.path.join(self.tmp.name, 'tasks.json')))
+        executor = ToolExecutor(max_workers=4)
+        calls = [self.make_call(str(i), 'schedule_task', cron_expression='0 12 * * *', objectives=[f'Task {i}'])
+                 for i in range(5)]
+        calls.append(self.make_call('d', 'delete_task_by_objective', objective='existing'))
+        calls.append(self.make_call('l', 'list_all_tasks'))
+
+        with patch.object(store, '_write', wraps=store._write) as write:
+            with unit_of_work():
+                results = executor.map(calls)
+                self.assertEqual(store.all(), {'0 9 * * *': ['Existing report']})
+        executor.shutdown()
+
+        self.assertEqual(write.call_count, 1)
+        self.assertIn('- Task 4', results[-1])
+        self.assertNotIn('Existing report', results[-1])
+        self.assertEqual(store.all(), {'0 12 * * *': [f'Task {i}' for i in range(5)]})
+        self.assertEqual(store.search('task 3'), [('0 12 * * *', 'Task 3')])
+
+    def test_rollback_when_the_turn_fails(self):
+        for store in (JsonTaskStore(os.path.join(self.tmp.name, 'tasks.json')),
+                      SqliteTaskStore(os.path.join(self.tmp.name, 'tasks.db'))):
+            self.use_store(store)
+            with self.assertRaises(RuntimeError):
+                with unit_of_work():
+                    handle_tool_call(self.make_call('1', 'schedule_task', cron_expression='0 12 * * *',
+                                                    objectives=['Never saved']))
+                    raise RuntimeError('model call failed')
+            self.assertEqual(store.all(), {'0 9 * * *': ['Existing report']})
+
+    def test_sqlite_applies_in_one_transaction(self):
+        store = self.use_store(SqliteTaskStore(os.path.join(self.tmp.name, 'tasks.db')))
+        version = store.version()
+        with unit_of_work():
+            handle_tool_call(self.make_call('1', 'schedule_task', cron_expression='0 12 * * *', objectives=['Ünïcode TASK']))
+            handle_tool_call(self.make_call('2', 'delete_task_by_objective', objective='EXISTING'))
+        self.assertEqual(store.version(), version + 1)
+        self.assertEqual(store.all(), {'0 12 * * *': ['Ünïcode TASK']})
+        self.assertEqual(store.search('ünïcode'), [('0 12 * * *', 'Ünïcode TASK')])
+
+    def test_agent_commits_each_iteration(self):
+        store = self.use_store(JsonTaskStore(os.path.join(self.tmp.name, 'tasks.json')))
+        turns = iter([
+            [self.make_call(str(i), 'schedule_task', cron_expression='0 12 * * *', objectives=[f'Task {i}'])
+             for i in range(3)],
+            [self.make_call('f', 'final_response', content='Scheduled')],
+        ])
+        agent = Agent()
+        self.assertFalse(agent.group_commit)
+        agent.group_commit = True
+        agent.send_messages = lambda messages, stats=None, tool_choice=None, selection=None: SimpleNamespace(
+            content=None, tool_calls=next(turns))
+
+        with patch.object(store, '_write', wraps=store._write) as write:
+            agent.process_conversation([{'role': 'user', 'content': 'schedule three tasks'}])
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(store.by_cron('0 12 * * *'), ['Task 0', 'Task 1', 'Task 2'])
+
+class TestToolSelection(unittest.TestCase):
+    def completion(self, name, arguments, call_id):
+        tool_call = SimpleNamespace(id=call_id, type='function',
+                                    function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+        message = SimpleNamespace(content=None, tool_calls=[tool_call])
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    def make_agent(self, *completions):
+        agent = Agent(tool_selector=ToolSelector())
+        agent.client = MagicMock()
+        agent.client.chat.completions.create.side_effect = list(completions)
+        agent.tool_executor = ToolExecutor(max_workers=1, handler=lambda tool_call: 'result')
+        return agent
+
+    def sent_tools(self, agent):
+        return [{schema['function']['name'] for schema in call.kwargs['tools']}
+                for call in agent.client.chat.completions.create.call_args_list]
+
+    def test_selects_relevant_tools(self):
+        selector = ToolSelector()
+        weather = selector.select([{'role': 'user', 'content': 'Is it going to rain in Paris?'}])
+        self.assertEqual(weather.names, {'get_weather', 'final_response'})
+        self.assertGreater(weather.tokens_saved, 0)
+        reminder = selector.select([{'role': 'user', 'content': 'Remind me every Monday to water the plants'}])
+        self.assertEqual(reminder.names, {'schedule_task', 'final_response'})
+
+        unrelated = selector.select([{'role': 'user', 'content': 'Hello there'}])
+        self.assertEqual(unrelated.schemas, tools)
+        self.assertEqual(unrelated.tokens_saved, 0)
+
+    def test_agent_sends_the_subset_and_reports_savings(self):
+        agent = self.make_agent(self.completion('get_weather', {'location': 'Rome, Italy'}, 'call_1'),
+                                self.completion('final_response', {'content': 'Sunny'}, 'call_2'))
+        result = agent.process_conversation([{'role': 'user', 'content': 'What is the weather in Rome?'}])
+
+        self.assertEqual(result, 'Sunny')
+        self.assertEqual(self.sent_tools(agent), [{'get_weather', 'final_response'}] * 2)
+        saved = ToolSelector().select([{'role': 'user', 'content': 'weather'}]).tokens_saved
+        self.assertEqual(agent.last_turn.tool_tokens_saved, 2 * saved)
+        self.assertEqual(agent.last_turn.tool_fallbacks, 0)
+
+    def test_calling_a_left_out_tool_sends_every_tool(self):
+        agent = self.make_agent(self.completion('search_tasks', {'objective': 'Rome'}, 'call_1'),
+                                self.completion('final_response', {'content': 'Done'}, 'call_2'))
+        messages = [{'role': 'user', 'content': 'What is the weather in Rome?'}]
+        agent.process_conversation(messages)
+
+        sent = self.sent_tools(agent)
+        self.assertEqual(sent[0], {'get_weather', 'final_response'})
+        self.assertEqual(sent[1], set(TOOLS))
+        self.assertEqual(messages[2]['name'], 'search_tasks')
+        self.assertEqual(agent.last_turn.tool_fallbacks, 1)
+
+class TestSessionLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.log = SessionLog(self.tmp.name, window=4)
+
+    def add_turn(self, messages, i):
+        messages.append({'role': 'user', 'content': f'question {i}'})
+        messages.append({'role': 'assistant', 'content': None,
+                         'tool_calls': [{'id': f'call_{i}', 'type': 'function',
+                                         'function': {'name': 'get_weather', 'arguments': '{}'}}]})
+        messages.append({'role': 'tool', 'name': 'get_weather', 'content': 'Sunny', 'tool_call_id': f'call_{i}'})
+        messages.append({'role': 'assistant', 'content': f'answer {i}'})
+
+    def test_window_starts_at_a_user_message(self):
+        messages = self.log.load('s1', {'role': 'system', 'content': 'prompt'})
+        for i in range(100):
+            self.add_turn(messages, i)
+        self.log.release('s1')
+
+        self.assertEqual(len(self.log.read('s1')), 400)
+        window = self.log.load('s1', {'role': 'system', 'content': 'prompt'})
+        self.assertEqual([m['role'] for m in window], ['system', 'user', 'assistant', 'tool', 'assistant'])
+        self.assertEqual(window[1]['content'], 'question 99')
+        self.assertEqual(len(self.log.recent('s1', window=6)), 8)
+
+    def test_appends_are_fsynced_in_batches(self):
+        log = SessionLog(self.tmp.name, sync_every=16)
+        messages = log.load('s1')
+        threads = []
+        with patch('session_log.os.fsync', side_effect=lambda fd: threads.append(threading.current_thread())):
+            for i in range(10):
+                self.add_turn(messages, i)
+            log.release('s1')
+        self.assertEqual(len(threads), 3)
+        # The batches are fsynced in the background, never by the appending thread
+        self.assertNotIn(threading.current_thread(), threads[:2])
+        self.assertEqual(log._files, {})
+
+    def test_fsync_of_a_session_does_not_block_another(self):
+        log = SessionLog(self.tmp.name, sync_every=1)
+        started, finish = threading.Event(), threading.Event()
+
+        def slow_fsync(fd):
+            started.set()
+            finish.wait(5)
+
+        with patch('session_log.os.fsync', side_effect=slow_fsync):
+            log.append('s1', {'role': 'user', 'content': 'slow'})
+            self.assertTrue(started.wait(5))
+            appending = threading.Thread(target=log.append, args=('s2', {'role': 'user', 'content': 'fast'}))
+            appending.start()
+            appending.join(5)
+            self.assertFalse(appending.is_alive())
+            finish.set()
+            log.close()
+        self.assertEqual(len(log.read('s2')), 1)
+
+    def test_line_cut_by_a_crash_is_skipped(self):
+        messages = self.log.load('s1')
+        self.add_turn(messages, 0)
+        self.log.release('s1')
+        with open(self.log.path('s1'), 'ab') as f:
+            f.write(b'{"role": "user", "cont')
+
+        messages = self.log.load('s1')
+        self.assertEqual(len(messages), 4)
+        self.add_turn(messages, 1)
+        self.log.release('s1')
+        self.assertEqual([m['content'] for m in self.log.read('s1') if m['role'] == 'user'],
+                         ['question 0', 'question 1'])
+
+    def test_invalid_session_ids(self):
+        self.assertFalse(self.log.exists('../config'))
+        with self.assertRaises(ValueError):
+            self.log.path('../config')
+
+
+class TestServerResume(unittest.IsolatedAsyncioTestCase):
+    async def test_restarted_server_resumes_sessions(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        seen = []
+
+        async def send_messages(messages, stats=None, tool_choice=None, selection=None):
+            seen.append([m['content'] for m in messages if m['role'] != 'system'])
+            return SimpleNamespace(content=f'reply {len(seen)}', tool_calls=None)
+
+        agent = AsyncAgent()
+        agent.send_messages = send_messages
+        server = AgentServer(agent, SessionLog(directory.name))
+        _, created = await server.handle_request('POST', '/sessions', b'')
+        path = f"/sessions/{created['session_id']}"
+        await server.handle_request('POST', path + '/messages', json.dumps({'content': 'first'}).encode())
+
+        restarted = AgentServer(agent, SessionLog(directory.name))
+        status, reply = await restarted.handle_request('POST', path + '/messages',
+                                                       json.dumps({'content': 'second'}).encode())
+        self.assertEqual(status, 200)
+        self.assertEqual(reply['response'], 'reply 2')
+        self.assertEqual(seen[1], ['first', 'reply 1', 'second'])
+        self.assertEqual(restarted.session_log._files, {})
+
+        _, history = await restarted.handle_request('GET', path, b'')
+        self.assertEqual(len(history['messages']), 5)
+        status, _ = await restarted.handle_request('DELETE', path, b'')
+        self.assertEqual(status, 200)
+        status, _ = await AgentServer(agent, SessionLog(directory.name)).handle_request('GET', path, b'')
+        self.assertEqual(status, 404)
+
+    async def test_failed_turn_is_rolled_back(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        agent = AsyncAgent()
+        agent.send_messages = AsyncMock(side_effect=[
+            SimpleNamespace(content=None, tool_calls=[
+                SimpleNamespace(id='call_1', type='function', function=SimpleNamespace(
+                    name='get_weather', arguments=json.dumps({'location': 'Rome, Italy'})))]),
+            RuntimeError('backend down'),
+            SimpleNamespace(content='Sunny', tool_calls=None),
+        ])
+        server = AgentServer(agent, SessionLog(directory.name))
+        _, created = await server.handle_request('POST', '/sessions', b'')
+        path = f"/sessions/{created['session_id']}"
+        body = json.dumps({'content': 'weather?'}).encode()
+
+        with self.assertRaises(RuntimeError):
+            await server.handle_request('POST', path + '/messages', body)
+        status, reply = await server.handle_request('POST', path + '/messages', body)
+        self.assertEqual(reply['response'], 'Sunny')
+        _, history = await server.handle_request('GET', path, b'')
+        self.assertEqual([m['role'] for m in history['messages']], ['system', 'user', 'assistant'])
+
+class FakeGenerateClient:
+    """Stands in for ollama.Client, records the concurrent calls per model"""
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = {}
+        self.peak = {}
+        self.calls = {}
+
+    def generate(self, model, prompt, format=None):
+        with self.lock:
+            self.active[model] = self.active.get(model, 0) + 1
+            self.peak[model] = max(self.peak.get(model, 0), self.active[model])
+            self.calls[model] = self.calls.get(model, 0) + 1
+        time.sleep(self.delay)
+        with self.lock:
+            self.active[model] -= 1
+        if format is None:
+            return SimpleNamespace(response="Step 1: Difference is 3.\nStep 2: 56 - 3 = 53.\nStep 3: The answer is 53.")
+        if 'result' in format['properties']:
+            return SimpleNamespace(response=json.dumps({'text_response': 'same', 'result': True}))
+        return SimpleNamespace(response=json.dumps({'response': 'The answer is 53.'}))
+
+
+class TestParallelMCTS(unittest.TestCase):
+    def setUp(self):
+        import tree_of_thought
+        self.tot = tree_of_thought
+        self.client = FakeGenerateClient()
+        patcher = patch.object(tree_of_thought, 'client', self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        slots = patch.dict(tree_of_thought._backend_slots, clear=True)
+        slots.start()
+        self.addCleanup(slots.stop)
+        # Every generation reaches the client
+        cache = patch.object(tree_of_thought, 'generation_cache', None)
+        cache.start()
+        self.addCleanup(cache.stop)
+
+    def test_virtual_loss_spreads_the_workers(self):
+        root = self.tot.Node()
+        for _ in range(3):
+            child = self.tot.Node(root)
+            child.visit_count, child.consistency_score = 2, 2
+            root.child.append(child)
+        root.visit_count = 6
+        first = root.select_best_child()
+        first.add_virtual_loss()
+        second = root.select_best_child()
+        self.assertIsNot(first, second)
+        self.assertEqual(root.virtual_loss, 1)
+        first.add_virtual_loss(-1)
+        self.assertIs(root.select_best_child(), first)
+
+    def test_parallel_search_keeps_statistics_consistent(self):
+        limits = {self.tot.self_generator: 2, self.tot.discriminator: 3}
+        with patch.dict(self.tot.BACKEND_CONCURRENCY, limits), redirect_stdout(io.StringIO()):
+            tree = self.tot.Tree("When I was 6 my sister was 3. Now I'm 56 how old is my sister?", workers=4)
+            best = tree.search(5)
+
+        self.assertLessEqual(self.client.peak[self.tot.self_generator], 2)
+        self.assertLessEqual(self.client.peak[self.tot.discriminator], 3)
+        self.assertGreater(self.client.peak[self.tot.discriminator], 1)
+
+        nodes = [tree.root]
+        for node in nodes:
+            nodes.extend(node.child)
+            self.assertEqual(node.virtual_loss, 0)
+        leaves = tree.root.get_leaf_nodes()
+        # Every rollout ends with a final answer, which is never expanded: one leaf per generation
+        self.assertEqual(self.client.calls[self.tot.self_generator], len(leaves))
+        self.assertEqual(tree.root.visit_count, sum(leaf.visit_count for leaf in leaves))
+        # Every check passes without the discriminator: a simulation makes 3 completions and adds 3 to the score
+        self.assertEqual(self.client.calls[self.tot.discriminator], sum(leaf.consistency_score for leaf in leaves))
+        self.assertIn(best, leaves)
+
+    def test_full_depth_selection_counts_each_simulation_once(self):
+        with patch.object(self.tot, 'client', AlternatingGenerateClient(delay=0)), redirect_stdout(io.StringIO()):
+            tree = self.tot.Tree("When I was 6 my sister was 3. Now I'm 56 how old is my sister?")
+            tree.search(6)
+
+        nodes = [tree.root]
+        for node in nodes:
+            nodes.extend(node.child)
+            if node.child:
+                self.assertEqual(node.visit_count, sum(child.visit_count for child in node.child))
+                self.assertEqual(node.consistency_score, sum(child.consistency_score for child in node.child))
+        # Rounds after the first expand below the root children
+        self.assertTrue(any(len(node.child) > 1 for node in nodes if node.parent is not None))
+        self.assertEqual(tree.root.visit_count, 3 * len(tree.root.get_leaf_nodes()))
+
+class TestAnswerComparison(unittest.TestCase):
+    def test_numbers_units_fractions_and_percentages(self):
+        self.assertEqual(extract_answer('Step 3: The answer is: 6 trees today.').value, 6)
+        self.assertEqual(extract_answer('The answer is 20 - 12 = 8.').value, 8)
+        self.assertEqual(extract_answer('The answer is $1,234.50.').value, Fraction(2469, 2))
+        self.assertEqual(extract_answer('The answer is 1 1/2 cups').value, Fraction(3, 2))
+        self.assertEqual(extract_answer('The answer is one hundred.').value, 100)
+        self.assertIsNone(extract_answer('The answer is 8 or 12.'))
+        self.assertIsNone(extract_answer('She is 53 years old.'))
+
+        self.assertTrue(compare_answers('The answer is 25%.', 'The answer is: 0.25'))
+        self.assertTrue(compare_answers('The answer is 8 dollars.', 'The answer is: $8.00'))
+        self.assertFalse(compare_answers('The answer is 53.', 'The answer is: 28.'))
+        self.assertIsNone(compare_answers('The answer is 2 hours.', 'The answer is: 120 minutes.'))
+        self.assertIsNone(compare_answers('The answer is 1/3.', 'The answer is: 0.33'))
+
+    def test_fixture_accuracy(self):
+        report = rule_based_report(load_fixtures())
+        self.assertEqual(report['accuracy'], 1.0)
+        self.assertGreaterEqual(report['coverage'], 0.75)
+
+    def test_check_consistency_skips_the_discriminator(self):
+        import tree_of_thought
+        client = FakeGenerateClient(delay=0)
+        root = tree_of_thought.Node()
+        root.step = 'When I was 6 my sister was 3. Now I am 56, how old is my sister?'
+        node = tree_of_thought.Node(root)
+        with patch.object(tree_of_thought, 'client', client), \
+                patch.object(tree_of_thought, 'generation_cache', None), \
+                patch.dict(tree_of_thought.consistency_checks, {'rule_based': 0, 'llm': 0}):
+            node.step = 'The answer is 53.'
+            self.assertTrue(node.check_consistency('So she is 56 - 3 = 53. The answer is: 53.').result)
+            self.assertFalse(node.check_consistency('The answer is: 28.').result)
+            node.step = 'She must be 53 now.'
+            self.assertTrue(node.check_consistency('The answer is: 53.').result)
+            self.assertEqual(tree_of_thought.consistency_checks, {'rule_based': 2, 'llm': 1})
+        self.assertEqual(client.calls, {tree_of_thought.discriminator: 1})
+
+class TestGenerationCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.count = 0
+
+    def generate(self, model, prompt, format=None):
+        self.count += 1
+        return SimpleNamespace(response=f'{prompt} #{self.count}')
+
+    def sample(self, cache, counter, samples=None, times=3):
+        return [cache.generate(self.generate, 'model', 'prompt', samples=samples, counter=counter).response
+                for _ in range(times)]
+
+    def test_sample_slots_and_replay(self):
+        cache = GenerationCache(directory=self.tmp.name)
+        first = self.sample(cache, SampleCounter())
+        self.assertEqual(first, ['prompt #1', 'prompt #2', 'prompt #3'])
+        self.assertEqual(self.sample(cache, SampleCounter()), first)
+        self.assertEqual(self.sample(cache, SampleCounter(), samples=2), ['prompt #1', 'prompt #2', 'prompt #1'])
+        self.assertEqual(self.count, 3)
+
+        # A new process reads the disk tier
+        restarted = GenerationCache(directory=self.tmp.name)
+        self.assertEqual(self.sample(restarted, SampleCounter()), first)
+        self.assertEqual(restarted.stats()['disk_hits'], 3)
+        self.assertEqual(cache.generate(self.generate, 'model', 'prompt', format={'type': 'object'}).response,
+                         'prompt #4')
+
+    def test_repeated_search_replays_the_first(self):
+        import tree_of_thought
+        client = FakeGenerateClient(delay=0)
+        query = "When I was 6 my sister was 3. Now I'm 56 how old is my sister?"
+        with patch.object(tree_of_thought, 'client', client), \
+                patch.object(tree_of_thought, 'generation_cache', GenerationCache()) as cache, \
+                redirect_stdout(io.StringIO()):
+            first = tree_of_thought.Tree(query).search(3)
+            calls = dict(client.calls)
+            second = tree_of_thought.Tree(query).search(3)
+        self.assertEqual(client.calls, calls)
+        self.assertEqual(first.step, second.step)
+        self.assertGreater(cache.stats()['hit_rate'], 0.5)
+
+class AlternatingGenerateClient(FakeGenerateClient):
+    """Answers 53 and 28 in turn, so candidates and simulations disagree"""
+    def __init__(self, delay=0.01):
+        super().__init__(delay)
+        self.rollout_prompts = []
+
+    def generate(self, model, prompt, format=None):
+        super().generate(model, prompt, format)
+        if format is None:
+            self.rollout_prompts.append(prompt)
+        answer = 53 if self.calls[model] % 2 else 28
+        if format is None:
+            return SimpleNamespace(response=f"Step 1: Difference is 3.\nStep 2: Subtract.\nStep 3: The answer is {answer}.")
+        return SimpleNamespace(response=json.dumps({'response': f'The answer is {answer}.'}))
+
+class TestArrayTree(unittest.TestCase):
+    def test_links_leaves_and_text_interning(self):
+        tree = ArrayTree('question')
+        first = tree.add_trajectory(0, ['a', 'b', 'c'])
+        second = tree.add_trajectory(0, ['a', 'd'])
+        tree.add(first, 'e')
+        self.assertEqual(tree.children(0), [first, second])
+        self.assertEqual([tree.text(n) for n in tree.trajectory(6)], ['question', 'a', 'e'])
+        self.assertEqual(list(tree.leaves), [3, 5, 6])
+        self.assertEqual(tree.leaves_under(0), [3, 6, 5])
+        self.assertEqual(tree.texts, ['question', 'a', 'b', 'c', 'd', 'e'])
+
+    def test_deep_trajectory_needs_no_recursion(self):
+        tree = ArrayTree('question')
+        leaf = 0
+        for i in range(20000):
+            leaf = tree.add(leaf, f'step {i % 3}')
+        self.assertEqual(len(tree.trajectory(leaf)), 20001)
+        self.assertEqual(tree.leaves_under(0), [leaf])
+        self.assertEqual(tree.depth[leaf], 20000)
+
+    def test_rounds_match_the_node_tree(self):
+        for legacy in (False, True):
+            with self.subTest(legacy=legacy):
+                self.check_rounds_match(legacy)
+
+    def check_rounds_match(self, legacy):
+        import tree_of_thought
+        query = "When I was 6 my sister was 3. Now I'm 56 how old is my sister?"
+        trees = [tree_of_thought.Tree(query, legacy=legacy), ArrayTree(query, legacy=legacy)]
+        clients = []
+        best = []
+        for tree in trees:
+            clients.append(AlternatingGenerateClient(delay=0))
+            with patch.object(tree_of_thought, 'client', clients[-1]), \
+                    patch.object(tree_of_thought, 'generation_cache', None), \
+                    redirect_stdout(io.StringIO()):
+                best.append(tree.search(6))
+        self.assertEqual(clients[0].calls, clients[1].calls)
+        self.assertEqual(clients[0].rollout_prompts, clients[1].rollout_prompts)
+        for prompt in clients[0].rollout_prompts:
+            self.assertIn(f"### Instruction: {query}\n", prompt)
+
+        node_tree, array = trees
+        nodes, stack = [], [node_tree.root]
+        while stack:
+            nodes.append(stack.pop())
+            stack.extend(reversed(nodes[-1].child))
+        indices, stack = [], [0]
+        while stack:
+            indices.append(stack.pop())
+            stack.extend(reversed(array.children(indices[-1])))
+        self.assertEqual([(n.step, n.visit_count, n.consistency_score) for n in nodes],
+                         [(array.text(i), array.visits[i], array.score[i]) for i in indices])
+        self.assertGreater(len({node.consistency_score for node in nodes}), 1)
+        self.assertEqual(best[0].step, array.text(best[1]))
+
+    def wide_tree(self):
+        """Root with more children than VECTORIZE_MIN_CHILDREN, some never visited"""
+        tree = ArrayTree('question', legacy=True)
+        for i in range(40):
+            child = tree.add_trajectory(0, [f'step {i}', f'answer {i % 7}'])
+            tree.visits[child] = i % 5
+            tree.score[child] = (i % 9) - 4
+            tree.visits[child + 1] = i % 3
+            tree.score[child + 1] = (i % 4) - 1
+        tree.visits[0] = sum(tree.visits[child] for child in tree.children(0))
+        return tree
+
+    def backend_results(self):
+        tree = self.wide_tree()
+        children = tree.children(0)
+        scores = [float(score) for score in tree.uct_scores(children)]
+        selected, best = tree.select_best_child(0), tree.best_leaf()
+        tree.add_visits(list(tree.leaves))
+        return scores, selected, best, list(tree.visits)
+
+    def test_python_backend(self):
+        with patch.object(array_tree, 'np', None):
+            scores, selected, best, visits = self.backend_results()
+        self.assertEqual(scores[0], float('inf'))
+        self.assertEqual(selected, 1)
+        # 80 visits of the children, then one per leaf
+        self.assertEqual(visits[0], 120)
+
+    @unittest.skipUnless(array_tree.np is not None, "numpy is not installed")
+    def test_numpy_backend_matches_python(self):
+        numpy_results = self.backend_results()
+        with patch.object(array_tree, 'np', None):
+            python_results = self.backend_results()
+        for numpy_score, python_score in zip(numpy_results[0], python_results[0]):
+            self.assertAlmostEqual(numpy_score, python_score)
+        self.assertEqual(numpy_results[1:], python_results[1:])
+
 if __name__ == '__main__':
     unittest.main()
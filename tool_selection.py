@@ -0,0 +1,129 @@
+import json
+import math
+import re
+
+from context import count_text_tokens
+from tools import TOOLS, tools
+
+# Sent on every request, the model can't answer without it
+ALWAYS_SENT = ("final_response",)
+
+STOPWORDS = {
+    "a", "an", "and", "are", "at", "be", "by", "can", "do", "for", "from", "i", "in", "is", "it", "me", "my",
+    "of", "on", "or", "please", "the", "this", "to", "what", "with", "you", "your",
+}
+
+# Matches in the tool name count more than matches in its description
+FIELD_WEIGHTS = {"name": 3.0, "keywords": 2.0, "description": 1.0, "parameters": 0.5}
+
+
+def _stem(word):
+    for suffix in ("ing", "ed", "es", "e", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def terms(text):
+    """Lower case, stemmed words of a text, without stopwords"""
+    return [_stem(word) for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in STOPWORDS]
+
+
+def schema_tokens(schemas):
+    return count_text_tokens(json.dumps(schemas)) if schemas else 0
+
+
+class ToolIndex:
+    """Keyword index over the names, descriptions and parameters of the registered tools"""
+    def __init__(self, registry=TOOLS):
+        self.weights = {}
+        frequency = {}
+        for name, registered in registry.items():
+            function = registered.schema["function"]
+            fields = {
+                "name": name.replace("_", " "),
+                "keywords": " ".join(registered.keywords),
+                "description": function["description"],
+                "parameters": " ".join(
+                    f"{param} {schema.get('description', '')}"
+                    for param, schema in function["parameters"]["properties"].items()),
+            }
+            weights = {}
+            for field, text in fields.items():
+                for term in terms(text):
+                    weights[term] = max(weights.get(term, 0.0), FIELD_WEIGHTS[field])
+            self.weights[name] = weights
+            for term in weights:
+                frequency[term] = frequency.get(term, 0) + 1
+        # Words shared by many tools ("task") tell them apart less than rare ones ("weather")
+        self.idf = {term: math.log(1 + len(registry) / count) for term, count in frequency.items()}
+
+    def scores(self, text):
+        query = set(terms(text))
+        scores = {}
+        for name, weights in self.weights.items():
+            score = sum(weights[term] * self.idf[term] for term in query if term in weights)
+            if score > 0:
+                scores[name] = score
+        return scores
+
+
+class ToolSelection:
+    """Tool schemas sent during one process_conversation call"""
+    def __init__(self, schemas, full_tokens):
+        self.schemas = schemas
+        self.names = {schema["function"]["name"] for schema in schemas}
+        self.full_tokens = full_tokens
+        self.tokens_saved = full_tokens - schema_tokens(schemas)
+
+    def left_out(self, tool_calls):
+        """Registered tools the model called although their schema was not sent"""
+        return sorted({tc.function.name for tc in tool_calls or []
+                       if tc.function.name in TOOLS and tc.function.name not in self.names})
+
+    def widen(self):
+        """Send every tool from now on"""
+        self.schemas = tools
+        self.names = set(TOOLS)
+        self.tokens_saved = 0
+
+
+class ToolSelector:
+    """Picks the tools relevant to the user's request instead of sending all of them
+
+    The last `history` user messages are matched against a keyword index of
+    the tools, the best max_tools matches scoring at least min_ratio of the
+    best score are sent along with ALWAYS_SENT. When nothing matches, every
+    tool is sent. The system prompt still names every tool, a model calling
+    one that was left out gets the full set for the rest of the turn.
+    """
+    def __init__(self, max_tools=4, min_ratio=0.5, history=2, always=ALWAYS_SENT):
+        self.max_tools = max_tools
+        self.min_ratio = min_ratio
+        self.history = history
+        self.always = tuple(always)
+        self._index = None
+        self._tokens = None
+
+    def index(self):
+        # Tools can be registered after the selector is created
+        if self._index is None or len(self._index.weights) != len(TOOLS):
+            self._index = ToolIndex(TOOLS)
+            self._tokens = schema_tokens(tools)
+        return self._index
+
+    def query(self, messages):
+        contents = [m.get("content") for m in messages if m.get("role") == "user"][-self.history:]
+        return " ".join(content for content in contents if isinstance(content, str))
+
+    def select(self, messages):
+        index = self.index()
+        scores = index.scores(self.query(messages))
+        if not scores:
+            return ToolSelection(tools, self._tokens)
+        cutoff = max(scores.values()) * self.min_ratio
+        best = sorted((name for name in scores if scores[name] >= cutoff), key=scores.get, reverse=True)
+        chosen = set(best[:self.max_tools]) | set(self.always)
+        # Registration order keeps the request prefix stable for prompt caching
+        schemas = [schema for schema in tools if schema["function"]["name"] in chosen]
+        return ToolSelection(schemas, self._tokens)
@@ -1,217 +1,636 @@
+import contextvars
+import inspect
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import datetime
+from typing import Annotated, Literal, get_args, get_origin, get_type_hints
+
+from context import TRUNCATION_MARKER
+from cron import validate_cron
+from metrics import NULL_METRICS, log
+from task_store import StagedTaskStore, open_task_store
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
 
 TASKS_FILE = "scheduled_tasks.json"
 
-tools = [
-    {
-        "type": "function",
-        "function": {
-            "name": "get_weather",
-            "description": "Get weather conditions for a specific location",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "location": {"type": "string", "description": "City and country, e.g. Rome, Italy"}
-                },
-                "required": ["location"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "schedule_task",
-            "description": "Schedule a task using cron expression",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "cron_expression": {
-                        "type": "string",
-                        "description": "Cron expression for scheduling (e.g., '0 9 * * 1-5' for weekdays at 9am)"
-                    },
-                    "objectives": {
-                        "type": "array",
-                        "items": {"type": "string"},
-                        "description": "List of objectives to schedule"
-                    }
-                },
-                "required": ["cron_expression", "objectives"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "final_response",
-            "description": "Delivers final answer to user",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "content": {"type": "string", "description": "Final response content"}
-                },
-                "required": ["content"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "get_scheduled_tasks",
-            "description": "Get list of all scheduled tasks",
-            "parameters": {
-                "type": "object",
-                "properties": {}
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "list_all_tasks",
-            "description": "Get a markdown formatted list of all scheduled tasks",
-            "parameters": {
-                "type": "object",
-                "properties": {}
-            }
+# name -> Tool, filled by the @tool decorator
+TOOLS = {}
+
+# JSON schemas sent to the model, generated from the registered functions
+tools = []
+
+# Tools that can run concurrently with other tool calls of the same turn.
+# Every other tool acts as a barrier: it waits for the calls issued before it
+# and the calls issued after it wait for it, so task file writes keep their order.
+PARALLEL_SAFE_TOOLS = set()
+
+# Tools that change the task file, results produced after them can't be reused
+MUTATING_TOOLS = set()
+
+# Tools whose result is a view of the task store, cached results are dropped when it changes
+TASK_VIEW_TOOLS = set()
+
+JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean", list: "array", dict: "object"}
+PYTHON_TYPES = {"string": str, "integer": int, "number": (int, float), "boolean": bool, "array": list, "object": dict}
+
+
+class Tool:
+    def __init__(self, function, schema, validate, parallel_safe, mutating, ttl=None, reads_tasks=False,
+                 keywords=()):
+        self.function = function
+        self.name = function.__name__
+        self.schema = schema
+        self.validate = validate
+        self.parallel_safe = parallel_safe
+        self.mutating = mutating
+        self.ttl = ttl
+        self.reads_tasks = reads_tasks
+        self.keywords = tuple(keywords)
+
+
+def _json_schema(annotation):
+    """JSON schema and description of a parameter annotation"""
+    description = None
+    if get_origin(annotation) is Annotated:
+        annotation, description = get_args(annotation)[:2]
+    origin = get_origin(annotation) or annotation
+    if origin is Literal:
+        values = list(get_args(annotation))
+        schema = {"type": JSON_TYPES[type(values[0])], "enum": values}
+        if description:
+            schema["description"] = description
+        return schema
+    schema = {"type": JSON_TYPES[origin]}
+    if origin is list and get_args(annotation):
+        schema["items"] = {"type": JSON_TYPES[get_args(annotation)[0]]}
+    if description:
+        schema["description"] = description
+    return schema
+
+
+def _is_json_type(value, json_type):
+    # bool is an int subclass but not a valid JSON integer/number
+    if isinstance(value, bool) and json_type != "boolean":
+        return False
+    return isinstance(value, PYTHON_TYPES[json_type])
+
+
+def _compile_validator(name, parameters):
+    """Build the argument check once, at registration time"""
+    checks = []
+    for param, schema in parameters["properties"].items():
+        item_type = schema["items"]["type"] if "items" in schema else None
+        checks.append((param, schema["type"], item_type, schema.get("enum"), param in parameters.get("required", ())))
+    known = set(parameters["properties"])
+
+    def validate(args):
+        if not isinstance(args, dict):
+            return f"arguments of {name} must be a JSON object"
+        for param, json_type, item_type, enum, required in checks:
+            if param not in args:
+                if required:
+                    return f"missing required argument '{param}'"
+                continue
+            value = args[param]
+            if value is None and not required:
+                # Models often send null for an optional argument, the function gets its None
+                continue
+            if not _is_json_type(value, json_type):
+                return f"argument '{param}' must be of type {json_type}"
+            if item_type and not all(_is_json_type(item, item_type) for item in value):
+                return f"items of '{param}' must be of type {item_type}"
+            if enum and value not in enum:
+                return f"argument '{param}' must be one of {', '.join(map(str, enum))}"
+        unknown = args.keys() - known
+        if unknown:
+            return f"unknown argument(s): {', '.join(sorted(unknown))}"
+        return None
+
+    return validate
+
+
+def tool(description, parallel_safe=False, mutating=False, ttl=None, reads_tasks=False, keywords=()):
+    """Register a function as a tool, its schema comes from the signature
+
+    Parameter descriptions are given with Annotated[type, "description"],
+    parameters without a default value are required. Results of tools with a
+    ttl (seconds) are kept in the tool cache, reads_tasks ones until the task
+    store changes. keywords are extra words matched by the tool selection.
+    """
+    def register(function):
+        hints = get_type_hints(function, include_extras=True)
+        parameters = {"type": "object", "properties": {}}
+        required = []
+        for param in inspect.signature(function).parameters.values():
+            parameters["properties"][param.name] = _json_schema(hints[param.name])
+            if param.default is inspect.Parameter.empty:
+                required.append(param.name)
+        if required:
+            parameters["required"] = required
+
+        schema = {
+            "type": "function",
+            "function": {"name": function.__name__, "description": description, "parameters": parameters}
         }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "delete_task_by_objective",
-            "description": "Delete scheduled tasks containing specific objective text",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "objective": {
-                        "type": "string",
-                        "description": "Text to search for in objectives to delete"
-                    }
-                },
-                "required": ["objective"]
+        registered = Tool(function, schema, _compile_validator(function.__name__, parameters), parallel_safe, mutating,
+                          ttl, reads_tasks, keywords)
+        TOOLS[registered.name] = registered
+        tools.append(schema)
+        if parallel_safe:
+            PARALLEL_SAFE_TOOLS.add(registered.name)
+        if mutating:
+            MUTATING_TOOLS.add(registered.name)
+        if reads_tasks:
+            TASK_VIEW_TOOLS.add(registered.name)
+        return function
+    return register
+
+
+def describe_tools(indent=""):
+    """Markdown list of the registered tools for the system prompt"""
+    return "\n".join(f"{indent}- {t.name}: {t.schema['function']['description']}" for t in TOOLS.values())
+
+
+class ToolCache:
+    """Results of tools registered with a ttl, shared by every conversation of the process
+
+    Bounded to max_entries, least recently used first. ttls overrides the
+    ttl given at registration, per tool name. Results of task views are keyed
+    by the store version too, so a write from another process also makes
+    them stale.
+    """
+    def __init__(self, max_entries=1024, ttls=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttls = ttls or {}
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def ttl(self, registered):
+        return self.ttls.get(registered.name, registered.ttl)
+
+    def get(self, key):
+        """Return (hit, result)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, result = entry
+                if expires > self.clock():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, result
+                del self.entries[key]
+                self.expired += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key, result, ttl):
+        with self.lock:
+            self.entries[key] = (self.clock() + ttl, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, names):
+        """Drop the cached results of the given tools"""
+        with self.lock:
+            stale = [key for key in self.entries if key[0] in names]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self.entries),
             }
-        }
-    }
-]
+
+
+_tool_cache = ToolCache()
+
+def get_tool_cache():
+    return _tool_cache
+
+def set_tool_cache(cache):
+    """Replace the tool cache, None disables it"""
+    global _tool_cache
+    _tool_cache = cache
+
+def invalidate_task_views():
+    """Called after every committed write to the task store"""
+    if _tool_cache is not None:
+        _tool_cache.invalidate(TASK_VIEW_TOOLS)
+
+
+_task_store = None
+
+# StagedTaskStore of the unit of work of the current context, see unit_of_work()
+_unit_of_work = contextvars.ContextVar("unit_of_work", default=None)
+
+def get_task_store():
+    """Task store in use, TASK_STORE env var selects the file (a .db path selects SQLite)"""
+    global _task_store
+    staged = _unit_of_work.get()
+    if staged is not None:
+        return staged
+    if _task_store is None:
+        _task_store = open_task_store(os.environ.get("TASK_STORE", TASKS_FILE))
+    return _task_store
+
+def set_task_store(store):
+    global _task_store
+    _task_store = store
+
+@contextmanager
+def unit_of_work():
+    """Stage the task writes of the block and commit them in one write when it exits
+
+    Nothing is written if the block raises. Tool calls submitted to a
+    ToolBatch inside the block join it, a nested block joins the outer one.
+    """
+    if _unit_of_work.get() is not None:
+        yield _unit_of_work.get()
+        return
+    staged = StagedTaskStore(get_task_store())
+    token = _unit_of_work.set(staged)
+    try:
+        yield staged
+    except BaseException:
+        staged.rollback()
+        raise
+    else:
+        if staged.commit():
+            invalidate_task_views()
+    finally:
+        _unit_of_work.reset(token)
 
 def save_task(task_data):
-    """Save scheduled task to JSON file"""
+    """Save scheduled task to the task store"""
     try:
-        # Validate cron expression format
-        cron_parts = task_data["cron_expression"].split()
-        if len(cron_parts) != 5:
-            raise ValueError("Invalid cron expression - must have 5 parts")
-            
-        # Create file if it doesn't exist
-        if not os.path.exists(TASKS_FILE):
-            with open(TASKS_FILE, 'w') as f:
-                json.dump({}, f)
-                
-        # Read existing tasks
-        with open(TASKS_FILE, 'r') as f:
-            tasks = json.load(f)
-            
-        # Add new task
-        cron_expr = task_data["cron_expression"]
-        if cron_expr not in tasks:
-            tasks[cron_expr] = []
-        tasks[cron_expr].extend(task_data["objectives"])
-        
-        # Save updated list
-        with open(TASKS_FILE, 'w') as f:
-            json.dump(tasks, f, indent=2)
+        validate_cron(task_data["cron_expression"])
             
+        get_task_store().add(task_data["cron_expression"], task_data["objectives"])
+        invalidate_task_views()
         return True
     except Exception as e:
-        print(f"Error saving task: {e}")
+        log(f"Error saving task: {e}")
         return False
 
-def list_all_tasks():
-    """Return all tasks in markdown format"""
-    if not os.path.exists(TASKS_FILE):
-        return "No scheduled tasks found"
-    
-    with open(TASKS_FILE, 'r') as f:
-        tasks = json.load(f)
-        
-    if not tasks:
+@tool("Get weather conditions for a specific location", parallel_safe=True, ttl=600,
+      keywords=("temperature", "forecast", "rain", "sunny", "hot", "cold", "climate"))
+def get_weather(location: Annotated[str, "City and country, e.g. Rome, Italy"]):
+    return f"{location}: 24℃"
+
+@tool("Schedule a task using cron expression", mutating=True,
+      keywords=("remind", "reminder", "every", "daily", "weekly", "monthly", "recurring", "add", "create"))
+def schedule_task(
+    cron_expression: Annotated[str, "Cron expression for scheduling (e.g., '0 9 * * 1-5' for weekdays at 9am)"],
+    objectives: Annotated[list[str], "List of objectives to schedule"]
+):
+    try:
+        validate_cron(cron_expression)
+        save_task({"cron_expression": cron_expression, "objectives": objectives})
+        return f"Tasks scheduled with cron expression: {cron_expression}"
+    except Exception as e:
+        return f"Error scheduling task: {str(e)}"
+
+@tool("Delivers final answer to user")
+def final_response(content: Annotated[str, "Final response content"]):
+    return content
+
+# Task listings go into the conversation and are re-sent on every later iteration
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_TOOL_OUTPUT_CHARS = 8000
+
+CronFilter = Annotated[str, "Only the tasks of this cron expression"]
+ContainsFilter = Annotated[str, "Only the tasks whose objective contains this text"]
+Cursor = Annotated[str, "Cursor from the previous page"]
+Limit = Annotated[int, f"Entries per page, at most {MAX_PAGE_SIZE}"]
+View = Annotated[Literal["auto", "summary", "list"],
+                 "summary: task counts per cron group, list: the objectives, "
+                 "auto: summary when the tasks do not fit in one page and no filter is given"]
+
+MARKDOWN_STYLE = {"title": "# Scheduled Tasks\n", "group": "## {cron}", "item": "- {objective}",
+                  "group_end": "", "count": "- {cron}: {count} tasks"}
+PLAIN_STYLE = {"title": None, "group": "Cron: {cron}", "item": " - {objective}",
+               "group_end": None, "count": "Cron: {cron} ({count} tasks)"}
+
+
+def _select_tasks(cron_expression=None, contains=None):
+    """(cron expression, objective) pairs in store order, filtered"""
+    store = get_task_store()
+    if contains:
+        return [row for row in store.search(contains) if not cron_expression or row[0] == cron_expression]
+    if cron_expression:
+        return [(cron_expression, objective) for objective in store.by_cron(cron_expression)]
+    return [(cron_expr, objective) for cron_expr, objectives in store.all().items() for objective in objectives]
+
+
+def _cap(text):
+    if len(text) <= MAX_TOOL_OUTPUT_CHARS:
+        return text
+    return text[:MAX_TOOL_OUTPUT_CHARS] + TRUNCATION_MARKER
+
+
+def _format_tasks(style, cron_expression, contains, cursor, limit, view):
+    """One page of the tasks, as a listing or as counts per cron group"""
+    rows = _select_tasks(cron_expression, contains)
+    if not rows:
         return "No scheduled tasks found"
-        
-    markdown = ["# Scheduled Tasks\n"]
-    for cron_expr, objectives in tasks.items():
-        markdown.append(f"## {cron_expr}")
-        markdown.extend([f"- {obj}" for obj in objectives])
-        markdown.append("")  # Add empty line between groups
-        
-    return "\n".join(markdown)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if view == "auto":
+        filtered = cron_expression or contains or cursor
+        view = "summary" if len(rows) > limit and not filtered else "list"
+    if view == "summary":
+        counts = {}
+        for cron_expr, _ in rows:
+            counts[cron_expr] = counts.get(cron_expr, 0) + 1
+        groups = list(counts.items())
+    # A cursor is the position of the first entry of a page, 0 to the last entry
+    last = len(groups) - 1 if view == "summary" else len(rows) - 1
+    try:
+        offset = int(cursor) if cursor else 0
+    except ValueError:
+        offset = None
+    if offset is None or not 0 <= offset <= last:
+        return f"Error: argument 'cursor' must be a 'Next page' cursor between 0 and {last}, got {cursor!r}"
+
+    lines = [style["title"]] if style["title"] else []
+    size = 0
+    if view == "summary":
+        lines.append(f"{len(rows)} tasks in {len(groups)} cron groups")
+        page = groups[offset:offset + limit]
+        lines.extend(style["count"].format(cron=cron_expr, count=count) for cron_expr, count in page)
+        total, unit, end = len(groups), "cron groups", offset + len(page)
+    else:
+        previous = None
+        end = offset
+        for cron_expr, objective in rows[offset:offset + limit]:
+            entry = [style["item"].format(objective=objective)]
+            if cron_expr != previous:
+                header = [style["group"].format(cron=cron_expr)]
+                if previous is not None and style["group_end"] is not None:
+                    header.insert(0, style["group_end"])
+                entry = header + entry
+            entry_size = sum(len(line) + 1 for line in entry)
+            # Stop at the size cap, the rest is on the next page
+            if end > offset and size + entry_size > MAX_TOOL_OUTPUT_CHARS:
+                break
+            lines.extend(entry)
+            size += entry_size
+            previous = cron_expr
+            end += 1
+        if style["group_end"] is not None:
+            lines.append(style["group_end"])
+        total, unit = len(rows), "tasks"
+
+    if end < total:
+        next_page = {"view": view, "cursor": str(end)}
+        if cron_expression:
+            next_page["cron_expression"] = cron_expression
+        if contains:
+            next_page["contains"] = contains
+        lines.append(f"Showing {unit} {offset + 1}-{end} of {total}. Next page: {json.dumps(next_page)}")
+    return _cap("\n".join(lines))
+
+
+@tool("Get list of scheduled tasks, paginated", parallel_safe=True, ttl=300, reads_tasks=True,
+      keywords=("show", "reminders", "how", "many"))
+def get_scheduled_tasks(cron_expression: CronFilter = None, contains: ContainsFilter = None,
+                        cursor: Cursor = None, limit: Limit = PAGE_SIZE, view: View = "auto"):
+    try:
+        return _format_tasks(PLAIN_STYLE, cron_expression, contains, cursor, limit, view)
+    except Exception as e:
+        return f"Error reading tasks: {str(e)}"
+
+@tool("Get a markdown formatted list of scheduled tasks, paginated", parallel_safe=True, ttl=300, reads_tasks=True,
+      keywords=("show", "all", "reminders"))
+def list_all_tasks(cron_expression: CronFilter = None, contains: ContainsFilter = None,
+                   cursor: Cursor = None, limit: Limit = PAGE_SIZE, view: View = "auto"):
+    """Return the tasks in markdown format, a summary per cron group when there are many"""
+    return _format_tasks(MARKDOWN_STYLE, cron_expression, contains, cursor, limit, view)
 
-def delete_task_by_objective(objective):
+@tool("Delete scheduled tasks containing specific objective text", mutating=True,
+      keywords=("remove", "cancel", "unschedule", "stop", "reminder"))
+def delete_task_by_objective(objective: Annotated[str, "Text to search for in objectives to delete"]):
     """Delete tasks containing the objective text"""
-    if not os.path.exists(TASKS_FILE):
-        return "No scheduled tasks found"
-        
-    with open(TASKS_FILE, 'r') as f:
-        tasks = json.load(f)
-        
-    deleted = False
-    for cron_expr, objectives in list(tasks.items()):
-        # Remove matching objectives
-        original_count = len(objectives)
-        tasks[cron_expr] = [obj for obj in objectives if objective.lower() not in obj.lower()]
-        
-        # If all objectives removed, delete the cron entry
-        if len(tasks[cron_expr]) == 0:
-            del tasks[cron_expr]
-            deleted = True
-        elif len(tasks[cron_expr]) != original_count:
-            deleted = True
-            
-    if deleted:
-        with open(TASKS_FILE, 'w') as f:
-            json.dump(tasks, f, indent=2)
+    if get_task_store().delete_matching(objective):
+        invalidate_task_views()
         return f"Deleted tasks containing: {objective}"
     return f"No tasks found containing: {objective}"
 
+@tool("Preview the scheduled tasks containing specific objective text, nothing is deleted", parallel_safe=True,
+      ttl=300, reads_tasks=True, keywords=("find", "look", "which", "reminder"))
+def search_tasks(objective: Annotated[str, "Text to search for in objectives"]):
+    """Return the tasks delete_task_by_objective would delete, in markdown format"""
+    matches = get_task_store().search(objective)
+    if not matches:
+        return f"No tasks found containing: {objective}"
+
+    grouped = {}
+    for cron_expr, obj in matches:
+        grouped.setdefault(cron_expr, []).append(obj)
+    markdown = [f"# Tasks containing: {objective}\n"]
+    for cron_expr, objectives in grouped.items():
+        markdown.append(f"## {cron_expr}")
+        markdown.extend([f"- {obj}" for obj in objectives])
+        markdown.append("")
+    return "\n".join(markdown)
+
 def handle_tool_call(tool_call):
-    args = json.loads(tool_call.function.arguments)
-    print(f"\n=== Handling {tool_call.function.name} ===")
-    print(f"Arguments: {args}")
-    
-    if tool_call.function.name == "get_weather":
-        return f"{args['location']}: 24℃"
-    
-    if tool_call.function.name == "schedule_task":
+    registered = TOOLS.get(tool_call.function.name)
+    if registered is None:
+        return "Unknown tool"
+
+    try:
+        args = loads(tool_call.function.arguments or "{}")
+    except ValueError as e:
+        return f"Error: invalid JSON arguments for {registered.name}: {e}"
+    log(f"\n=== Handling {registered.name} ===")
+    log(f"Arguments: {args}")
+
+    error = registered.validate(args)
+    if error:
+        return f"Error: invalid arguments for {registered.name}: {error}"
+
+    cache = _tool_cache
+    ttl = cache.ttl(registered) if cache is not None else None
+    if not ttl:
+        return registered.function(**args)
+    # The version is read before the call: a write racing with it leaves the result under the old version
+    if registered.reads_tasks:
+        store = get_task_store()
+        version = (id(store), store.version())
+    else:
+        version = None
+    key = (registered.name, json.dumps(args, sort_keys=True), version)
+    hit, result = cache.get(key)
+    if hit:
+        log(f"Cached result of {registered.name}")
+        return result
+    result = registered.function(**args)
+    cache.put(key, result, ttl)
+    return result
+
+
+class ToolExecutor:
+    """Runs the tool calls of assistant turns on a bounded thread pool"""
+    def __init__(self, max_workers=8, parallel_safe=None, handler=None, metrics=None):
+        self.max_workers = max_workers
+        self.handler = handler or handle_tool_call
+        self.metrics = metrics or NULL_METRICS
+        self.parallel_safe = PARALLEL_SAFE_TOOLS if parallel_safe is None else set(parallel_safe)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+
+    def call(self, tool_call):
+        """Run one tool call, timing it when metrics are enabled"""
+        if not self.metrics.enabled:
+            return self.handler(tool_call)
+        started = time.perf_counter()
         try:
-            task_data = {
-                "cron_expression": args["cron_expression"],
-                "objectives": args["objectives"]
-            }
-            save_task(task_data)
-            return f"Tasks scheduled with cron expression: {args['cron_expression']}"
-        except Exception as e:
-            return f"Error scheduling task: {str(e)}"
-    
-    if tool_call.function.name == "get_scheduled_tasks":
+            return self.handler(tool_call)
+        finally:
+            self.metrics.emit("tool_call", tool=tool_call.function.name, latency=time.perf_counter() - started)
+
+    def batch(self, memo=None):
+        """Start a turn, its ordering constraints are independent of other turns"""
+        return ToolBatch(self, memo)
+
+    def map(self, tool_calls, memo=None):
+        """Run the tool calls and return their results in the original order"""
+        batch = self.batch(memo)
+        futures = [batch.submit(tool_call) for tool_call in tool_calls]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+
+
+class ToolMemo:
+    """Results of parallel-safe tool calls of one conversation, keyed by name and arguments
+
+    Any other tool call may change what they return, it clears the memo.
+    """
+    def __init__(self):
+        self.results = {}
+        self.generation = 0
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(tool_call):
+        arguments = tool_call.function.arguments or "{}"
         try:
-            if os.path.exists(TASKS_FILE):
-                with open(TASKS_FILE, 'r') as f:
-                    tasks = json.load(f)
-                # Format the output for better readability
-                formatted_tasks = []
-                for cron_expr, objectives in tasks.items():
-                    formatted_tasks.append(f"Cron: {cron_expr}")
-                    formatted_tasks.extend([f" - {obj}" for obj in objectives])
-                return "\n".join(formatted_tasks)
-            return "No scheduled tasks found"
-        except Exception as e:
-            return f"Error reading tasks: {str(e)}"
-            
-    if tool_call.function.name == "list_all_tasks":
-        return list_all_tasks()
-        
-    if tool_call.function.name == "delete_task_by_objective":
-        return delete_task_by_objective(args["objective"])
-            
-    return "Unknown tool"
+            arguments = json.dumps(loads(arguments), sort_keys=True)
+        except (TypeError, ValueError):
+            pass
+        return tool_call.function.name, arguments
+
+    def lookup(self, key):
+        """Return (hit, result, generation), generation is passed back to store()"""
+        with self.lock:
+            if key in self.results:
+                self.hits += 1
+                return True, self.results[key], self.generation
+            return False, None, self.generation
+
+    def store(self, key, generation, future):
+        # A call that finished after an invalidation may have read the old state
+        if future.exception() is not None:
+            return
+        with self.lock:
+            if generation == self.generation:
+                self.results[key] = future.result()
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.results.clear()
+
+
+class ToolBatch:
+    """Tool calls of a single assistant turn, memo answers repeated parallel-safe calls"""
+    def __init__(self, executor, memo=None):
+        self.executor = executor
+        self.memo = memo
+        self.pending = []
+        self.barrier = None
+
+    def _run(self, tool_call, dependencies):
+        wait(dependencies)
+        return self.executor.call(tool_call)
+
+    def submit(self, tool_call):
+        """Schedule a tool call and return a future with its result"""
+        executor = self.executor
+        memo = self.memo
+        if memo is not None:
+            if tool_call.function.name not in executor.parallel_safe:
+                memo.invalidate()
+            else:
+                key = memo.key(tool_call)
+                hit, result, generation = memo.lookup(key)
+                if hit:
+                    log(f"\n=== {tool_call.function.name}: same call earlier in the conversation, reusing its result ===")
+                    return _completed_future(lambda: result)
+                future = self._submit(tool_call)
+                future.add_done_callback(lambda f: memo.store(key, generation, f))
+                return future
+        return self._submit(tool_call)
+
+    def _submit(self, tool_call):
+        executor = self.executor
+        if executor.pool is None:
+            future = _completed_future(executor.call, tool_call)
+            self.pending.append(future)
+            return future
+
+        # Worker threads run the call in the submitter's context, e.g. its unit of work
+        context = contextvars.copy_context()
+        if tool_call.function.name in executor.parallel_safe:
+            dependencies = [self.barrier] if self.barrier else []
+            future = executor.pool.submit(context.run, self._run, tool_call, dependencies)
+            self.pending.append(future)
+        else:
+            future = executor.pool.submit(context.run, self._run, tool_call, list(self.pending))
+            self.barrier = future
+            self.pending = [future]
+        return future
+
+
+def _completed_future(fn, *args):
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
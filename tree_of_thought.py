@@ -1,12 +1,97 @@
-from ollama import Client
-from pydantic import BaseModel, Field
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Literal
 from math import sqrt, log
 
+from answers import compare_answers, extract_answer
+from cache import GenerationCache, SampleCounter
+
 self_generator = 'hermes3:8b-llama3.1-q4_K_M'
 discriminator = 'granite3.1-dense:latest'
 
-client = Client(host="http://localhost:11434")
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+
+# Concurrent generate calls per model, the number of requests its Ollama server runs in parallel
+BACKEND_CONCURRENCY = {
+    self_generator: int(os.environ.get("GENERATOR_CONCURRENCY", os.environ.get("OLLAMA_NUM_PARALLEL", 4))),
+    discriminator: int(os.environ.get("DISCRIMINATOR_CONCURRENCY", os.environ.get("OLLAMA_NUM_PARALLEL", 4))),
+}
+
+# Distinct completions of a masked trajectory, more simulations of it reuse them
+COMPLETION_SAMPLES = 3
+
+# ollama and pydantic are imported on first use, they take most of the import time
+client = None
+
+# Generations are kept in memory, and on disk when TOT_CACHE_DIR is set, None disables the cache
+generation_cache = GenerationCache(directory=os.environ.get("TOT_CACHE_DIR"))
+
+# Guards the tree structure and the node statistics when workers search concurrently,
+# held only for bookkeeping, never during a generate call
+tree_lock = threading.RLock()
+
+# Decide check_consistency from the final numbers when both answers have a clear one
+RULE_BASED_CONSISTENCY = True
+
+# check_consistency decisions, "rule_based" ones did not call the discriminator
+consistency_checks = {"rule_based": 0, "llm": 0}
+
+_backend_slots = {}
+_call_pool = None
+_pool_lock = threading.Lock()
+
+def get_client():
+    global client
+    if client is None:
+        from ollama import Client
+        client = Client(host=OLLAMA_HOST)
+    return client
+
+def _backend_slot(model):
+    with _pool_lock:
+        if model not in _backend_slots:
+            _backend_slots[model] = threading.BoundedSemaphore(BACKEND_CONCURRENCY.get(model, 1))
+        return _backend_slots[model]
+
+def _generate(model, **kwargs):
+    with _backend_slot(model):
+        return get_client().generate(model=model, **kwargs)
+
+def generate(model, prompt, format=None, samples=None, counter=None):
+    """client.generate through the generation cache, waiting for a free slot of the model's backend"""
+    if generation_cache is None:
+        return _generate(model, prompt=prompt, **({"format": format} if format is not None else {}))
+    return generation_cache.generate(_generate, model, prompt, format, samples=samples, counter=counter)
+
+def get_call_pool():
+    """Threads running the generate calls of parallel searches, the backend slots bound them"""
+    global _call_pool
+    with _pool_lock:
+        if _call_pool is None:
+            _call_pool = ThreadPoolExecutor(max_workers=sum(BACKEND_CONCURRENCY.values()))
+        return _call_pool
+
+def _define_models():
+    from pydantic import BaseModel, Field
+
+    class SubQuestionAnswer(BaseModel):
+        response: str = Field(description="Let's think step by step.")
+
+    class ConsistencyCheck(BaseModel):
+        text_response: str = Field(description="Explain why they are consistent.")
+        result: bool = Field(description="True if consistent false if not.")
+
+    globals().update(SubQuestionAnswer=SubQuestionAnswer, ConsistencyCheck=ConsistencyCheck)
+
+def __getattr__(name):
+    if name in ("SubQuestionAnswer", "ConsistencyCheck"):
+        _define_models()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _model(name):
+    return globals().get(name) or __getattr__(name)
 
 def extract_steps(text):
     # Dividi il testo in righe
@@ -137,9 +222,6 @@ answer_sub_question = """### Instruction: There are 15 trees in the grove. Grove
 ### Instruction: {user_question}
 ### Response:"""
 
-class SubQuestionAnswer(BaseModel):
-    response: str = Field(description="Let's think step by step.")
-
 check_consistency = """You are a consistency checker. Your task is to evaluate whether two different answers to the same question lead to the same final numerical result, regardless of their reasoning path. You should focus only on the final numerical answers.
 
 For each case, analyze the question and both answers, then state if they are consistent (lead to the same result) or not. 
@@ -178,9 +260,52 @@ Now check if the following answers are consistent:
 ### First answer: {first_answer}
 ### Second answer: {second_answer}"""
 
-class ConsistencyCheck(BaseModel):
-    text_response: str = Field(description="Explain why they are consistent.")
-    result: bool = Field(description="True if consistent false if not.")
+def propose_steps(question, previous_steps, counter=None):
+    """Generator rollout after the steps so far, returns the new steps"""
+    trajectory_prompt = ""
+    for i in range(len(previous_steps)):
+        trajectory_prompt += f"\nStep {i+1}: {previous_steps[i]}"
+
+    print(f"Rolling out trajectory for: {question}{trajectory_prompt}")
+    text_trajectory = generate(
+        self_generator,
+        prompt=propose_one_step_thought.format(user_question=question) + trajectory_prompt,
+        counter=counter
+    ).response
+    return extract_steps(text_trajectory)
+
+def complete_masked_steps(initial_query, text_trajectory, counter=None):
+    """Discriminator answer to the query given the first steps of a trajectory"""
+    masked_trajectory = mask_trajectory(text_trajectory)
+    mask = answer_sub_question.format(user_question=initial_query) + " " + " ".join(masked_trajectory)
+
+    question_answer = generate(
+        discriminator,
+        prompt=mask,
+        format=_model("SubQuestionAnswer").model_json_schema(),
+        samples=COMPLETION_SAMPLES,
+        counter=counter
+    )
+    question_answer = _model("SubQuestionAnswer").model_validate_json(question_answer.response)
+    return question_answer.response
+
+def judge_consistency(initial_query, first_answer, second_answer) -> "ConsistencyCheck":
+    result = compare_answers(first_answer, second_answer) if RULE_BASED_CONSISTENCY else None
+    with tree_lock:
+        consistency_checks["llm" if result is None else "rule_based"] += 1
+    if result is not None:
+        return _model("ConsistencyCheck")(text_response="Compared the final numbers of both answers.",
+                                          result=result)
+
+    consistency_check = generate(
+        discriminator,
+        prompt=check_consistency.format(user_question=initial_query, first_answer=first_answer, second_answer=second_answer),
+        format=_model("ConsistencyCheck").model_json_schema(),
+        # A verdict, not a sample: the same pair gets the same answer
+        samples=1
+    )
+    consistency_check = _model("ConsistencyCheck").model_validate_json(consistency_check.response)
+    return consistency_check
 
 class Node:
     def __init__(self, parent=None):
@@ -190,11 +315,17 @@ class Node:
         self.step: str | None = None
         self.visit_count: int = 0
         self.consistency_score: float = 0
+        # Searches in progress below this node, each one counts as a visit that lost
+        self.virtual_loss: int = 0
 
     def get_root(self):
         if self.parent: return self.parent.get_root()
         return self
 
+    def sample_counter(self):
+        # Set by Tree: each search numbers its repeated requests from 0 and replays cached runs
+        return getattr(self.get_root(), "samples", None)
+
     def get_leaf_nodes(self):
         if len(self.child) == 0: return [self]
         leaf_nodes = []
@@ -206,24 +337,42 @@ class Node:
         if self.parent: return [self, *self.parent.get_trajectory()]
         return [self]
 
+    def is_terminal(self):
+        # Rollouts run to the final answer, a leaf holding one is not expanded again
+        return not self.child and self.parent is not None and extract_answer(self.step) is not None
+
+    def last_step(self):
+        current = self
+        while current.child:
+            current = current.child[-1]
+        return current
+
     def update_visit_count(self):
         current = self
         while current:
             current.visit_count += 1
             current = current.parent
 
+    def add_virtual_loss(self, amount=1):
+        current = self
+        while current:
+            current.virtual_loss += amount
+            current = current.parent
+
     def uct_score(self, exploration_constant=sqrt(2)):
-        if self.visit_count == 0:
+        # The virtual loss steers concurrent workers away from the branches already being searched
+        visits = self.visit_count + self.virtual_loss
+        if visits == 0:
             return float('inf')
     
         # Vi/Ni: termine di sfruttamento (exploitation)
-        exploitation = self.consistency_score / self.visit_count
+        exploitation = (self.consistency_score - self.virtual_loss) / visits
         
         # Calcola N (visite totali del genitore)
-        parent_visits = self.parent.visit_count if self.parent else 1
+        parent_visits = self.parent.visit_count + self.parent.virtual_loss if self.parent else 1
         
         # C * √(ln(N)/Ni): termine di esplorazione (exploration)
-        exploration = exploration_constant * sqrt(log(parent_visits) / self.visit_count)
+        exploration = exploration_constant * sqrt(log(max(parent_visits, 1)) / visits)
         
         return exploitation + exploration
 
@@ -231,20 +380,15 @@ class Node:
         if len(self.child) > 0: return max(self.child, key=lambda node: node.uct_score())
         return self
 
-    def rollout_step_by_step(self):
+    def attach(self, first_node):
+        with tree_lock:
+            self.child.append(first_node)
+
+    def propose_trajectory(self):
+        """Generate the next steps, returns the first one without adding it to the tree"""
         current_node_trajectory = self.get_trajectory()[::-1]
         current_text_trajectory = [n.step for n in current_node_trajectory if n.step]
-        current_text_trajectory = current_text_trajectory[1:]
-        trajectory_prompt = ""
-        for i in range(len(current_text_trajectory)):
-            trajectory_prompt += f"\nStep {i+1}: {current_text_trajectory[i]}"
-
-        print(f"Rolling out trajectory for: {self.step}{trajectory_prompt}")
-        text_trajectory = client.generate(
-            model=self_generator,
-            prompt=propose_one_step_thought.format(user_question=self.step) + trajectory_prompt
-        ).response
-        text_trajectory = extract_steps(text_trajectory)
+        text_trajectory = propose_steps(self.get_root().step, current_text_trajectory[1:], self.sample_counter())
 
         first_node = Node(self)
         first_node.step = text_trajectory[0]
@@ -257,80 +401,205 @@ class Node:
             node_trajectory[-1].child.append(new_node)
             node_trajectory.append(new_node)
 
-        self.child.append(first_node)
+        return first_node
 
     def complete_steps(self):
-        initial_query = self.get_root().step
         current_node_trajectory = self.get_trajectory()[::-1]
         current_text_trajectory = [n.step for n in current_node_trajectory if n.step]
-        masked_trajectory = mask_trajectory(current_text_trajectory)
-        mask = answer_sub_question.format(user_question=initial_query) + " " + " ".join(masked_trajectory)
-
-        question_answer = client.generate(
-            model=discriminator,
-            prompt=mask,
-            format=SubQuestionAnswer.model_json_schema()
-        )
-        question_answer = SubQuestionAnswer.model_validate_json(question_answer.response)
-        return question_answer.response
-
-    def check_consistency(self, trajectory) -> ConsistencyCheck:
-        initial_query = self.get_root().step
-        consistency_check = client.generate(
-            model=discriminator,
-            prompt=check_consistency.format(user_question=initial_query, first_answer=self.step, second_answer=trajectory),
-            format=ConsistencyCheck.model_json_schema()
-        )
-        consistency_check = ConsistencyCheck.model_validate_json(consistency_check.response)
-        return consistency_check
-
-    def expand(self, rounds=3):
-        for _ in range(rounds): self.rollout_step_by_step()
-
-    def simulate(self, rounds=3):
+        return complete_masked_steps(self.get_root().step, current_text_trajectory, self.sample_counter())
+
+    def check_consistency(self, trajectory) -> "ConsistencyCheck":
+        return judge_consistency(self.get_root().step, self.step, trajectory)
+
+    def expand(self, rounds=3, pool=None):
+        """Add `rounds` rollouts below this node, returns the last step of each one"""
+        # Taken before attaching, once in the tree a concurrent round may extend a rollout
+        last_steps = []
+        if pool is None:
+            for _ in range(rounds):
+                first_node = self.propose_trajectory()
+                last_steps.append(first_node.last_step())
+                self.attach(first_node)
+            return last_steps
+        # Children are attached in submission order, whatever order the generations finish in
+        for future in [pool.submit(self.propose_trajectory) for _ in range(rounds)]:
+            first_node = future.result()
+            last_steps.append(first_node.last_step())
+            self.attach(first_node)
+        return last_steps
+
+    def simulation_round(self):
+        """Complete the masked trajectory and check it agrees with this candidate"""
+        return self.check_consistency(self.complete_steps()).result
+
+    def record_simulation(self, results):
+        with tree_lock:
+            for round, result in enumerate(results):
+                print(f"Consistency {round}: {result}")
+
+                if result: self.consistency_score += 1
+                else: self.consistency_score -= 1
+
+    def backpropagate(self, results):
+        """Count the simulations as visits of this node and its ancestors, O(depth)"""
+        for round, result in enumerate(results):
+            print(f"Consistency {round}: {result}")
+        score = sum(1 if result else -1 for result in results)
+        with tree_lock:
+            current = self
+            while current:
+                current.visit_count += len(results)
+                current.consistency_score += score
+                current = current.parent
+
+    def simulation_results(self, rounds=3, pool=None):
         print(f"Candidate solution: {self.step}")
 
-        for round in range(rounds):
-            rollout_result = self.complete_steps()
+        if pool is None:
+            return [self.simulation_round() for _ in range(rounds)]
+        futures = [pool.submit(self.simulation_round) for _ in range(rounds)]
+        return [future.result() for future in futures]
 
-            rollout_consistency = self.check_consistency(rollout_result)
-            print(f"Consistency {round}: {rollout_consistency.result}")
-
-            if rollout_consistency.result: self.consistency_score += 1
-            else: self.consistency_score -= 1
+    def simulate(self, rounds=3, pool=None):
+        self.record_simulation(self.simulation_results(rounds, pool))
 
 
 class Tree:
-    def __init__(self, query):
+    """MCTS over reasoning steps
+
+    A round descends from the root by UCT while the node has all the
+    children it may have, `width` or the square root of its visits when
+    more, adds rollouts to the node it stops at and simulates the candidate
+    answer each of them ends with. A simulation result is counted once, on
+    the path from its leaf to the root, and the search answers with the end
+    of the most visited path. A final answer reached by the descent is
+    simulated again instead of expanded. With legacy=True rounds select one
+    level below the root, add the leaf scores of the selected node to its
+    children and the best leaf is the one with the best score per visit.
+
+    With workers > 1, search() runs that many rounds at a time: each one
+    selects a node under a virtual loss so the others pick different
+    branches, and the generate calls of all rounds share a pool bounded by
+    BACKEND_CONCURRENCY. Selection and backpropagation hold tree_lock, so
+    every round updates the statistics as if it ran alone.
+    """
+    def __init__(self, query, workers=1, width=3, legacy=False):
         self.root: Node = Node()
         self.root.step = query
+        self.root.samples = SampleCounter()
+        self.workers = workers
+        self.width = width
+        self.legacy = legacy
+
+    def child_limit(self, node):
+        # Progressive widening: a node visited often enough gets more children than `width`
+        return max(self.width, int(sqrt(node.visit_count)))
+
+    def select(self):
+        node = self.root
+        while len(node.child) >= self.child_limit(node):
+            node = node.select_best_child()
+        return node
 
     def mcts_round(self):
+        if self.legacy:
+            return self.legacy_round()
+        pool = get_call_pool() if self.workers > 1 else None
+
         print("\nSelection")
-        selected_node = self.root.select_best_child()
+        with tree_lock:
+            selected_node = self.select()
+            selected_node.add_virtual_loss()
+            # Concurrent rounds on the same node add one rollout each at least
+            rollouts = max(self.child_limit(selected_node) - len(selected_node.child), 1)
         print(f"\nSelected: {selected_node.step}")
 
-        print("\nExpansion")
-        selected_node.expand()
-
-        print("\nSimulation")
-        leaf_nodes = selected_node.get_leaf_nodes()
-        for i, leaf in enumerate(leaf_nodes):
-            print(f"\nCandidate Solution {i+1}:")
-            leaf.simulate()
+        try:
+            if selected_node.is_terminal():
+                leaf_nodes = [selected_node]
+            else:
+                print("\nExpansion")
+                leaf_nodes = selected_node.expand(rollouts, pool=pool)
+
+            print("\nSimulation")
+            if pool is None:
+                results = [leaf.simulation_results() for leaf in leaf_nodes]
+            else:
+                futures = [[pool.submit(leaf.simulation_round) for _ in range(3)] for leaf in leaf_nodes]
+                results = [[future.result() for future in rounds] for rounds in futures]
+
+            print("\nBackpropagation")
+            for i, (leaf, leaf_results) in enumerate(zip(leaf_nodes, results)):
+                print(f"\nCandidate Solution {i+1}: {leaf.step}")
+                leaf.backpropagate(leaf_results)
+        finally:
+            with tree_lock:
+                selected_node.add_virtual_loss(-1)
+
+    def legacy_round(self):
+        pool = get_call_pool() if self.workers > 1 else None
 
-        print("\nBackpropagation")
-        new_nodes = selected_node.child
+        print("\nSelection")
+        with tree_lock:
+            selected_node = self.root.select_best_child()
+            selected_node.add_virtual_loss()
+        print(f"\nSelected: {selected_node.step}")
 
-        for child in new_nodes:
-            child_leaf = child.get_leaf_nodes()
-            for leaf in child_leaf: 
-                leaf.update_visit_count()
-                child.consistency_score += leaf.consistency_score
-            print(f"\nStep: {child.step}")
-            print(f"UCT score: {child.uct_score()}")
+        try:
+            print("\nExpansion")
+            selected_node.expand(pool=pool)
+
+            print("\nSimulation")
+            with tree_lock:
+                leaf_nodes = selected_node.get_leaf_nodes()
+            if pool is None:
+                for i, leaf in enumerate(leaf_nodes):
+                    print(f"\nCandidate Solution {i+1}:")
+                    leaf.simulate()
+            else:
+                # Every simulation of every leaf is queued at once
+                futures = [[pool.submit(leaf.simulation_round) for _ in range(3)] for leaf in leaf_nodes]
+                for i, (leaf, rounds) in enumerate(zip(leaf_nodes, futures)):
+                    print(f"\nCandidate Solution {i+1}: {leaf.step}")
+                    leaf.record_simulation([future.result() for future in rounds])
+
+            print("\nBackpropagation")
+            with tree_lock:
+                new_nodes = selected_node.child
+
+                for child in new_nodes:
+                    child_leaf = child.get_leaf_nodes()
+                    for leaf in child_leaf: 
+                        leaf.update_visit_count()
+                        child.consistency_score += leaf.consistency_score
+                    print(f"\nStep: {child.step}")
+                    print(f"UCT score: {child.uct_score()}")
+        finally:
+            with tree_lock:
+                selected_node.add_virtual_loss(-1)
+
+    def search(self, rounds=3):
+        """Run rounds of MCTS, up to `workers` at a time, and return the best leaf"""
+        if self.workers == 1:
+            for _ in range(rounds): self.mcts_round()
+            return self.get_best_leaf()
+        # An empty root is the only choice of every worker, expand it once first
+        if not self.root.child:
+            self.mcts_round()
+            rounds -= 1
+        with ThreadPoolExecutor(max_workers=self.workers) as workers:
+            for future in [workers.submit(self.mcts_round) for _ in range(rounds)]:
+                future.result()
+        return self.get_best_leaf()
 
     def get_best_leaf(self):
+        if not self.legacy:
+            # The most visited path: visit counts follow the search and are steadier than the ratio of one leaf
+            node = self.root
+            while node.child:
+                node = max(node.child, key=lambda child: (child.visit_count, child.consistency_score))
+            return node
+
         # Prendi tutte le foglie
         leaf_nodes = self.root.get_leaf_nodes()
         
@@ -342,12 +611,13 @@ class Tree:
 
 
 
-test_query = "When I was 6 my sister was 3. Now I'm 56 how old is my sister?"
-
-tree = Tree(test_query)
-for _ in range(3): tree.mcts_round()
+if __name__ == "__main__":
+    test_query = "When I was 6 my sister was 3. Now I'm 56 how old is my sister?"
 
-best_solution = tree.get_best_leaf()
-print(f"\n\nBest solution:")
-print(f"Score: {best_solution.uct_score()}")
-print(best_solution.step)
\ No newline at end of file
+    tree = Tree(test_query, workers=int(os.environ.get("MCTS_WORKERS", 1)))
+    best_solution = tree.search(3)
+    print(f"\n\nBest solution:")
+    print(f"Score: {best_solution.uct_score()}")
+    print(best_solution.step)
+    if generation_cache is not None:
+        print(f"Generation cache: {generation_cache.stats()}")